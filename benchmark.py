@@ -0,0 +1,304 @@
+from collect_info import ProductParser
+from link_collect import LinkCollector
+from extraction import ExtractionEngine, parse_document
+from selector_registry import SelectorRegistry
+from js_extract import extract_product, extract_card_links
+from bs4 import BeautifulSoup
+import contextlib
+import tracemalloc
+import subprocess
+import argparse
+import shutil
+import json
+import time
+import sys
+import io
+import os
+
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+EXPECTED_FILE = os.path.join(FIXTURES_DIR, "expected.json")
+BASELINE_FILE = os.path.join(FIXTURES_DIR, "benchmark_baseline.json")
+JS_DOM_SHIM = os.path.join(os.path.dirname(os.path.abspath(__file__)), "js_dom_shim.js")
+
+# Страницы, чье дерево браузер чинит по HTML5 иначе, чем html.parser: в Chrome эти поля с эталоном не сравниваем
+BROWSER_REPAIRED_FIELDS = {
+    'malformed_nesting.html': ('description', 'seller_name'),
+}
+
+# Поле карточки и метод ProductParser, который его извлекает
+PRODUCT_EXTRACTORS = [
+    ('name', 'get_product_name'),
+    ('price', 'get_product_price'),
+    ('rating', 'get_product_rating'),
+    ('reviews_count', 'get_reviews_count'),
+    ('description', 'get_product_description'),
+    ('images', 'get_product_images'),
+    ('characteristics', 'get_characteristics'),
+    ('seller', 'get_seller_info'),
+]
+
+
+def load_corpus(kind):
+    """Загружаем сохраненные страницы: search или product"""
+    folder = os.path.join(FIXTURES_DIR, kind)
+    corpus = []
+    for filename in sorted(os.listdir(folder)):
+        if filename.endswith(".html"):
+            with open(os.path.join(folder, filename), 'r', encoding='utf-8') as f:
+                corpus.append((filename, f.read()))
+    return corpus
+
+
+class ParserBenchmark:
+    """Прогон сохраненных страниц через извлечение ссылок и все get_* методы"""
+
+    def __init__(self, rounds=5):
+        self.rounds = rounds
+        self.search_pages = load_corpus("search")
+        self.product_pages = load_corpus("product")
+        self.collector = LinkCollector(start_driver=False)
+        # У каждого парсера свой реестр: пропуски селекторов одного не должны влиять на другой
+        self.soup_parser = ProductParser(start_driver=False, extractor="soup",
+                                         selector_registry=SelectorRegistry())
+        self.compiled_parser = ProductParser(start_driver=False, extractor="compiled",
+                                             selector_registry=SelectorRegistry())
+
+    def measure(self, pages_count, func):
+        """Время и пиковая память на прогон всех страниц rounds раз"""
+        tracemalloc.start()
+        started = time.perf_counter()
+        # Экстракторы печатают в stdout, в замер это попадать не должно
+        with contextlib.redirect_stdout(io.StringIO()):
+            for _ in range(self.rounds):
+                func()
+        elapsed = time.perf_counter() - started
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        total_pages = pages_count * self.rounds
+        return {
+            'pages_per_sec': round(total_pages / elapsed, 1) if elapsed else 0.0,
+            'ms_per_page': round(elapsed * 1000 / total_pages, 3),
+            'peak_memory_kb': round(peak / 1024, 1),
+        }
+
+    def bench_links(self):
+        def run():
+            for _, html in self.search_pages:
+                self.collector.extract_links_from_page(html)
+        return self.measure(len(self.search_pages), run)
+
+    def bench_product_pages(self, parser):
+        def run():
+            for _, html in self.product_pages:
+                parser.parse_product_page(html)
+        return self.measure(len(self.product_pages), run)
+
+    def bench_fields(self):
+        """Время каждого get_* метода на уже разобранном дереве"""
+        soups = [BeautifulSoup(html, 'html.parser') for _, html in self.product_pages]
+        timings = {}
+
+        def parse_trees():
+            for _, html in self.product_pages:
+                BeautifulSoup(html, 'html.parser')
+        timings['soup_parse'] = self.measure(len(self.product_pages), parse_trees)['ms_per_page']
+
+        for field, method_name in PRODUCT_EXTRACTORS:
+            method = getattr(self.soup_parser, method_name)
+
+            def run():
+                for soup in soups:
+                    method(soup)
+            timings[field] = self.measure(len(soups), run)['ms_per_page']
+        return timings
+
+    def snapshot(self):
+        """Значения, извлеченные из корпуса: для проверки, что оптимизации ничего не поменяли"""
+        with contextlib.redirect_stdout(io.StringIO()):
+            return {
+                'search': {name: self.collector.extract_links_from_page(html) for name, html in self.search_pages},
+                'product': {name: self.soup_parser.parse_product_page(html) for name, html in self.product_pages},
+            }
+
+    def run(self):
+        """Полный прогон, возвращает отчет"""
+        return {
+            'rounds': self.rounds,
+            'links': self.bench_links(),
+            'product_soup': self.bench_product_pages(self.soup_parser),
+            'product_compiled': self.bench_product_pages(self.compiled_parser),
+            'fields_ms_per_page': self.bench_fields(),
+        }
+
+    def check_values(self, expected):
+        """Сравниваем извлеченные значения обоими движками с эталоном"""
+        problems = []
+        current = self.snapshot()
+        for name, links in expected.get('search', {}).items():
+            if current['search'].get(name) != links:
+                problems.append(f"ссылки изменились: search/{name}")
+
+        engine = ExtractionEngine()
+        for name, html in self.product_pages:
+            reference = expected.get('product', {}).get(name)
+            if reference is None:
+                continue
+            if current['product'].get(name) != reference:
+                problems.append(f"значения изменились (soup): product/{name}")
+            if engine.extract(html) != reference:
+                problems.append(f"значения изменились (compiled): product/{name}")
+        return problems
+
+
+def dom_tree(element):
+    """Дерево lxml в JSON для js_dom_shim.js: элементы и текст, без комментариев"""
+    node = {'tag': element.tag, 'attrs': dict(element.attrib), 'children': []}
+    if element.text:
+        node['children'].append(element.text)
+    for child in element:
+        if isinstance(child.tag, str):
+            node['children'].append(dom_tree(child))
+        if child.tail:
+            node['children'].append(child.tail)
+    return node
+
+
+class NodeDomDriver:
+    """Замена драйвера для execute_script: скрипт выполняется в node над деревом страницы из parse_document"""
+
+    def __init__(self, html):
+        self.tree = dom_tree(parse_document(html))
+
+    def execute_script(self, script, *args):
+        payload = json.dumps({'tree': self.tree, 'script': script, 'args': list(args)}, ensure_ascii=False)
+        result = subprocess.run(["node", JS_DOM_SHIM], input=payload, capture_output=True, text=True,
+                                encoding='utf-8')
+        if result.returncode:
+            raise RuntimeError(result.stderr.strip())
+        return json.loads(result.stdout)
+
+
+class ChromePageDriver:
+    """Сохраненная страница, открытая в настоящем Chrome из пула"""
+
+    def __init__(self, driver, path):
+        self.driver = driver
+        driver.get("file://" + path)
+
+    def execute_script(self, script, *args):
+        return self.driver.execute_script(script, *args)
+
+
+def check_js(expected, browser="node"):
+    """PRODUCT_SCRIPT и LINKS_SCRIPT на сохраненных страницах против эталона: в node или в Chrome"""
+    problems = []
+    pool = None
+    if browser == "chrome":
+        from driver_factory import get_shared_driver_pool
+
+        pool = get_shared_driver_pool()
+        driver = pool.acquire()
+    try:
+        for kind in ("search", "product"):
+            for name, html in load_corpus(kind):
+                reference = expected.get(kind, {}).get(name)
+                if reference is None:
+                    continue
+                if pool:
+                    page = ChromePageDriver(driver, os.path.join(FIXTURES_DIR, kind, name))
+                else:
+                    page = NodeDomDriver(html)
+                if kind == "search":
+                    if extract_card_links(page) != reference:
+                        problems.append(f"ссылки изменились (js): search/{name}")
+                    continue
+                values = extract_product(page, SelectorRegistry())
+                skipped = BROWSER_REPAIRED_FIELDS.get(name, ()) if pool else ()
+                changed = [field for field in reference if field not in skipped and values.get(field) != reference[field]]
+                if changed:
+                    problems.append(f"значения изменились (js): product/{name}: {', '.join(changed)}")
+    finally:
+        if pool:
+            pool.release(driver)
+            pool.close()
+    return problems
+
+
+def check_throughput(report, baseline, tolerance):
+    """Падение скорости больше допуска относительно сохраненного замера"""
+    problems = []
+    for stage in ('links', 'product_soup', 'product_compiled'):
+        if stage not in baseline:
+            continue
+        was = baseline[stage]['pages_per_sec']
+        now = report[stage]['pages_per_sec']
+        if was and now < was * (1 - tolerance):
+            problems.append(f"{stage}: {now} стр/с против {was} стр/с в эталоне")
+    return problems
+
+
+def print_report(report):
+    """Вывод отчета бенчмарка"""
+    print(f"Прогонов корпуса: {report['rounds']}")
+    for stage, title in (('links', 'Ссылки из поиска'), ('product_soup', 'Карточки, BeautifulSoup'),
+                         ('product_compiled', 'Карточки, compiled')):
+        stats = report[stage]
+        print(f"{title}: {stats['pages_per_sec']} стр/с, {stats['ms_per_page']} мс/стр, "
+              f"пик памяти {stats['peak_memory_kb']} КБ")
+    print("Время по полям (мс на страницу):")
+    for field, ms in report['fields_ms_per_page'].items():
+        print(f"  {field}: {ms}")
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Бенчмарк парсеров на сохраненных страницах")
+    arg_parser.add_argument("--rounds", type=int, default=5)
+    arg_parser.add_argument("--check", action="store_true",
+                            help="Режим регрессии: ошибка, если упала скорость или изменились значения")
+    arg_parser.add_argument("--tolerance", type=float, default=0.3,
+                            help="Допустимое падение скорости относительно эталона")
+    arg_parser.add_argument("--save-baseline", action="store_true",
+                            help="Сохранить текущую скорость как эталон для этой машины")
+    arg_parser.add_argument("--update-expected", action="store_true",
+                            help="Перезаписать эталонные значения извлечения")
+    arg_parser.add_argument("--js", choices=["node", "chrome", "off"], default="node",
+                            help="Где в режиме --check выполнять скрипты js_extract: node с js_dom_shim.js, "
+                                 "настоящий Chrome или не проверять")
+    args = arg_parser.parse_args()
+
+    benchmark = ParserBenchmark(rounds=args.rounds)
+
+    if args.update_expected:
+        with open(EXPECTED_FILE, 'w', encoding='utf-8') as f:
+            json.dump(benchmark.snapshot(), f, ensure_ascii=False, indent=2)
+        print(f"Эталонные значения сохранены в {EXPECTED_FILE}")
+
+    report = benchmark.run()
+    print_report(report)
+
+    if args.save_baseline:
+        with open(BASELINE_FILE, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"Эталон скорости сохранен в {BASELINE_FILE}")
+
+    if args.check:
+        with open(EXPECTED_FILE, 'r', encoding='utf-8') as f:
+            expected = json.load(f)
+        problems = benchmark.check_values(expected)
+        if args.js == "node" and not shutil.which("node"):
+            print("node не найден, скрипты js_extract не проверяются")
+        elif args.js != "off":
+            problems += check_js(expected, browser=args.js)
+        if os.path.exists(BASELINE_FILE):
+            with open(BASELINE_FILE, 'r', encoding='utf-8') as f:
+                problems += check_throughput(report, json.load(f), args.tolerance)
+        else:
+            print("Эталон скорости не найден, проверяем только значения")
+
+        if problems:
+            print("Регрессия:")
+            for problem in problems:
+                print(f"  - {problem}")
+            sys.exit(1)
+        print("Регрессий нет")
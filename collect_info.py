@@ -1,143 +1,431 @@
-from webdriver_manager.chrome import ChromeDriverManager
-from selenium.webdriver.chrome.service import Service
-from selenium import webdriver
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
-from selenium.webdriver.chrome.options import Options
+from selenium.common.exceptions import TimeoutException
 from bs4 import BeautifulSoup
-import pandas as pd
+from http_fetch import HttpFetcher, get_shared_fallback_guard
+from extraction import ExtractionEngine, FIELD_SELECTORS
+from selector_registry import get_shared_selector_registry
+from js_extract import extract_product
+from rate_limit import get_shared_scheduler, looks_blocked
+from driver_factory import get_shared_driver_pool, LOAD_PROFILES
+from page_cache import PageCache
+from crawl_state import CrawlState, articul_from_url
+from exporters import StreamingExporter, SINKS
+from normalize import load_filter_rules
+from product_record import ProductRecord
+from metrics import get_metrics, add_observability_arguments, start_observability, finish_observability
+from image_downloader import ImageDownloader
+from incremental import ChangeTracker, change_row, UNCHANGED
+from failures import (get_shared_failure_log, classify_exception, RetryPolicy,
+                      BLOCKED, REDIRECT, PARSE_ERROR, NOT_CACHED, ERROR)
+import argparse
 import json
 import time
 import re
-import random
+import logging
+
+
+logger = logging.getLogger(__name__)
+metrics = get_metrics()
 
 
 class ProductParser:
-    def __init__(self):
+    def __init__(self, backend="selenium", http_workers=8, start_driver=True, scheduler=None,
+                 extractor="compiled", cache=None, driver_pool=None, tracker=None,
+                 selector_registry=None, failure_log=None):
         self.driver = None
-        self.setup_driver()
+        self.driver_pool = driver_pool or get_shared_driver_pool()
+        self.fetcher = None
+        self.http_guard = None
+        self.backend = backend
+        self.scheduler = scheduler or get_shared_scheduler()
+        self.cache = cache
+        # Вид каждой неудачи по ссылке: по нему решается, повторять ли ссылку и когда
+        self.failures = failure_log or get_shared_failure_log()
+        # Инкрементальный обход: неизменившиеся страницы не разбираем
+        self.tracker = tracker
+        # Порядок запасных селекторов по частоте срабатываний, общий для потоков и запусков
+        self.selectors = selector_registry or get_shared_selector_registry()
+        # compiled - все поля за один проход lxml, soup - исходные get_* на BeautifulSoup,
+        # js - в браузере поля считает скрипт, html из HTTP и кэша разбирается как в compiled
+        self.extractor = extractor
+        self.engine = ExtractionEngine(registry=self.selectors) if extractor in ("compiled", "js") else None
+
+        if backend == "http":
+            # Браузер поднимается только если странице понадобится JS
+            self.fetcher = HttpFetcher(max_workers=http_workers, scheduler=self.scheduler)
+            self.http_guard = get_shared_fallback_guard()
+        elif start_driver and not (cache and cache.cache_only):
+            self.setup_driver()
 
     def setup_driver(self):
-        """Настройка Chrome драйвера"""
-        chrome_options = Options()
-        chrome_options.add_argument("--no-sandbox")
-        chrome_options.add_argument("--disable-dev-shm-usage")
-        chrome_options.add_argument("--disable-blink-features=AutomationControlled")
-        chrome_options.add_experimental_option("excludeSwitches", ["enable-automation"])
-        chrome_options.add_experimental_option('useAutomationExtension', False)
-        chrome_options.add_argument(
-            "--user-agent=Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36")
-
-        service = Service(ChromeDriverManager().install())
-        self.driver = webdriver.Chrome(service=service, options=chrome_options)
+        """Настройка Chrome драйвера: прогретый из общего пула или новый"""
+        self.driver = self.driver_pool.acquire()
 
     def load_links_from_file(self, filename="product_links.json"):
         """Загружаем ссылки из файла"""
         try:
             with open(filename, 'r', encoding='utf-8') as f:
                 links = json.load(f)
-            print(f"Загружено {len(links)} ссылок из файла {filename}")
+            logger.info(f"Загружено {len(links)} ссылок из файла {filename}")
             return links
         except Exception as e:
-            print(f"Ошибка при загрузке ссылок: {e}")
+            logger.warning(f"Ошибка при загрузке ссылок: {e}")
             return []
 
     def parse_product_from_link(self, product_url):
         """Парсим данные товара по ссылке"""
-        try:
-            print(f"Парсим товар: {product_url}")
+        with metrics.timer("product"):
+            return self._parse_product_from_link(product_url)
+
+    def _parse_product_from_link(self, product_url):
+        if self.cache:
+            product_data = self.parse_product_from_cache(product_url)
+            if product_data or self.cache.cache_only:
+                return product_data
+
+        if self.use_http():
+            product_data = self.parse_product_over_http(product_url)
+            if product_data:
+                return product_data
+            logger.warning(f"Без браузера не получилось, открываем в Chrome: {product_url}")
+
+        return self.parse_product_in_browser(product_url)
 
-            # Переходим по ссылке
-            self.driver.get(product_url)
-            time.sleep(3)
+    def parse_product_in_browser(self, product_url):
+        """Парсим товар через Selenium"""
+        try:
+            logger.debug("Парсим товар: %s", product_url)
 
-            # Проверяем, что страница загрузилась
-            if "detail.aspx" not in self.driver.current_url:
-                print(f"Страница не загрузилась: {product_url}")
+            if not self.open_in_browser(product_url):
                 return None
 
+            # Поля считаются в браузере: html не передается по WebDriver и в кэш не попадает
+            if self.extractor == "js":
+                return self.finish_product(extract_product(self.driver, self.selectors), product_url,
+                                           source="browser")
+
             # Получаем данные со страницы товара
-            product_data = self.parse_product_page()
+            with metrics.timer("page_source", stage="product"):
+                html = self.driver.page_source
+            unchanged = self.unchanged_product(product_url, html, source="browser")
+            if unchanged:
+                return unchanged
+            product_data = self.parse_product_page(html)
+            if product_data and self.cache:
+                self.cache.put(product_url, html)
+            return self.finish_product(product_data, product_url, source="browser")
 
-            if product_data:
-                product_data['url'] = product_url
-                # Извлекаем артикул из URL
-                articul_match = re.search(r'/(\d+)/detail', product_url)
-                if articul_match:
-                    product_data['articul'] = articul_match.group(1)
+        except Exception as e:
+            kind = classify_exception(e)
+            logger.warning(f"Ошибка при парсинге {product_url} ({kind}): {e}", extra={'url': product_url, 'kind': kind})
+            metrics.inc("products", source="browser", result="error")
+            self.failures.record(product_url, kind, e)
+            return None
 
-                print(f"Успешно обработан артикул: {product_data.get('articul', 'N/A')}")
-                return product_data
-            else:
-                print(f"Не удалось спарсить: {product_url}")
+    def open_in_browser(self, product_url):
+        """Открываем карточку в Chrome; False, если вместо нее блокировка или другая страница"""
+        if self.driver is None:
+            self.setup_driver()
+
+        # Переходим по ссылке, темп задает общий планировщик
+        self.scheduler.acquire(product_url)
+        started = time.monotonic()
+        try:
+            with metrics.timer("driver_get", stage="product"):
+                self.driver.get(product_url)
+            with metrics.timer("wait_page"):
+                price_wait = self.wait_for_product_page()
+        except Exception:
+            self.scheduler.report(product_url, time.monotonic() - started, ok=False)
+            raise
+
+        # Проверяем, что страница загрузилась; ожидание цены, которой на карточке нет, - не медленный ответ хоста
+        blocked = looks_blocked(self.driver.current_url, self.driver.title)
+        loaded = "detail.aspx" in self.driver.current_url and not blocked
+        self.scheduler.report(product_url, time.monotonic() - started - price_wait, ok=loaded, blocked=blocked)
+        if not loaded:
+            logger.warning(f"Страница не загрузилась: {product_url}", extra={'url': product_url, 'blocked': blocked})
+            metrics.inc("products", source="browser", result="blocked" if blocked else "not_loaded")
+            self.failures.record(product_url, BLOCKED if blocked else REDIRECT, self.driver.current_url)
+        return loaded
+
+    def fetch_product_page(self, product_url, browser=False):
+        """Html карточки без разбора: из кэша, по HTTP или из Chrome; (html, источник) или None.
+        browser=True - сразу в Chrome, например когда по HTTP пришла страница без данных"""
+        if self.cache and not browser:
+            html = self.cached_page(product_url)
+            if html is not None:
+                return html, "cache"
+            if self.cache.cache_only:
                 return None
 
+        if self.use_http() and not browser:
+            page = self.fetcher.fetch(product_url)
+            if page is not None and "detail.aspx" in page[0]:
+                return page[1], "http"
+            logger.warning(f"Без браузера не получилось, открываем в Chrome: {product_url}")
+
+        try:
+            if not self.open_in_browser(product_url):
+                return None
+            with metrics.timer("page_source", stage="product"):
+                return self.driver.page_source, "browser"
         except Exception as e:
-            print(f"Ошибка при парсинге {product_url}: {e}")
+            kind = classify_exception(e)
+            logger.warning(f"Ошибка при загрузке {product_url} ({kind}): {e}", extra={'url': product_url, 'kind': kind})
+            metrics.inc("products", source="browser", result="error")
+            self.failures.record(product_url, kind, e)
             return None
 
-    def parse_product_page(self):
-        """Парсим данные со страницы товара"""
-        product_data = {}
+    def wait_for_product_page(self, timeout=10, price_grace=2.0):
+        """Ждем заголовок карточки, затем недолго цену: у товара не в наличии цены нет совсем.
+        Капча, "почти готово" и уход со страницы товара заканчивают ожидание сразу, чтобы планировщик
+        быстрее сбавил темп. Возвращает, сколько секунд ждали цену, которой так и не оказалось"""
+        title_selector = ", ".join(FIELD_SELECTORS['name'])
+
+        def page_state(driver):
+            """Почему можно перестать ждать: blocked, redirect, ready; None - ждем дальше"""
+            current_url = driver.current_url
+            if looks_blocked(current_url, driver.title):
+                return "blocked"
+            if "detail.aspx" not in current_url:
+                return "redirect"
+            if (driver.execute_script("return document.readyState") == "complete"
+                    and driver.find_elements(By.CSS_SELECTOR, title_selector)):
+                return "ready"
+            return None
 
         try:
-            html = self.driver.page_source
-            soup = BeautifulSoup(html, 'html.parser')
+            state = WebDriverWait(self.driver, timeout).until(page_state)
+        except TimeoutException:
+            logger.warning("Страница товара не догрузилась, парсим что есть")
+            metrics.inc("wait_page_timeouts")
+            return 0.0
+        if state != "ready":
+            logger.debug("Ожидание карточки прервано: %s", state)
+            metrics.inc("wait_page_aborted", reason=state)
+            return 0.0
 
-            # Название товара
-            product_data['name'] = self.get_product_name(soup)
+        started = time.monotonic()
+        try:
+            WebDriverWait(self.driver, price_grace, poll_frequency=0.2).until(
+                lambda driver: driver.find_elements(By.CSS_SELECTOR, "[class*='price']")
+            )
+            return 0.0
+        except TimeoutException:
+            logger.debug("Цены на карточке нет, товар не в наличии или цена еще не пришла")
+            metrics.inc("wait_page_no_price")
+            return time.monotonic() - started
 
-            # Цена
-            product_data['price'] = self.get_product_price(soup)
+    def parse_product_over_http(self, product_url, page=None):
+        """Парсим товар по HTTP, None если страница требует JS"""
+        try:
+            if page is None:
+                page = self.fetcher.fetch(product_url)
+            if page is None:
+                return None
 
-            # Рейтинг
-            product_data['rating'] = self.get_product_rating(soup)
+            final_url, html = page
+            if "detail.aspx" not in final_url:
+                logger.warning(f"Редирект со страницы товара: {product_url}")
+                return None
+            unchanged = self.unchanged_product(product_url, html, source="http")
+            if unchanged:
+                self.http_guard.record(False)
+                return unchanged
 
-            # Количество отзывов
-            product_data['reviews_count'] = self.get_reviews_count(soup)
+            product_data = self.parse_product_page(html)
+            if self.http_needs_browser(product_data):
+                return None
+            if self.cache:
+                self.cache.put(product_url, html)
+            return self.finish_product(product_data, product_url, source="http")
 
-            # Описание
-            product_data['description'] = self.get_product_description(soup)
+        except Exception as e:
+            logger.warning(f"Ошибка при HTTP парсинге {product_url}: {e}")
+            return None
 
-            # Изображения
-            images = self.get_product_images(soup)
-            product_data['images'] = ', '.join(images) if images else ""
+    def parse_product_from_cache(self, product_url):
+        """Парсим товар из кэша страниц, None при промахе"""
+        html = self.cached_page(product_url)
+        if html is None:
+            return None
+        unchanged = self.unchanged_product(product_url, html, source="cache")
+        if unchanged:
+            return unchanged
+        return self.finish_product(self.parse_product_page(html), product_url, source="cache")
+
+    def cached_page(self, product_url):
+        """Html из кэша страниц или None"""
+        with metrics.timer("cache_get"):
+            html = self.cache.get(product_url)
+        if html is None:
+            metrics.inc("cache_lookups", result="miss")
+            if self.cache.cache_only:
+                logger.warning(f"Нет в кэше: {product_url}")
+                self.failures.record(product_url, NOT_CACHED)
+            return None
+        metrics.inc("cache_lookups", result="hit")
+        return html
+
+    def parse_products(self, product_links, on_result=None):
+        """Парсим список ссылок, по HTTP загрузка идет параллельно"""
+        if not self.use_http():
+            results = []
+            for link in product_links:
+                results.append(self.parse_product_from_link(link))
+                if on_result:
+                    on_result(link, results[-1])
+            return results
+
+        results = [None] * len(product_links)
+        to_fetch = list(range(len(product_links)))
+        if self.cache:
+            to_fetch = []
+            for index, link in enumerate(product_links):
+                results[index] = self.parse_product_from_cache(link)
+                if results[index] is None and not self.cache.cache_only:
+                    to_fetch.append(index)
+                elif on_result:
+                    on_result(link, results[index])
+
+        pages = self.fetcher.fetch_many([product_links[index] for index in to_fetch])
+        for index, page in zip(to_fetch, pages):
+            link = product_links[index]
+            product_data = self.parse_product_over_http(link, page) if page else None
+            if product_data is None:
+                logger.warning(f"Без браузера не получилось, открываем в Chrome: {link}")
+                product_data = self.parse_product_in_browser(link)
+            results[index] = product_data
+            if on_result:
+                on_result(link, product_data)
+        return results
+
+    def unchanged_product(self, product_url, html, source):
+        """Прошлая запись товара, если страница не изменилась с прошлого обхода"""
+        if not self.tracker:
+            return None
+        record = self.tracker.unchanged(product_url, html)
+        if record:
+            metrics.inc("products", source=source, result="unchanged")
+            self.failures.resolve(product_url)
+        return record
+
+    def use_http(self):
+        """Пробовать ли карточку сначала по HTTP: бэкенд http и страницы по нему приходят с данными"""
+        return self.fetcher is not None and self.http_guard.enabled
+
+    def http_needs_browser(self, product_data):
+        """Страница из HTTP без данных; заодно учитываем, стоит ли дальше ходить по HTTP"""
+        fell_back = not product_data or self.needs_browser(product_data)
+        self.http_guard.record(fell_back)
+        if fell_back:
+            metrics.inc("browser_fallbacks")
+        return fell_back
+
+    def needs_browser(self, product_data):
+        """Карточка без названия и цены значит, что контент рисуется через JS"""
+        return (product_data.get('name') == "Название не найдено" or
+                product_data.get('price') in ("Цена не найдена", "Ошибка получения цены"))
+
+    def finish_product(self, product_data, product_url, source="browser"):
+        """Дополняем данные ссылкой и артикулом, возвращаем типизированную запись"""
+        metrics.inc("products", source=source, result="ok" if product_data else "failed")
+        if product_data:
+            product_data['url'] = product_url
+            # Извлекаем артикул из URL
+            articul = articul_from_url(product_url)
+            if articul:
+                product_data['articul'] = articul
+
+            record = ProductRecord.from_dict(product_data)
+            logger.debug("Успешно обработан артикул: %s", record.articul or 'N/A')
+            self.failures.resolve(product_url)
+            return record
+        else:
+            logger.warning(f"Не удалось спарсить: {product_url}", extra={'url': product_url, 'source': source})
+            self.failures.record(product_url, PARSE_ERROR, f"источник {source}")
+            return None
 
-            # Характеристики
-            characteristics = self.get_characteristics(soup)
-            product_data['characteristics'] = json.dumps(characteristics, ensure_ascii=False) if characteristics else ""
+    def parse_product_page(self, html=None):
+        """Парсим данные со страницы товара"""
+        product_data = {}
 
-            # Продавец
-            seller_info = self.get_seller_info(soup)
-            product_data.update(seller_info)
+        try:
+            if html is None:
+                html = self.driver.page_source
+            if self.engine:
+                with metrics.timer("parse_page", extractor="compiled"):
+                    return self.engine.extract(html)
+
+            with metrics.timer("parse_page", extractor="soup"):
+                with metrics.timer("soup_build"):
+                    soup = BeautifulSoup(html, 'html.parser')
+
+                # Название товара
+                with metrics.timer("extract_field", field="name"):
+                    product_data['name'] = self.get_product_name(soup)
+
+                # Цена
+                with metrics.timer("extract_field", field="price"):
+                    product_data['price'] = self.get_product_price(soup)
+
+                # Рейтинг
+                with metrics.timer("extract_field", field="rating"):
+                    product_data['rating'] = self.get_product_rating(soup)
+
+                # Количество отзывов
+                with metrics.timer("extract_field", field="reviews_count"):
+                    product_data['reviews_count'] = self.get_reviews_count(soup)
+
+                # Описание
+                with metrics.timer("extract_field", field="description"):
+                    product_data['description'] = self.get_product_description(soup)
+
+                # Изображения
+                with metrics.timer("extract_field", field="images"):
+                    images = self.get_product_images(soup)
+                product_data['images'] = ', '.join(images) if images else ""
+
+                # Характеристики
+                with metrics.timer("extract_field", field="characteristics"):
+                    characteristics = self.get_characteristics(soup)
+                product_data['characteristics'] = json.dumps(characteristics, ensure_ascii=False) if characteristics else ""
+
+                # Продавец
+                with metrics.timer("extract_field", field="seller"):
+                    seller_info = self.get_seller_info(soup)
+                product_data.update(seller_info)
 
             return product_data
 
         except Exception as e:
-            print(f"Ошибка при парсинге страницы товара: {e}")
+            logger.warning(f"Ошибка при парсинге страницы товара: {e}")
             return None
 
+    def select_first(self, soup, field, convert):
+        """Значение первого сработавшего селектора поля по исходному приоритету; реестр учитывает,
+        чье значение взято, и пропускает селекторы, не дававшие значения"""
+        order = self.selectors.order(field)
+        used = None
+        try:
+            for selector in order:
+                element = soup.select_one(selector)
+                value = convert(element) if element is not None else None
+                if value is not None:
+                    used = selector
+                    return value
+            return None
+        finally:
+            self.selectors.record(field, order, used)
+
     def get_product_name(self, soup):
         """Получаем название товара"""
         try:
-            name_tag = soup.find('h1')
-            if name_tag:
-                return name_tag.get_text(strip=True)
-
-            # Альтернативные селекторы
-            name_selectors = [
-                ".productHeader--G5fu8",
-                "[data-link*='text']",
-                "h1.product-page__header"
-            ]
-
-            for selector in name_selectors:
-                name_elem = soup.select_one(selector)
-                if name_elem:
-                    return name_elem.get_text(strip=True)
-
-            return "Название не найдено"
+            name = self.select_first(soup, 'name', lambda name_elem: name_elem.get_text(strip=True))
+            return "Название не найдено" if name is None else name
         except:
             return "Ошибка при получении названия"
 
@@ -151,79 +439,56 @@ class ProductParser:
             for element in price_elements:
                 price_text = element.get_text(strip=True)
                 if '₽' in price_text and any(char.isdigit() for char in price_text):
-                    print(f"Найден элемент с ценой: '{price_text}'")
+                    logger.debug("Найден элемент с ценой: '%s'", price_text)
 
                     # Берем весь текст цены как есть
                     prices = price_text.split('₽')
                     if prices:
                         first_price = prices[0].strip()
-                        print(f"Первая цена: '{first_price}'")
+                        logger.debug("Первая цена: '%s'", first_price)
                         return first_price
 
             return "Цена не найдена"
 
         except Exception as e:
-            print(f"Ошибка при получении цены: {e}")
+            logger.warning(f"Ошибка при получении цены: {e}")
             return "Ошибка получения цены"
 
     def get_product_rating(self, soup):
         """Получаем рейтинг товара"""
         try:
-            rating_selectors = [
-                ".product-page__reviews-icon",
-                ".address-rate-mini",
-                ".sellerRatingWrap--qfxW5 span",
-                "[class*='rating']"
-            ]
-
-            for selector in rating_selectors:
-                rating_tag = soup.select_one(selector)
-                if rating_tag:
-                    rating_text = rating_tag.get_text(strip=True).replace(',', '.')
-                    rating_match = re.search(r'[\d.]+', rating_text)
-                    if rating_match:
-                        try:
-                            return float(rating_match.group())
-                        except ValueError:
-                            continue
-            return 0.0
+            def to_rating(rating_tag):
+                rating_text = rating_tag.get_text(strip=True).replace(',', '.')
+                rating_match = re.search(r'[\d.]+', rating_text)
+                if rating_match:
+                    try:
+                        return float(rating_match.group())
+                    except ValueError:
+                        return None
+                return None
+
+            rating = self.select_first(soup, 'rating', to_rating)
+            return 0.0 if rating is None else rating
         except:
             return 0.0
 
     def get_reviews_count(self, soup):
         """Получаем количество отзывов"""
         try:
-            reviews_selectors = [
-                ".product-page__reviews-text",
-                "[class*='reviews-count']",
-                "[class*='review-count']"
-            ]
-
-            for selector in reviews_selectors:
-                reviews_tag = soup.select_one(selector)
-                if reviews_tag:
-                    reviews_text = reviews_tag.get_text(strip=True)
-                    reviews_match = re.search(r'\d+', reviews_text)
-                    if reviews_match:
-                        return int(reviews_match.group())
-            return 0
+            def to_count(reviews_tag):
+                reviews_match = re.search(r'\d+', reviews_tag.get_text(strip=True))
+                return int(reviews_match.group()) if reviews_match else None
+
+            reviews_count = self.select_first(soup, 'reviews_count', to_count)
+            return 0 if reviews_count is None else reviews_count
         except:
             return 0
 
     def get_product_description(self, soup):
         """Получаем описание товара"""
         try:
-            desc_selectors = [
-                "p.collapsable__text",
-                ".product-page__description",
-                ".description__text"
-            ]
-
-            for selector in desc_selectors:
-                desc_tag = soup.select_one(selector)
-                if desc_tag:
-                    return desc_tag.get_text(strip=True)
-            return "Описание отсутствует"
+            description = self.select_first(soup, 'description', lambda desc_tag: desc_tag.get_text(strip=True))
+            return "Описание отсутствует" if description is None else description
         except:
             return "Ошибка при получении описания"
 
@@ -240,7 +505,7 @@ class ProductParser:
                         if len(images) >= 10:
                             break
         except Exception as e:
-            print(f"Ошибка при получении изображений: {e}")
+            logger.warning(f"Ошибка при получении изображений: {e}")
         return images
 
     def get_characteristics(self, soup):
@@ -258,39 +523,23 @@ class ProductParser:
                         value = value_elem.get_text(strip=True)
                         characteristics[key] = value
         except Exception as e:
-            print(f"Ошибка при получении характеристик: {e}")
+            logger.warning(f"Ошибка при получении характеристик: {e}")
         return characteristics
 
     def get_seller_info(self, soup):
         """Получаем информацию о продавце"""
         seller_info = {}
         try:
-            seller_selectors = [
-                ".sellerAndBrandItemName--RV73r",
-                ".seller-info__name",
-                "[class*='seller-name']"
-            ]
-
-            for selector in seller_selectors:
-                seller_tag = soup.select_one(selector)
-                if seller_tag:
-                    seller_info['seller_name'] = seller_tag.get_text(strip=True)
-                    break
-
-            seller_link_selectors = [
-                "a.seller-info__name",
-                "[class*='seller-link']"
-            ]
+            seller_name = self.select_first(soup, 'seller_name', lambda seller_tag: seller_tag.get_text(strip=True))
+            if seller_name is not None:
+                seller_info['seller_name'] = seller_name
 
-            for selector in seller_link_selectors:
-                seller_link = soup.select_one(selector)
-                if seller_link and seller_link.get('href'):
-                    seller_href = seller_link.get('href')
-                    seller_info['seller_url'] = "https://www.wildberries.ru" + seller_href
-                    break
+            seller_href = self.select_first(soup, 'seller_url', lambda seller_link: seller_link.get('href') or None)
+            if seller_href is not None:
+                seller_info['seller_url'] = "https://www.wildberries.ru" + seller_href
 
         except Exception as e:
-            print(f"Ошибка при получении информации о продавце: {e}")
+            logger.warning(f"Ошибка при получении информации о продавце: {e}")
 
         # Заполняем обязательные поля
         if 'seller_name' not in seller_info:
@@ -303,98 +552,248 @@ class ProductParser:
     def export_to_excel(self, products, filename="wildberries_catalog.xlsx"):
         """Экспорт данных в Excel"""
         try:
-            if not products:
-                print("Нет данных для экспорта")
-                return
-
-            df = pd.DataFrame(products)
-
-            if df.empty:
-                print("DataFrame пустой")
-                return
-
-            print(f"Экспортируем {len(df)} товаров в Excel...")
-            df.to_excel(filename, index=False)
-            print(f"Основной каталог сохранен в {filename}")
-
-            # Фильтрованный файл
-            if 'rating' in df.columns and 'price' in df.columns:
-                # Преобразуем цены в числа для фильтрации
-                def parse_price(price_str):
-                    if isinstance(price_str, str):
-                        numbers = re.findall(r'\d+', price_str.replace(' ', ''))
-                        return int(numbers[0]) if numbers else 0
-                    return price_str
-
-                df['price_numeric'] = df['price'].apply(parse_price)
-
-                filtered_df = df[
-                    (df['rating'] >= 4.5) &
-                    (df['price_numeric'] <= 10000)
-                    ]
-
-                if not filtered_df.empty:
-                    filtered_filename = "filtered_catalog.xlsx"
-                    filtered_df.to_excel(filtered_filename, index=False)
-                    print(f"Фильтрованный каталог сохранен в {filtered_filename}")
-                    print(f"В фильтрованном каталоге: {len(filtered_df)} товаров")
-                else:
-                    print("Нет товаров, соответствующих фильтру")
-
+            exporter = StreamingExporter(formats=("xlsx",), output=filename[:-len(".xlsx")])
+            logger.info("Экспортируем товары в Excel...")
+            exporter.write_many(products)
+            exporter.close()
         except Exception as e:
-            print(f"Ошибка при экспорте в Excel: {e}")
+            logger.warning(f"Ошибка при экспорте в Excel: {e}")
 
     def close(self):
         """Закрытие драйвера"""
         if self.driver:
-            self.driver.quit()
+            # Браузер не закрываем, а отдаем следующему сборщику или парсеру
+            self.driver_pool.release(self.driver)
+            self.driver = None
+        if self.fetcher:
+            self.fetcher.close()
 
 
 if __name__ == "__main__":
-    parser = ProductParser()
+    arg_parser = argparse.ArgumentParser(description="Сбор данных по ссылкам Wildberries")
+    arg_parser.add_argument("--backend", choices=["selenium", "http"], default="selenium",
+                            help="http - загрузка без браузера, Chrome только для страниц с JS; "
+                                 "карточка WB по GET обычно приходит без данных, тогда HTTP отключается")
+    arg_parser.add_argument("--http-workers", type=int, default=8,
+                            help="Число одновременных HTTP запросов")
+    arg_parser.add_argument("--workers", type=int, default=1,
+                            help="Число параллельных браузеров")
+    arg_parser.add_argument("--parse-processes", type=int, default=0,
+                            help="Разбор в N отдельных процессах, потоки --workers только загружают страницы")
+    arg_parser.add_argument("--parse-queue", type=int, default=None,
+                            help="Сколько страниц может ждать разбора, по умолчанию 2 на процесс")
+    arg_parser.add_argument("--extractor", choices=["compiled", "soup", "js"], default="compiled",
+                            help="compiled - один проход lxml, soup - BeautifulSoup, "
+                                 "js - разбор в браузере без передачи page_source")
+    arg_parser.add_argument("--show-browser", action="store_true",
+                            help="Открывать окно Chrome вместо headless")
+    arg_parser.add_argument("--load-profile", choices=list(LOAD_PROFILES), default="lite",
+                            help="lite - не грузить картинки, шрифты, видео и счетчики")
+    arg_parser.add_argument("--max-rps", type=float, default=5.0,
+                            help="Потолок скорости запросов в секунду на хост")
+    arg_parser.add_argument("--cache", default=None,
+                            help="Файл кэша страниц (SQLite), например page_cache.sqlite")
+    arg_parser.add_argument("--cache-ttl", type=float, default=24,
+                            help="Время жизни страницы в кэше, часов")
+    arg_parser.add_argument("--cache-max-mb", type=float, default=512,
+                            help="Максимальный размер кэша, МБ")
+    arg_parser.add_argument("--cache-only", action="store_true",
+                            help="Парсить только из кэша, без сети и браузера")
+    arg_parser.add_argument("--links-file", default="product_links.json")
+    arg_parser.add_argument("--state", default="crawl_state.sqlite",
+                            help="Файл состояния обхода, по нему перезапуск пропускает готовое")
+    arg_parser.add_argument("--fresh", action="store_true",
+                            help="Забыть состояние прошлых запусков")
+    arg_parser.add_argument("--limit", type=int, default=None,
+                            help="Сколько ссылок обработать за этот запуск")
+    arg_parser.add_argument("--batch-size", type=int, default=50,
+                            help="Размер пачки ссылок")
+    arg_parser.add_argument("--max-attempts", type=int, default=3,
+                            help="Сколько раз пробовать упавшую ссылку")
+    arg_parser.add_argument("--retry-delay", type=float, default=10,
+                            help="Пауза перед первым повтором упавшей ссылки, дальше удваивается, секунд")
+    arg_parser.add_argument("--max-retry-wait", type=float, default=300,
+                            help="Сколько в конце запуска ждать ближайшего отложенного повтора, секунд")
+    arg_parser.add_argument("--failure-report", default="failure_report.json",
+                            help="Файл отчета об ошибках")
+    arg_parser.add_argument("--format", default="xlsx",
+                            help=f"Форматы экспорта через запятую: {', '.join(SINKS)}")
+    arg_parser.add_argument("--output", default="wildberries_catalog",
+                            help="Имя файла каталога без расширения")
+    arg_parser.add_argument("--filters", default=None,
+                            help="JSON с правилами фильтрации, например filters.json")
+    arg_parser.add_argument("--images", default=None,
+                            help="Папка для фото товаров, фото качаются параллельно с парсингом")
+    arg_parser.add_argument("--image-workers", type=int, default=8,
+                            help="Число одновременных загрузок фото")
+    arg_parser.add_argument("--incremental", action="store_true",
+                            help="Повторный обход: неизменившиеся карточки не разбираются, "
+                                 "в экспорт идут только новые и измененные")
+    arg_parser.add_argument("--history", default="history.sqlite",
+                            help="Файл отпечатков карточек и истории цен для --incremental")
+    arg_parser.add_argument("--recheck-hours", type=float, default=20,
+                            help="Через сколько часов готовую карточку проверять снова в режиме --incremental")
+    arg_parser.add_argument("--selector-stats", default=None,
+                            help="Файл статистики селекторов между запусками (например selector_stats.json), "
+                                 "по умолчанию статистика живет только в памяти")
+    add_observability_arguments(arg_parser)
+    args = arg_parser.parse_args()
+    if args.parse_processes and args.extractor == "js":
+        arg_parser.error("--extractor js считает поля в браузере и не сочетается с --parse-processes")
+    start_observability(args)
+
+    cache = None
+    if args.cache or args.cache_only:
+        cache = PageCache(args.cache or "page_cache.sqlite", ttl=args.cache_ttl * 3600,
+                          max_bytes=int(args.cache_max_mb * 1024 * 1024), cache_only=args.cache_only)
+
+    state = CrawlState(args.state, max_attempts=args.max_attempts)
+    if args.fresh:
+        state.reset()
+    failure_log = get_shared_failure_log()
+    retry_policy = RetryPolicy(base_delay=args.retry_delay)
+
+    formats = [fmt.strip() for fmt in args.format.split(",")]
+    tracker = None
+    if args.incremental:
+        # Вместо полного каталога - выгрузка изменений за запуск, без файлов фильтров
+        tracker = ChangeTracker(args.history)
+        exporter = StreamingExporter(formats=formats, rules=[],
+                                     output=f"{args.output}_changes_{time.strftime('%Y%m%d_%H%M')}")
+    else:
+        exporter = StreamingExporter(formats=formats, output=args.output, rules=load_filter_rules(args.filters))
+
+    downloader = ImageDownloader(args.images, max_workers=args.image_workers) if args.images else None
+
+    scheduler = get_shared_scheduler()
+    scheduler.max_rate = args.max_rps
+
+    driver_pool = get_shared_driver_pool()
+    driver_pool.headless = not args.show_browser
+    driver_pool.profile = args.load_profile
+
+    selector_registry = get_shared_selector_registry()
+    if args.selector_stats:
+        selector_registry.attach(args.selector_stats)
+
+    # В режиме пула у каждого воркера свой браузер, основной не нужен
+    parser = ProductParser(backend=args.backend, http_workers=args.http_workers,
+                           start_driver=args.workers <= 1 and not args.parse_processes,
+                           extractor=args.extractor, cache=cache,
+                           tracker=tracker)
     try:
-        print("Запуск парсера товаров Wildberries...")
+        logger.info("Запуск парсера товаров Wildberries...")
 
         # Загружаем ссылки из файла
-        product_links = parser.load_links_from_file("product_links.json")
+        product_links = parser.load_links_from_file(args.links_file)
 
         if not product_links:
-            print("Не найдено ссылок в файле")
+            logger.warning("Не найдено ссылок в файле")
             exit()
 
-        print(f"Загружено {len(product_links)} ссылок")
-
-        # Парсим каждый товар
-        print("Начинаем парсинг товаров...")
-        all_products = []
-
-        # Ограничиваем количество для теста
-        test_links = product_links[:15]
-
-        for i, link in enumerate(test_links):
-            print(f"Обрабатываем товар {i + 1}/{len(test_links)}")
-
-            # Добавляем задержку между запросами
-            time.sleep(random.uniform(2, 4))
+        if tracker:
+            requeued = state.requeue_done(time.time() - args.recheck_hours * 3600)
+            logger.info(f"Повторная проверка {requeued} готовых карточек")
+
+        added = state.add_links(product_links)
+        counts = state.counts()
+        logger.info(f"Загружено {len(product_links)} ссылок, новых {added}. "
+                    f"Готово {counts['done']}, ждут {counts['pending']}, с ошибкой {counts['failed']}")
+
+        pool = None
+        if args.parse_processes:
+            from parse_pool import FetchParsePool, ParsePool
+
+            pool = FetchParsePool(fetch_workers=args.workers, scheduler=scheduler, backend=args.backend,
+                                  extractor=args.extractor, cache=cache, tracker=tracker,
+                                  parse_pool=ParsePool(args.parse_processes, queue_size=args.parse_queue,
+                                                       extractor=args.extractor))
+        elif args.workers > 1:
+            from worker_pool import ParserPool
+
+            pool = ParserPool(workers=args.workers, scheduler=scheduler, backend=args.backend,
+                              extractor=args.extractor, cache=cache, tracker=tracker)
+
+        # Готовое с прошлых запусков сразу уходит в экспорт; в инкрементальном режиме оно уже выгружалось
+        if not tracker:
+            exporter.write_many(state.iter_done_products())
+
+        def on_result(link, product_data):
+            """Товар сразу фиксируется в состоянии и дописывается в файлы"""
+            if not product_data:
+                # Повтор откладывается по виду ошибки, окончательные ошибки больше не берутся в работу
+                failure = failure_log.last(link) or {'kind': ERROR, 'detail': "нет данных"}
+                state.mark_failed(link, error=failure['detail'] or failure['kind'], kind=failure['kind'],
+                                  policy=retry_policy)
+                return
+            state.mark_done(link, product_data)
+            if tracker:
+                change, previous = tracker.record(product_data)
+                if change == UNCHANGED:
+                    logger.debug("Без изменений: %s", link)
+                    return
+                exporter.write(change_row(product_data, change, previous))
+            else:
+                exporter.write(product_data)
+            if downloader:
+                downloader.submit(product_data)
+            logger.info(f"  - {product_data.name[:50]}... | Цена: {product_data.price} "
+                        f"| Рейтинг: {product_data.rating}")
+
+        # Парсим пачками
+        logger.info("Начинаем парсинг товаров...")
+        processed = 0
+        while args.limit is None or processed < args.limit:
+            batch_size = args.batch_size if args.limit is None else min(args.batch_size, args.limit - processed)
+            batch = state.next_batch(batch_size)
+            if not batch:
+                # Остались только отложенные повторы: ждем ближайший, если он не слишком далеко
+                retry_at = state.next_retry_at()
+                if retry_at is None or retry_at - time.time() > args.max_retry_wait:
+                    break
+                logger.info(f"Ждем повтора упавших ссылок {retry_at - time.time():.0f} с")
+                time.sleep(max(0.0, retry_at - time.time()))
+                continue
 
-            product_data = parser.parse_product_from_link(link)
-            if product_data:
-                all_products.append(product_data)
+            logger.info(f"Пачка из {len(batch)} ссылок, обработано за запуск {processed}")
+            if pool:
+                pool.run(batch, on_result=on_result)
+            else:
+                parser.parse_products(batch, on_result=on_result)
+            processed += len(batch)
 
-        print(f"Успешно обработано товаров: {len(all_products)}")
+        if args.parse_processes:
+            pool.print_stats()
+            pool.close()
 
-        # Экспорт в Excel
-        if all_products:
-            parser.export_to_excel(all_products)
-            print("\nСобранные данные:")
-            for product in all_products:
-                print(
-                    f"  - {product.get('name', 'N/A')[:50]}... | Цена: {product.get('price', 'N/A')} | Рейтинг: {product.get('rating', 'N/A')}")
-        else:
-            print("Не удалось собрать данные о товарах")
+        counts = state.counts()
+        logger.info(f"Обработано за запуск: {processed}. Всего готово {counts['done']}, "
+                    f"с ошибкой {counts['failed']}, ждут {counts['pending']}")
 
     except Exception as e:
-        print(f"Критическая ошибка: {e}")
+        logger.error(f"Критическая ошибка: {e}")
     finally:
+        exporter.close()
         parser.close()
-        print("Парсер товаров завершил работу")
\ No newline at end of file
+        failure_log.print_report()
+        failure_log.write_report(args.failure_report, extra={
+            'failed_in_state': state.failure_kinds(),
+            'circuit': scheduler.breaker.stats() if scheduler.breaker else {},
+        })
+        state.close()
+        if tracker:
+            tracker.print_stats()
+            tracker.close()
+        if downloader:
+            downloader.close()
+            downloader.print_stats()
+        scheduler.print_stats()
+        driver_pool.print_stats()
+        driver_pool.close()
+        selector_registry.print_stats()
+        selector_registry.save()
+        if cache:
+            cache.print_stats()
+            cache.close()
+        finish_observability(args)
+        logger.info("Парсер товаров завершил работу")
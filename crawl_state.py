@@ -0,0 +1,194 @@
+from product_record import ProductRecord
+import threading
+import sqlite3
+import json
+import time
+import re
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+
+PENDING = "pending"
+DONE = "done"
+FAILED = "failed"
+
+
+def articul_from_url(url):
+    """Артикул из ссылки вида /catalog/<артикул>/detail.aspx"""
+    match = re.search(r'/(\d+)/detail', url)
+    return match.group(1) if match else None
+
+
+class CrawlState:
+    """Состояние обхода по артикулам: что спарсено, что упало, что ждет"""
+
+    def __init__(self, path="crawl_state.sqlite", max_attempts=3):
+        self.path = path
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS items (
+                articul TEXT PRIMARY KEY,
+                url TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                last_seen REAL,
+                error TEXT,
+                data TEXT,
+                kind TEXT,
+                retry_at REAL,
+                checked_at REAL
+            )
+        """)
+        # Базы прошлых версий: вид ошибки, время повтора и время проверки добавились позже
+        columns = {row[1] for row in self.conn.execute("PRAGMA table_info(items)")}
+        for column, column_type in (('kind', 'TEXT'), ('retry_at', 'REAL'), ('checked_at', 'REAL')):
+            if column not in columns:
+                self.conn.execute(f"ALTER TABLE items ADD COLUMN {column} {column_type}")
+        if 'checked_at' not in columns:
+            self.conn.execute("UPDATE items SET checked_at = last_seen WHERE status = ?", (DONE,))
+        self.conn.execute("CREATE INDEX IF NOT EXISTS items_status ON items (status)")
+        self.conn.commit()
+
+    def add_links(self, links):
+        """Добавляем ссылки, уже известные артикулы не сбрасываем"""
+        now = time.time()
+        added = 0
+        with self._lock:
+            for url in links:
+                articul = articul_from_url(url)
+                if not articul:
+                    logger.warning(f"Не удалось определить артикул: {url}")
+                    continue
+                cursor = self.conn.execute(
+                    "INSERT OR IGNORE INTO items (articul, url, last_seen) VALUES (?, ?, ?)",
+                    (articul, url, now)
+                )
+                if cursor.rowcount:
+                    added += 1
+                else:
+                    self.conn.execute("UPDATE items SET last_seen = ? WHERE articul = ?", (now, articul))
+            self.conn.commit()
+        return added
+
+    def next_batch(self, size):
+        """Ссылки, которые еще нужно обработать: ожидающие и упавшие с запасом попыток, чей повтор уже наступил"""
+        with self._lock:
+            rows = self.conn.execute(
+                "SELECT url FROM items WHERE status = ? OR (status = ? AND attempts < ? "
+                "AND (retry_at IS NULL OR retry_at <= ?)) ORDER BY rowid LIMIT ?",
+                (PENDING, FAILED, self.max_attempts, time.time(), size)
+            ).fetchall()
+        return [url for (url,) in rows]
+
+    def next_retry_at(self):
+        """Время ближайшего отложенного повтора или None"""
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT MIN(retry_at) FROM items WHERE status = ? AND attempts < ? AND retry_at > ?",
+                (FAILED, self.max_attempts, time.time())
+            ).fetchone()
+        return row[0]
+
+    def mark_done(self, url, product_data):
+        """Сохраняем результат сразу, чтобы падение процесса его не потеряло"""
+        if not isinstance(product_data, ProductRecord):
+            product_data = ProductRecord.from_dict(product_data)
+        now = time.time()
+        with self._lock:
+            self.conn.execute(
+                "UPDATE items SET status = ?, attempts = attempts + 1, last_seen = ?, checked_at = ?, error = NULL, "
+                "kind = NULL, retry_at = NULL, data = ? WHERE articul = ?",
+                (DONE, now, now, json.dumps(product_data.to_dict(), ensure_ascii=False), articul_from_url(url))
+            )
+            self.conn.commit()
+
+    def mark_failed(self, url, error="нет данных", kind=None, policy=None):
+        """Запоминаем неудачную попытку; с policy (RetryPolicy) повтор откладывается по виду ошибки,
+        а окончательная ошибка больше не выдается в next_batch"""
+        now = time.time()
+        articul = articul_from_url(url)
+        with self._lock:
+            row = self.conn.execute("SELECT attempts FROM items WHERE articul = ?", (articul,)).fetchone()
+            attempts = (row[0] if row else 0) + 1
+            retry_at = None
+            if policy and kind:
+                delay = policy.delay(kind, attempts)
+                if delay is None:
+                    attempts = max(attempts, self.max_attempts)
+                else:
+                    retry_at = now + delay
+            self.conn.execute(
+                "UPDATE items SET status = ?, attempts = ?, last_seen = ?, error = ?, kind = ?, retry_at = ? "
+                "WHERE articul = ?",
+                (FAILED, attempts, now, error, kind, retry_at, articul)
+            )
+            self.conn.commit()
+
+    def checkpoint(self, url, product_data):
+        """Отметка результата одной ссылки"""
+        if product_data:
+            self.mark_done(url, product_data)
+        else:
+            self.mark_failed(url)
+
+    def done_products(self):
+        """Все успешно спарсенные товары, включая прошлые запуски"""
+        return list(self.iter_done_products())
+
+    def iter_done_products(self, chunk_size=500):
+        """То же, но порциями, без загрузки всего каталога в память"""
+        last_rowid = 0
+        while True:
+            with self._lock:
+                rows = self.conn.execute(
+                    "SELECT rowid, data FROM items WHERE status = ? AND rowid > ? ORDER BY rowid LIMIT ?",
+                    (DONE, last_rowid, chunk_size)
+                ).fetchall()
+            if not rows:
+                return
+            for rowid, data in rows:
+                yield ProductRecord.from_dict(json.loads(data))
+            last_rowid = rows[-1][0]
+
+    def failure_kinds(self):
+        """Число упавших ссылок по видам ошибок"""
+        with self._lock:
+            rows = self.conn.execute(
+                "SELECT COALESCE(kind, 'error'), COUNT(*) FROM items WHERE status = ? GROUP BY 1", (FAILED,)
+            ).fetchall()
+        return dict(rows)
+
+    def counts(self):
+        """Количество ссылок по статусам"""
+        with self._lock:
+            rows = self.conn.execute("SELECT status, COUNT(*) FROM items GROUP BY status").fetchall()
+        counts = {PENDING: 0, DONE: 0, FAILED: 0}
+        counts.update(dict(rows))
+        return counts
+
+    def requeue_done(self, older_than):
+        """Готовые ссылки, проверенные раньше older_than, снова ставим в очередь для повторного обхода.
+        Смотрим на время разбора, а не на last_seen: его обновляет каждый запуск, встретивший ссылку"""
+        with self._lock:
+            cursor = self.conn.execute(
+                "UPDATE items SET status = ?, attempts = 0 WHERE status = ? AND COALESCE(checked_at, 0) < ?",
+                (PENDING, DONE, older_than)
+            )
+            self.conn.commit()
+        return cursor.rowcount
+
+    def reset(self):
+        """Начать обход заново"""
+        with self._lock:
+            self.conn.execute("DELETE FROM items")
+            self.conn.commit()
+
+    def close(self):
+        """Закрытие базы"""
+        with self._lock:
+            self.conn.close()
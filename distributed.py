@@ -0,0 +1,632 @@
+from crawl_state import articul_from_url
+from product_record import ProductRecord
+from metrics import get_metrics, add_observability_arguments, start_observability, finish_observability
+from failures import RetryPolicy, classify_exception, get_shared_failure_log, ERROR
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import requests
+import itertools
+import argparse
+import threading
+import logging
+import sqlite3
+import socket
+import time
+import json
+import os
+
+
+logger = logging.getLogger(__name__)
+metrics = get_metrics()
+
+QUEUED = "queued"
+LEASED = "leased"
+DONE = "done"
+DEAD = "dead"
+
+
+class WorkQueue:
+    """Очередь ссылок с арендой: задача видна снова, если воркер не подтвердил ее до конца аренды.
+
+    Доставка "хотя бы один раз": результат пишется по артикулу, повторная обработка его просто перезапишет.
+    Координатор, воркеры и экспорт работают только через эти методы: SqliteWorkQueue - файл на одной машине,
+    HttpWorkQueue - та же очередь через QueueBroker для воркеров на других машинах.
+    """
+
+    def __init__(self, lease_seconds=120, max_attempts=5, retry_delay=30):
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+
+    def enqueue(self, links):
+        """Ставим ссылки в очередь, возвращаем сколько новых"""
+        raise NotImplementedError
+
+    def lease(self, worker_id, count=1):
+        """Берем до count задач в аренду: список (артикул, ссылка)"""
+        raise NotImplementedError
+
+    def extend(self, articul, worker_id):
+        """Продлеваем аренду; False - задачу уже отдали другому"""
+        raise NotImplementedError
+
+    def attempts(self, articul):
+        """Сколько раз задачу уже выдавали"""
+        raise NotImplementedError
+
+    def ack(self, articul, worker_id, product_data):
+        """Задача выполнена, результат сохраняется"""
+        raise NotImplementedError
+
+    def nack(self, articul, worker_id, error="нет данных", delay=None, final=False):
+        """Неудача: повтор через delay секунд или dead"""
+        raise NotImplementedError
+
+    def requeue_dead(self):
+        """Вернуть задачи из dead в очередь"""
+        raise NotImplementedError
+
+    def counts(self):
+        """Количество задач по статусам"""
+        raise NotImplementedError
+
+    def results_after(self, last_rowid, chunk_size=500):
+        """Порция результатов после last_rowid: список (rowid, словарь товара)"""
+        raise NotImplementedError
+
+    def iter_results(self, chunk_size=500):
+        """Результаты всех воркеров порциями"""
+        last_rowid = 0
+        while True:
+            rows = self.results_after(last_rowid, chunk_size)
+            if not rows:
+                return
+            for _, data in rows:
+                yield ProductRecord.from_dict(data)
+            last_rowid = rows[-1][0]
+
+    def is_drained(self):
+        """Работы больше нет: ничего не ждет и ничего не в аренде"""
+        counts = self.counts()
+        return counts[QUEUED] == 0 and counts[LEASED] == 0
+
+    def close(self):
+        pass
+
+
+class SqliteWorkQueue(WorkQueue):
+    """Очередь в файле SQLite для процессов одной машины.
+
+    Файл нельзя класть на сетевой диск (NFS, SMB): WAL там не работает, а блокировки SQLite ненадежны,
+    и аренда перестает быть атомарной. Воркерам других машин файл отдает QueueBroker по HTTP.
+    """
+
+    def __init__(self, path="work_queue.sqlite", lease_seconds=120, max_attempts=5, retry_delay=30):
+        super().__init__(lease_seconds=lease_seconds, max_attempts=max_attempts, retry_delay=retry_delay)
+        self.path = path
+        self._lock = threading.Lock()
+        # Транзакции открываем сами: аренда должна быть атомарной между процессами
+        self.conn = sqlite3.connect(path, check_same_thread=False, timeout=60, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS tasks (
+                articul TEXT PRIMARY KEY,
+                url TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'queued',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                owner TEXT,
+                visible_at REAL NOT NULL,
+                updated_at REAL,
+                error TEXT
+            )
+        """)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS tasks_visible ON tasks (status, visible_at)")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS results (
+                articul TEXT PRIMARY KEY,
+                url TEXT NOT NULL,
+                data TEXT NOT NULL,
+                worker TEXT,
+                finished_at REAL
+            )
+        """)
+
+    def enqueue(self, links):
+        """Ставим ссылки в очередь, уже известные артикулы не трогаем"""
+        now = time.time()
+        added = 0
+        with self._lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                for url in links:
+                    articul = articul_from_url(url)
+                    if not articul:
+                        logger.warning(f"Не удалось определить артикул: {url}")
+                        continue
+                    cursor = self.conn.execute(
+                        "INSERT OR IGNORE INTO tasks (articul, url, visible_at, updated_at) VALUES (?, ?, ?, ?)",
+                        (articul, url, now, now)
+                    )
+                    added += cursor.rowcount
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+        metrics.inc("queue_enqueued", added)
+        return added
+
+    def lease(self, worker_id, count=1):
+        """Берем задачи в аренду: ожидающие и те, чья аренда истекла"""
+        now = time.time()
+        with self._lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                # Задачи, которые уже столько раз терялись, больше не выдаем
+                self.conn.execute(
+                    "UPDATE tasks SET status = ?, owner = NULL, updated_at = ? "
+                    "WHERE status = ? AND visible_at <= ? AND attempts >= ?",
+                    (DEAD, now, LEASED, now, self.max_attempts)
+                )
+                rows = self.conn.execute(
+                    "SELECT articul, url, status FROM tasks "
+                    "WHERE status IN (?, ?) AND visible_at <= ? AND attempts < ? ORDER BY visible_at LIMIT ?",
+                    (QUEUED, LEASED, now, self.max_attempts, count)
+                ).fetchall()
+                for articul, _, _ in rows:
+                    self.conn.execute(
+                        "UPDATE tasks SET status = ?, owner = ?, attempts = attempts + 1, visible_at = ?, "
+                        "updated_at = ? WHERE articul = ?",
+                        (LEASED, worker_id, now + self.lease_seconds, now, articul)
+                    )
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+
+        expired = sum(1 for _, _, status in rows if status == LEASED)
+        if expired:
+            logger.info(f"{worker_id}: забрал {expired} задач с истекшей арендой")
+            metrics.inc("queue_lease_expired", expired)
+        metrics.inc("queue_leased", len(rows))
+        return [(articul, url) for articul, url, _ in rows]
+
+    def extend(self, articul, worker_id):
+        """Продлеваем аренду, пока задача в работе; False - задачу уже отдали другому"""
+        now = time.time()
+        with self._lock:
+            cursor = self.conn.execute(
+                "UPDATE tasks SET visible_at = ?, updated_at = ? WHERE articul = ? AND status = ? AND owner = ?",
+                (now + self.lease_seconds, now, articul, LEASED, worker_id)
+            )
+        return cursor.rowcount > 0
+
+    def attempts(self, articul):
+        """Сколько раз задачу уже выдавали, по всем воркерам и перезапускам"""
+        with self._lock:
+            row = self.conn.execute("SELECT attempts FROM tasks WHERE articul = ?", (articul,)).fetchone()
+        return row[0] if row else 0
+
+    def ack(self, articul, worker_id, product_data):
+        """Задача выполнена: результат и статус фиксируются одной транзакцией"""
+        if not isinstance(product_data, ProductRecord):
+            product_data = ProductRecord.from_dict(product_data)
+        now = time.time()
+        with self._lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                url = self.conn.execute("SELECT url FROM tasks WHERE articul = ?", (articul,)).fetchone()[0]
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO results (articul, url, data, worker, finished_at) VALUES (?, ?, ?, ?, ?)",
+                    (articul, url, json.dumps(product_data.to_dict(), ensure_ascii=False), worker_id, now)
+                )
+                self.conn.execute(
+                    "UPDATE tasks SET status = ?, owner = NULL, error = NULL, updated_at = ? WHERE articul = ?",
+                    (DONE, now, articul)
+                )
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+        metrics.inc("queue_acked")
+
+    def nack(self, articul, worker_id, error="нет данных", delay=None, final=False):
+        """Неудача: задача вернется в очередь после паузы или уйдет в dead; final - повторять бессмысленно"""
+        now = time.time()
+        delay = self.retry_delay if delay is None else delay
+        with self._lock:
+            self.conn.execute(
+                "UPDATE tasks SET status = CASE WHEN ? OR attempts >= ? THEN ? ELSE ? END, owner = NULL, "
+                "visible_at = ?, updated_at = ?, error = ? WHERE articul = ? AND status = ? AND owner = ?",
+                (final, self.max_attempts, DEAD, QUEUED, now + delay, now, error,
+                 articul, LEASED, worker_id)
+            )
+        metrics.inc("queue_nacked")
+
+    def requeue_dead(self):
+        """Вернуть задачи из dead в очередь с обнуленными попытками"""
+        now = time.time()
+        with self._lock:
+            cursor = self.conn.execute(
+                "UPDATE tasks SET status = ?, attempts = 0, visible_at = ?, updated_at = ? WHERE status = ?",
+                (QUEUED, now, now, DEAD)
+            )
+        return cursor.rowcount
+
+    def counts(self):
+        """Количество задач по статусам"""
+        with self._lock:
+            rows = self.conn.execute("SELECT status, COUNT(*) FROM tasks GROUP BY status").fetchall()
+        counts = {QUEUED: 0, LEASED: 0, DONE: 0, DEAD: 0}
+        counts.update(dict(rows))
+        return counts
+
+    def results_after(self, last_rowid, chunk_size=500):
+        """Порция результатов после last_rowid"""
+        with self._lock:
+            rows = self.conn.execute(
+                "SELECT rowid, data FROM results WHERE rowid > ? ORDER BY rowid LIMIT ?",
+                (last_rowid, chunk_size)
+            ).fetchall()
+        return [(rowid, json.loads(data)) for rowid, data in rows]
+
+    def close(self):
+        """Закрытие базы"""
+        with self._lock:
+            self.conn.close()
+
+
+class QueueBroker:
+    """HTTP доступ к SqliteWorkQueue для воркеров других машин: файл очереди остается на одной машине,
+    каждый метод WorkQueue - POST /<метод> с аргументами в JSON"""
+
+    METHODS = ('config', 'enqueue', 'lease', 'extend', 'attempts', 'ack', 'nack', 'requeue_dead', 'counts',
+               'results_after')
+
+    def __init__(self, work_queue, host="0.0.0.0", port=8765, token=None):
+        self.queue = work_queue
+        # Общий секрет в заголовке X-Queue-Token; без него брокер открыт всем, кто видит порт
+        self.token = token
+        self.server = ThreadingHTTPServer((host, port), self.handler_class())
+        self.thread = None
+
+    @property
+    def address(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def call(self, method, params):
+        if method == 'config':
+            return {'lease_seconds': self.queue.lease_seconds, 'max_attempts': self.queue.max_attempts,
+                    'retry_delay': self.queue.retry_delay}
+        if method == 'ack':
+            params['product_data'] = ProductRecord.from_dict(params['product_data'])
+        return getattr(self.queue, method)(**params)
+
+    def handler_class(self):
+        broker = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                method = self.path.strip("/")
+                if method not in broker.METHODS:
+                    return self.reply(404, {'error': f"нет метода {method}"})
+                if broker.token and self.headers.get("X-Queue-Token") != broker.token:
+                    return self.reply(403, {'error': "неверный токен"})
+                try:
+                    params = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                    result = broker.call(method, params)
+                except Exception as e:
+                    logger.warning(f"Брокер: ошибка в {method}: {e}")
+                    return self.reply(500, {'error': str(e)})
+                self.reply(200, {'result': result})
+
+            def reply(self, status, payload):
+                body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self):
+        """Обслуживание запросов в фоновом потоке"""
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def serve_forever(self):
+        logger.info(f"Брокер очереди {self.queue.path} слушает {self.address}")
+        self.server.serve_forever()
+
+    def close(self):
+        if self.thread:
+            self.server.shutdown()
+        self.server.server_close()
+
+
+class HttpWorkQueue(WorkQueue):
+    """Очередь на другой машине через QueueBroker; аренда, попытки и пауза повтора - настройки брокера"""
+
+    def __init__(self, url, token=None, timeout=30, retries=5):
+        self.url = url.rstrip("/")
+        self.timeout = timeout
+        self.session = requests.Session()
+        if token:
+            self.session.headers["X-Queue-Token"] = token
+        # Повторяем только неудачное соединение: повтор запроса, дошедшего до брокера, мог бы выдать аренду дважды
+        adapter = HTTPAdapter(max_retries=Retry(total=retries, connect=retries, read=0, status=0,
+                                                backoff_factor=0.5, allowed_methods=None))
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        super().__init__(**self.call('config'))
+        self.path = self.url
+
+    def call(self, method, **params):
+        response = self.session.post(f"{self.url}/{method}", json=params, timeout=self.timeout)
+        if response.status_code != 200:
+            try:
+                detail = response.json().get('error')
+            except ValueError:
+                detail = response.text[:200]
+            raise RuntimeError(f"брокер {self.url} ответил {response.status_code} на {method}: {detail}")
+        return response.json()['result']
+
+    def enqueue(self, links):
+        return self.call('enqueue', links=list(links))
+
+    def lease(self, worker_id, count=1):
+        return [tuple(task) for task in self.call('lease', worker_id=worker_id, count=count)]
+
+    def extend(self, articul, worker_id):
+        return self.call('extend', articul=articul, worker_id=worker_id)
+
+    def attempts(self, articul):
+        return self.call('attempts', articul=articul)
+
+    def ack(self, articul, worker_id, product_data):
+        if not isinstance(product_data, ProductRecord):
+            product_data = ProductRecord.from_dict(product_data)
+        self.call('ack', articul=articul, worker_id=worker_id, product_data=product_data.to_dict())
+
+    def nack(self, articul, worker_id, error="нет данных", delay=None, final=False):
+        self.call('nack', articul=articul, worker_id=worker_id, error=error, delay=delay, final=final)
+
+    def requeue_dead(self):
+        return self.call('requeue_dead')
+
+    def counts(self):
+        return self.call('counts')
+
+    def results_after(self, last_rowid, chunk_size=500):
+        return self.call('results_after', last_rowid=last_rowid, chunk_size=chunk_size)
+
+    def close(self):
+        self.session.close()
+
+
+def open_work_queue(location, lease_seconds=120, max_attempts=5, retry_delay=30, token=None):
+    """Адрес http(s)://... - брокер на другой машине, иначе файл SQLite на этой"""
+    if location.startswith(("http://", "https://")):
+        return HttpWorkQueue(location, token=token)
+    return SqliteWorkQueue(location, lease_seconds=lease_seconds, max_attempts=max_attempts,
+                           retry_delay=retry_delay)
+
+
+_worker_numbers = itertools.count(1)
+
+
+def default_worker_id():
+    """Уникальное имя воркера: хост, процесс и номер в процессе"""
+    return f"{socket.gethostname()}-{os.getpid()}-{next(_worker_numbers)}"
+
+
+class LeaseHeartbeat:
+    """Продлевает аренду задачи из фонового потока, пока она в работе: долгий разбор, перезапуск Chrome
+    или пауза хоста не должны отдать задачу второму воркеру"""
+
+    def __init__(self, work_queue, articul, worker_id, interval=None):
+        self.queue = work_queue
+        self.articul = articul
+        self.worker_id = worker_id
+        self.interval = interval or max(1.0, work_queue.lease_seconds / 3)
+        self.lost = False
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self.run, daemon=True)
+
+    def run(self):
+        while not self._stop.wait(self.interval):
+            if not self.queue.extend(self.articul, self.worker_id):
+                self.lost = True
+                logger.warning(f"{self.worker_id}: аренду {self.articul} забрали, пока задача была в работе")
+                metrics.inc("queue_lease_lost")
+                return
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+class QueueWorker:
+    """Воркер: арендует ссылки пачками, парсит своим ProductParser, подтверждает результат"""
+
+    def __init__(self, work_queue, worker_id=None, batch_size=5, parser_factory=None, **parser_options):
+        self.queue = work_queue
+        self.worker_id = worker_id or default_worker_id()
+        self.batch_size = batch_size
+        if parser_factory is None:
+            from collect_info import ProductParser
+
+            parser_factory = lambda: ProductParser(**parser_options)
+        self.parser_factory = parser_factory
+        # Пауза до повтора растет с числом неудач, окончательные ошибки сразу уходят в dead
+        self.retry_policy = RetryPolicy(base_delay=work_queue.retry_delay)
+        self.failures = get_shared_failure_log()
+        self.processed = 0
+        self.failed = 0
+
+    def run(self, stop_when_drained=True, poll_interval=2.0, stop_event=None):
+        """Цикл воркера; без stop_when_drained ждет новые ссылки, пока не выставят stop_event"""
+        parser = None
+        try:
+            while not (stop_event and stop_event.is_set()):
+                tasks = self.queue.lease(self.worker_id, self.batch_size)
+                if not tasks:
+                    if stop_when_drained and self.queue.is_drained():
+                        break
+                    time.sleep(poll_interval)
+                    continue
+
+                for articul, url in tasks:
+                    # Аренду могли забрать, пока мы разбирали предыдущие ссылки пачки
+                    if not self.queue.extend(articul, self.worker_id):
+                        logger.warning(f"{self.worker_id}: аренда {articul} истекла, пропускаем")
+                        continue
+                    try:
+                        with LeaseHeartbeat(self.queue, articul, self.worker_id):
+                            if parser is None:
+                                parser = self.parser_factory()
+                            product_data = parser.parse_product_from_link(url)
+                    except Exception as e:
+                        logger.warning(f"{self.worker_id}: ошибка на {url}: {e}")
+                        self.failures.record(url, classify_exception(e), e)
+                        self.nack(articul, url)
+                        if parser:
+                            parser.close()
+                        parser = None
+                        continue
+
+                    if product_data:
+                        self.queue.ack(articul, self.worker_id, product_data)
+                        self.processed += 1
+                    else:
+                        self.nack(articul, url)
+        finally:
+            if parser:
+                parser.close()
+        logger.info(f"{self.worker_id}: обработано {self.processed}, неудач {self.failed}")
+        self.failures.print_report()
+
+    def nack(self, articul, url):
+        """Неудачу возвращаем в очередь с паузой по виду ошибки; попытки считает очередь, а не этот процесс"""
+        failure = self.failures.last(url) or {'kind': ERROR, 'detail': "нет данных"}
+        delay = self.retry_policy.delay(failure['kind'], self.queue.attempts(articul))
+        self.queue.nack(articul, self.worker_id, f"{failure['kind']}: {failure['detail']}",
+                        delay=delay, final=delay is None)
+        self.failed += 1
+
+
+def log_counts(work_queue):
+    counts = work_queue.counts()
+    logger.info(f"Очередь: ждут {counts[QUEUED]}, в работе {counts[LEASED]}, готово {counts[DONE]}, "
+                f"отброшено {counts[DEAD]}")
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Распределенный обход: общая очередь ссылок с арендой")
+    arg_parser.add_argument("role", choices=["coordinator", "worker", "export", "status", "broker"])
+    arg_parser.add_argument("--queue", default="work_queue.sqlite",
+                            help="Файл очереди SQLite (только эта машина, не сетевой диск) "
+                                 "или адрес брокера http://хост:порт")
+    arg_parser.add_argument("--token", default=None, help="Общий секрет брокера и его клиентов")
+    # Брокер
+    arg_parser.add_argument("--listen", default="0.0.0.0:8765", help="Адрес брокера для воркеров других машин")
+    arg_parser.add_argument("--lease", type=float, default=120, help="Время аренды задачи, с")
+    arg_parser.add_argument("--max-attempts", type=int, default=5)
+    arg_parser.add_argument("--retry-delay", type=float, default=30,
+                            help="Через сколько секунд повторить неудачную ссылку")
+    # Координатор
+    arg_parser.add_argument("--links-file", default=None, help="Поставить в очередь ссылки из файла")
+    arg_parser.add_argument("--query", default=None, help="Собрать ссылки по запросу и ставить в очередь")
+    arg_parser.add_argument("--pages", type=int, default=2)
+    arg_parser.add_argument("--requeue-dead", action="store_true",
+                            help="Вернуть в очередь задачи, исчерпавшие попытки")
+    # Воркер
+    arg_parser.add_argument("--threads", type=int, default=1, help="Воркеров в этом процессе")
+    arg_parser.add_argument("--batch-size", type=int, default=5)
+    arg_parser.add_argument("--backend", choices=["selenium", "http"], default="selenium")
+    arg_parser.add_argument("--cache", default=None, help="Кэш страниц воркера")
+    arg_parser.add_argument("--cache-only", action="store_true", help="Парсить только из кэша")
+    arg_parser.add_argument("--wait", action="store_true",
+                            help="Не завершаться на пустой очереди, ждать новые ссылки")
+    # Экспорт
+    arg_parser.add_argument("--format", default="xlsx")
+    arg_parser.add_argument("--output", default="wildberries_catalog")
+    arg_parser.add_argument("--filters", default=None)
+    add_observability_arguments(arg_parser)
+    args = arg_parser.parse_args()
+    start_observability(args)
+
+    work_queue = open_work_queue(args.queue, lease_seconds=args.lease, max_attempts=args.max_attempts,
+                                 retry_delay=args.retry_delay, token=args.token)
+    try:
+        if args.role == "broker":
+            host, port = args.listen.rsplit(":", 1)
+            broker = QueueBroker(work_queue, host=host, port=int(port), token=args.token)
+            try:
+                broker.serve_forever()
+            except KeyboardInterrupt:
+                pass
+            finally:
+                broker.close()
+
+        elif args.role == "coordinator":
+            if args.requeue_dead:
+                logger.info(f"Возвращено в очередь: {work_queue.requeue_dead()}")
+            if args.links_file:
+                with open(args.links_file, 'r', encoding='utf-8') as f:
+                    links = json.load(f)
+                logger.info(f"В очередь добавлено {work_queue.enqueue(links)} из {len(links)} ссылок")
+            if args.query:
+                from link_collect import LinkCollector
+
+                # Ссылки уходят в очередь постранично, воркеры начинают работу не дожидаясь конца сбора
+                collector = LinkCollector()
+                try:
+                    for page_links in collector.iter_product_links(args.query, args.pages):
+                        logger.info(f"В очередь добавлено {work_queue.enqueue(page_links)} ссылок")
+                finally:
+                    collector.close()
+
+        elif args.role == "worker":
+            cache = None
+            if args.cache or args.cache_only:
+                from page_cache import PageCache
+
+                cache = PageCache(args.cache or "page_cache.sqlite", cache_only=args.cache_only)
+            workers = [QueueWorker(work_queue, batch_size=args.batch_size, backend=args.backend, cache=cache)
+                       for _ in range(args.threads)]
+            threads = [threading.Thread(target=worker.run, kwargs={'stop_when_drained': not args.wait})
+                       for worker in workers]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            if cache:
+                cache.print_stats()
+                cache.close()
+
+        elif args.role == "export":
+            from exporters import StreamingExporter
+            from normalize import load_filter_rules
+
+            exporter = StreamingExporter(formats=[fmt.strip() for fmt in args.format.split(",")],
+                                         output=args.output, rules=load_filter_rules(args.filters))
+            exporter.write_many(work_queue.iter_results())
+            exporter.close()
+
+        log_counts(work_queue)
+    except Exception as e:
+        logger.error(f"Критическая ошибка: {e}")
+    finally:
+        work_queue.close()
+        finish_observability(args)
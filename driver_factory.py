@@ -0,0 +1,202 @@
+from webdriver_manager.chrome import ChromeDriverManager
+from selenium.webdriver.chrome.service import Service
+from selenium.webdriver.chrome.options import Options
+from selenium.common.exceptions import SessionNotCreatedException, WebDriverException
+from selenium import webdriver
+import threading
+import atexit
+import time
+import os
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+
+USER_AGENT = ("Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) "
+              "Chrome/120.0.0.0 Safari/537.36")
+
+# Путь к chromedriver между запусками, чтобы не ходить в webdriver_manager каждый раз
+DRIVER_PATH_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".chromedriver_path")
+
+# Что не грузим в профиле lite: картинки, шрифты, видео и сторонние счетчики.
+# Ссылки на фото товара берутся из атрибутов разметки, сами файлы парсеру не нужны
+LITE_BLOCKED_URLS = [
+    "*.jpg", "*.jpeg", "*.png", "*.webp", "*.avif", "*.gif", "*.svg", "*.ico",
+    "*.woff", "*.woff2", "*.ttf", "*.otf",
+    "*.mp4", "*.webm", "*.m3u8",
+    "*google-analytics.com*", "*googletagmanager.com*", "*doubleclick.net*",
+    "*mc.yandex.ru*", "*top-fwz1.mail.ru*", "*vk.com/rtrg*", "*criteo*",
+]
+
+LOAD_PROFILES = {
+    'full': [],
+    'lite': LITE_BLOCKED_URLS,
+}
+
+
+_driver_path = None
+_driver_path_lock = threading.Lock()
+
+
+def resolve_driver_path(refresh=False):
+    """Путь к chromedriver: из памяти, из файла прошлого запуска или через webdriver_manager"""
+    global _driver_path
+    with _driver_path_lock:
+        if _driver_path and not refresh:
+            return _driver_path
+
+        if not refresh and os.path.exists(DRIVER_PATH_FILE):
+            with open(DRIVER_PATH_FILE, 'r', encoding='utf-8') as f:
+                path = f.read().strip()
+            if path and os.path.exists(path):
+                _driver_path = path
+                return _driver_path
+
+        _driver_path = ChromeDriverManager().install()
+        try:
+            with open(DRIVER_PATH_FILE, 'w', encoding='utf-8') as f:
+                f.write(_driver_path)
+        except OSError as e:
+            logger.warning(f"Не удалось сохранить путь к chromedriver: {e}")
+        return _driver_path
+
+
+def chrome_options(headless=True):
+    """Общие настройки Chrome для сборщика ссылок и парсера"""
+    options = Options()
+    if headless:
+        options.add_argument("--headless=new")
+        options.add_argument("--window-size=1920,1080")
+    options.add_argument("--no-sandbox")
+    options.add_argument("--disable-dev-shm-usage")
+    options.add_argument("--disable-blink-features=AutomationControlled")
+    options.add_experimental_option("excludeSwitches", ["enable-automation"])
+    options.add_experimental_option('useAutomationExtension', False)
+    options.add_argument(f"--user-agent={USER_AGENT}")
+    return options
+
+
+def apply_load_profile(driver, profile):
+    """Блокировка лишних ресурсов через CDP, действует на все следующие загрузки"""
+    blocked = LOAD_PROFILES[profile]
+    if not blocked:
+        return
+    driver.execute_cdp_cmd("Network.enable", {})
+    driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": blocked})
+
+
+def create_driver(headless=True, profile="lite"):
+    """Новый Chrome; если закэшированный chromedriver не подошел к браузеру - скачиваем заново"""
+    try:
+        driver = webdriver.Chrome(service=Service(resolve_driver_path()), options=chrome_options(headless))
+    except SessionNotCreatedException:
+        logger.warning("Chromedriver не подходит к установленному Chrome, обновляем")
+        driver = webdriver.Chrome(service=Service(resolve_driver_path(refresh=True)),
+                                  options=chrome_options(headless))
+    apply_load_profile(driver, profile)
+    return driver
+
+
+class DriverPool:
+    """Прогретые браузеры: закрытый сборщиком или парсером драйвер отдается следующему"""
+
+    def __init__(self, max_idle=4, headless=True, profile="lite"):
+        if profile not in LOAD_PROFILES:
+            raise ValueError(f"Неизвестный профиль загрузки: {profile}")
+        self.max_idle = max_idle
+        self.headless = headless
+        self.profile = profile
+
+        self.created = 0
+        self.reused = 0
+        self.startup_time = 0.0
+
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Свободный прогретый драйвер или новый"""
+        while True:
+            with self._lock:
+                driver = self._idle.pop() if self._idle else None
+            if driver is None:
+                break
+            if self.is_alive(driver):
+                with self._lock:
+                    self.reused += 1
+                return driver
+            self.quit(driver)
+
+        started = time.monotonic()
+        driver = create_driver(headless=self.headless, profile=self.profile)
+        with self._lock:
+            self.created += 1
+            self.startup_time += time.monotonic() - started
+        return driver
+
+    def release(self, driver):
+        """Возвращаем драйвер в пул; сломанный или лишний закрываем"""
+        if driver is None:
+            return
+        if not self.is_alive(driver):
+            self.quit(driver)
+            return
+        with self._lock:
+            if len(self._idle) < self.max_idle:
+                self._idle.append(driver)
+                return
+        self.quit(driver)
+
+    @staticmethod
+    def is_alive(driver):
+        try:
+            driver.current_url
+            return True
+        except WebDriverException:
+            return False
+
+    @staticmethod
+    def quit(driver):
+        try:
+            driver.quit()
+        except Exception as e:
+            logger.warning(f"Ошибка при закрытии браузера: {e}")
+
+    def stats(self):
+        """Сколько браузеров запущено и сколько раз отдан прогретый"""
+        return {
+            'created': self.created,
+            'reused': self.reused,
+            'idle': len(self._idle),
+            'avg_startup': round(self.startup_time / self.created, 2) if self.created else 0.0,
+        }
+
+    def print_stats(self):
+        """Вывод статистики пула браузеров"""
+        stats = self.stats()
+        if not stats['created'] and not stats['reused']:
+            return
+        logger.info(f"Браузеры: запущено {stats['created']} (в среднем {stats['avg_startup']} с на запуск), "
+                    f"переиспользовано {stats['reused']}, профиль {self.profile}")
+
+    def close(self):
+        """Закрываем все простаивающие браузеры"""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for driver in idle:
+            self.quit(driver)
+
+
+_shared_pool = None
+_shared_pool_lock = threading.Lock()
+
+
+def get_shared_driver_pool():
+    """Один пул браузеров на процесс, общий для сборщика ссылок и парсеров"""
+    global _shared_pool
+    with _shared_pool_lock:
+        if _shared_pool is None:
+            _shared_pool = DriverPool()
+            atexit.register(_shared_pool.close)
+        return _shared_pool
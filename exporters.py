@@ -0,0 +1,190 @@
+from product_record import ProductBatch, as_row
+from normalize import load_filter_rules
+from metrics import get_metrics
+from openpyxl import Workbook
+import threading
+import json
+import csv
+import logging
+
+
+logger = logging.getLogger(__name__)
+metrics = get_metrics()
+
+
+# Порядок колонок как в DataFrame из словарей parse_product_page
+PRODUCT_COLUMNS = [
+    'name', 'price', 'rating', 'reviews_count', 'description', 'images',
+    'characteristics', 'seller_name', 'seller_url', 'url', 'articul',
+]
+
+EXTENSIONS = {'xlsx': '.xlsx', 'csv': '.csv', 'jsonl': '.jsonl', 'parquet': '.parquet'}
+
+
+class Sink:
+    """Файл, в который строки дописываются по одной; открывается при первой строке"""
+
+    def __init__(self, filename, columns=None):
+        self.filename = filename
+        self.columns = columns
+        self.rows = 0
+        self.opened = False
+
+    def write(self, row):
+        if not self.opened:
+            if self.columns is None:
+                self.columns = PRODUCT_COLUMNS + [key for key in row if key not in PRODUCT_COLUMNS]
+            self.open()
+            self.opened = True
+        self.write_row(row)
+        self.rows += 1
+
+    def open(self):
+        raise NotImplementedError
+
+    def write_row(self, row):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class XlsxSink(Sink):
+    """Excel в режиме write-only: строки сразу уходят во временный файл, а не в память"""
+
+    def open(self):
+        self.workbook = Workbook(write_only=True)
+        self.sheet = self.workbook.create_sheet()
+        self.sheet.append(self.columns)
+
+    def write_row(self, row):
+        self.sheet.append([row.get(column) for column in self.columns])
+
+    def close(self):
+        if self.opened:
+            self.workbook.save(self.filename)
+
+
+class CsvSink(Sink):
+    def open(self):
+        self.file = open(self.filename, 'w', encoding='utf-8-sig', newline='')
+        self.writer = csv.DictWriter(self.file, fieldnames=self.columns, extrasaction='ignore')
+        self.writer.writeheader()
+
+    def write_row(self, row):
+        self.writer.writerow(row)
+
+    def close(self):
+        if self.opened:
+            self.file.close()
+
+
+class JsonlSink(Sink):
+    def open(self):
+        self.file = open(self.filename, 'w', encoding='utf-8')
+
+    def write_row(self, row):
+        self.file.write(json.dumps(row, ensure_ascii=False) + "\n")
+        self.file.flush()
+
+    def close(self):
+        if self.opened:
+            self.file.close()
+
+
+class ParquetSink(Sink):
+    """Parquet группами строк через колоночный ProductBatch, нужен pyarrow"""
+
+    def __init__(self, filename, columns=None, row_group_size=10000):
+        super().__init__(filename, ProductBatch.COLUMNS)
+        self.row_group_size = row_group_size
+        self.buffer = ProductBatch()
+        self.writer = None
+
+    def open(self):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise RuntimeError("Для экспорта в Parquet установите pyarrow: pip install pyarrow")
+        self.pa = pyarrow
+        self.pq = pyarrow.parquet
+
+    def write_row(self, row):
+        self.buffer.append(row)
+        if len(self.buffer) >= self.row_group_size:
+            self.flush()
+
+    def flush(self):
+        if not len(self.buffer):
+            return
+        table = self.buffer.to_arrow()
+        if self.writer is None:
+            self.writer = self.pq.ParquetWriter(self.filename, table.schema)
+        self.writer.write_table(table)
+        self.buffer.clear()
+
+    def close(self):
+        if self.opened:
+            self.flush()
+            if self.writer:
+                self.writer.close()
+
+
+SINKS = {'xlsx': XlsxSink, 'csv': CsvSink, 'jsonl': JsonlSink, 'parquet': ParquetSink}
+
+
+class StreamingExporter:
+    """Экспорт по мере парсинга: основной каталог и файлы правил фильтра, память не растет с числом товаров"""
+
+    def __init__(self, formats=("xlsx",), output="wildberries_catalog", rules=None):
+        self.sinks = [SINKS[fmt](output + EXTENSIONS[fmt]) for fmt in formats]
+        # Без явных правил - стандартный фильтр каталога
+        self.rules = load_filter_rules() if rules is None else rules
+        self.rule_sinks = {
+            rule.name: [SINKS[fmt](rule.output_path(output) + EXTENSIONS[fmt]) for fmt in formats]
+            for rule in self.rules
+        }
+        self.rule_counts = {rule.name: 0 for rule in self.rules}
+        self.total = 0
+        self._lock = threading.Lock()
+
+    def write(self, product_data):
+        """Дописываем товар (ProductRecord или словарь) во все файлы"""
+        product_row = as_row(product_data)
+        with self._lock, metrics.timer("export_write"):
+            for sink in self.sinks:
+                sink.write(product_row)
+            self.total += 1
+
+            for rule in self.rules:
+                if rule.matches(product_row):
+                    for sink in self.rule_sinks[rule.name]:
+                        sink.write(product_row)
+                    self.rule_counts[rule.name] += 1
+
+    def write_many(self, products):
+        for product_data in products:
+            self.write(product_data)
+
+    def close(self):
+        """Закрываем файлы и выводим итог"""
+        with self._lock:
+            for sink in self.sinks + [sink for sinks in self.rule_sinks.values() for sink in sinks]:
+                try:
+                    sink.close()
+                except Exception as e:
+                    logger.warning(f"Ошибка при сохранении {sink.filename}: {e}")
+
+        if not self.total:
+            logger.info("Нет данных для экспорта")
+            return
+        for sink in self.sinks:
+            logger.info(f"Основной каталог сохранен в {sink.filename}: {sink.rows} товаров")
+        for rule in self.rules:
+            if self.rule_counts[rule.name]:
+                for sink in self.rule_sinks[rule.name]:
+                    logger.info(f"Фильтр {rule.name} сохранен в {sink.filename}")
+                logger.info(f"В фильтре {rule.name}: {self.rule_counts[rule.name]} товаров")
+            else:
+                logger.info(f"Нет товаров, соответствующих фильтру {rule.name}")
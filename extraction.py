@@ -0,0 +1,529 @@
+from lxml import etree
+from bs4.dammit import EntitySubstitution
+from html.parser import HTMLParser
+from metrics import get_metrics
+import lxml.html
+import json
+import re
+
+
+metrics = get_metrics()
+
+
+# Селекторы полей в порядке приоритета, общие для BeautifulSoup и скомпилированного движка
+FIELD_SELECTORS = {
+    'name': [
+        "h1",
+        ".productHeader--G5fu8",
+        "[data-link*='text']",
+        "h1.product-page__header",
+    ],
+    'rating': [
+        ".product-page__reviews-icon",
+        ".address-rate-mini",
+        ".sellerRatingWrap--qfxW5 span",
+        "[class*='rating']",
+    ],
+    'reviews_count': [
+        ".product-page__reviews-text",
+        "[class*='reviews-count']",
+        "[class*='review-count']",
+    ],
+    'description': [
+        "p.collapsable__text",
+        ".product-page__description",
+        ".description__text",
+    ],
+    'seller_name': [
+        ".sellerAndBrandItemName--RV73r",
+        ".seller-info__name",
+        "[class*='seller-name']",
+    ],
+    'seller_url': [
+        "a.seller-info__name",
+        "[class*='seller-link']",
+    ],
+}
+
+PRICE_TAGS = {'span', 'div', 'ins'}
+PRICE_CLASS_RE = re.compile(r'price|Price')
+IMAGE_SRC_RE = re.compile(r'\.(webp|jpg|png|jpeg)')
+IMAGE_HOSTS = ('images.wbstatic.net', 'basket-', 'geobasket')
+MAX_IMAGES = 10
+
+# Как и get_text в BeautifulSoup, текст скриптов и стилей не учитываем
+SKIP_TEXT_TAGS = {'script', 'style', 'template'}
+
+# Теги без содержимого, как их понимает BeautifulSoup с html.parser
+VOID_TAGS = {
+    'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'keygen', 'link', 'menuitem', 'meta',
+    'param', 'source', 'track', 'wbr', 'basefont', 'bgsound', 'command', 'frame', 'image', 'isindex',
+    'nextid', 'spacer',
+}
+# Обертки, которые libxml2 достраивает сам: при сравнении вложенности их не учитываем
+WRAPPER_TAGS = {'html', 'head', 'body'}
+RAW_TEXT_TAGS = ('script', 'style')
+# Теги, которые libxml2 закрывает сам и молча, не записывая ошибку в error_log
+IMPLIED_END_TAGS = (
+    'a', 'p', 'li', 'dt', 'dd', 'option', 'optgroup', 'tr', 'td', 'th', 'thead', 'tbody', 'tfoot',
+    'colgroup', 'caption', 'form', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'title', 'textarea',
+)
+
+_TOKEN_RE = re.compile(
+    r"<!--.*?-->|<![^>]*>|<\?[^>]*>"
+    r"|<(/?)([a-zA-Z][^\t\n\r\f />\x00]*)((?:[^>\"']|\"[^\"]*\"|'[^']*')*)>",
+    re.S
+)
+_IMPLIED_END_RE = re.compile(r'<(/?(?:%s))(?=[\s/>])' % '|'.join(IMPLIED_END_TAGS), re.I)
+_RAW_TEXT_END_RE = {tag: re.compile(r'</\s*%s\s*>' % tag, re.I) for tag in RAW_TEXT_TAGS}
+
+_COMPOUND_RE = re.compile(
+    r"(?P<tag>[a-zA-Z][\w-]*)?"
+    r"(?P<rest>(?:\.[\w-]+|\[[\w-]+(?:\*=['\"][^'\"]*['\"])?\])*)$"
+)
+_PART_RE = re.compile(r"\.([\w-]+)|\[([\w-]+)(?:\*=['\"]([^'\"]*)['\"])?\]")
+
+
+class Compound:
+    """Простой селектор: тег, классы и атрибуты с проверкой на подстроку"""
+
+    __slots__ = ('tag', 'classes', 'attrs')
+
+    def __init__(self, text):
+        match = _COMPOUND_RE.match(text)
+        if not match or not text:
+            raise ValueError(f"Неподдерживаемый селектор: {text}")
+        self.tag = match.group('tag').lower() if match.group('tag') else None
+        self.classes = []
+        self.attrs = []
+        for class_name, attr, value in _PART_RE.findall(match.group('rest')):
+            if class_name:
+                self.classes.append(class_name)
+            else:
+                self.attrs.append((attr.lower(), value))
+
+    def matches(self, tag, classes, element):
+        if self.tag and self.tag != tag:
+            return False
+        for class_name in self.classes:
+            if class_name not in classes:
+                return False
+        for attr, value in self.attrs:
+            attr_value = element.get(attr)
+            if attr_value is None:
+                return False
+            if attr == 'class':
+                # Классы в BeautifulSoup хранятся списком и сравниваются через пробел
+                attr_value = ' '.join(classes)
+            if value and value not in attr_value:
+                return False
+        return True
+
+
+class CompiledSelector:
+    """Селектор вида 'A' или 'A B' (потомок), компилируется один раз"""
+
+    __slots__ = ('text', 'ancestor', 'target')
+
+    def __init__(self, text):
+        parts = text.split()
+        if len(parts) > 2:
+            raise ValueError(f"Поддерживается только один уровень вложенности: {text}")
+        self.text = text
+        self.ancestor = Compound(parts[0]) if len(parts) == 2 else None
+        self.target = Compound(parts[-1])
+
+
+def element_text(element):
+    """Аналог get_text(strip=True): склеиваем непустые куски текста без пробелов"""
+    parts = []
+    stack = [element]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, str):
+            stripped = node.strip()
+            if stripped:
+                parts.append(stripped)
+            continue
+        if not isinstance(node.tag, str) or node.tag in SKIP_TEXT_TAGS:
+            continue
+        # Обходим в порядке документа: текст, дети, хвосты детей
+        pending = []
+        if node.text:
+            pending.append(node.text)
+        for child in node:
+            pending.append(child)
+            if child.tail:
+                pending.append(child.tail)
+        stack.extend(reversed(pending))
+    return ''.join(parts)
+
+
+def soup_nesting(html):
+    """Вложенность тегов так, как ее построит html.parser в BeautifulSoup: (тег, номер родителя) по порядку.
+    Незакрытые теги не закрываются сами, закрывающий тег снимает все открытые до своей пары"""
+    nesting = []
+    # (тег, номер ближайшего предка не из оберток)
+    stack = []
+    open_counts = {}
+    pos = 0
+    while True:
+        match = _TOKEN_RE.search(html, pos)
+        if match is None:
+            break
+        pos = match.end()
+        closing, tag, rest = match.groups()
+        if tag is None:
+            continue
+        tag = tag.lower()
+
+        if closing:
+            if not open_counts.get(tag):
+                continue
+            while True:
+                name, _ = stack.pop()
+                open_counts[name] -= 1
+                if name == tag:
+                    break
+            continue
+
+        parent = stack[-1][1] if stack else None
+        if tag not in WRAPPER_TAGS:
+            nesting.append((tag, parent))
+            parent = len(nesting) - 1
+        if tag in VOID_TAGS or rest.endswith('/'):
+            continue
+        stack.append((tag, parent))
+        open_counts[tag] = open_counts.get(tag, 0) + 1
+        if tag in RAW_TEXT_TAGS:
+            end = _RAW_TEXT_END_RE[tag].search(html, pos)
+            pos = end.start() if end else len(html)
+    return nesting
+
+
+def lxml_nesting(root):
+    """Та же вложенность по дереву, которое построил lxml"""
+    nesting = []
+    index = {}
+    for element in root.iter(etree.Element):
+        if element.tag in WRAPPER_TAGS:
+            continue
+        parent = element.getparent()
+        while parent is not None and parent.tag in WRAPPER_TAGS:
+            parent = parent.getparent()
+        index[element] = len(nesting)
+        nesting.append((element.tag, index[parent] if parent is not None else None))
+    return nesting
+
+
+class SoupCompatibleBuilder(HTMLParser):
+    """Дерево lxml по разбору html.parser: вложенность и текст как у BeautifulSoup(html, 'html.parser')"""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=False)
+        self.builder = etree.TreeBuilder()
+        # Корень-заглушка, как объект BeautifulSoup: под ним может быть несколько тегов верхнего уровня
+        self.builder.start('document', {})
+        self.stack = ['document']
+
+    def start(self, tag, attrs):
+        attributes = {}
+        for key, value in attrs:
+            attributes[key] = value or ""
+        try:
+            self.builder.start(tag, attributes)
+            return tag
+        except ValueError:
+            # Имена, недопустимые в lxml (например @click), селекторы все равно не проверяют
+            attributes = {key: value for key, value in attributes.items() if re.fullmatch(r'[a-zA-Z_][\w.-]*', key)}
+            if not re.fullmatch(r'[a-zA-Z_][\w.-]*', tag):
+                tag = 'invalid'
+            self.builder.start(tag, attributes)
+            return tag
+
+    def handle_starttag(self, tag, attrs):
+        tag = self.start(tag, attrs)
+        if tag in VOID_TAGS:
+            self.builder.end(tag)
+        else:
+            self.stack.append(tag)
+
+    def handle_startendtag(self, tag, attrs):
+        self.builder.end(self.start(tag, attrs))
+
+    def handle_endtag(self, tag):
+        if tag not in self.stack[1:]:
+            return
+        while True:
+            name = self.stack.pop()
+            self.builder.end(name)
+            if name == tag:
+                break
+
+    def handle_data(self, data):
+        self.builder.data(data)
+
+    def handle_charref(self, name):
+        try:
+            number = int(name[1:], 16) if name[:1] in ('x', 'X') else int(name)
+            self.builder.data(chr(number))
+        except (ValueError, OverflowError):
+            self.builder.data(f"&#{name}")
+
+    def handle_entityref(self, name):
+        character = EntitySubstitution.HTML_ENTITY_TO_CHARACTER.get(name)
+        self.builder.data(character if character is not None else f"&{name}")
+
+    def handle_comment(self, data):
+        # Комментарий делит текст на куски так же, как в BeautifulSoup, но в текст не попадает
+        self.builder.comment(data)
+
+    def parse(self, html):
+        self.feed(html)
+        self.close()
+        while self.stack:
+            self.builder.end(self.stack.pop())
+        return self.builder.close()
+
+
+def implied_ends(html):
+    """Есть ли теги, которые libxml2 закрыл бы сам без записи в error_log: открывающих и закрывающих не поровну"""
+    balance = {}
+    for tag in _IMPLIED_END_RE.findall(html):
+        tag = tag.lower()
+        if tag[0] == '/':
+            balance[tag[1:]] = balance.get(tag[1:], 0) - 1
+        else:
+            balance[tag] = balance.get(tag, 0) + 1
+    return any(balance.values())
+
+
+def parse_document(html):
+    """Дерево для извлечения: быстрый lxml, а если он починил вложенность иначе, чем html.parser, -
+    разбор html.parser, чтобы значения совпадали с путем soup.
+    Полное сравнение вложенности только для страниц, которые lxml чинил: ошибки в error_log или
+    несбалансированные теги, которые libxml2 закрывает молча"""
+    parser = lxml.html.HTMLParser()
+    with metrics.timer("lxml_parse"):
+        root = lxml.html.document_fromstring(html, parser=parser)
+    if not len(parser.error_log) and not implied_ends(html):
+        return root
+    with metrics.timer("nesting_check"):
+        same = soup_nesting(html) == lxml_nesting(root)
+    if same:
+        return root
+    metrics.inc("soup_compatible_parse")
+    with metrics.timer("soup_compatible_parse"):
+        return SoupCompatibleBuilder().parse(html)
+
+
+class ExtractionEngine:
+    """Извлечение всех полей товара за один проход по документу lxml"""
+
+    def __init__(self, field_selectors=None, registry=None):
+        self.field_selectors = field_selectors or FIELD_SELECTORS
+        # Реестр селекторов получает, чье значение взято на странице: статистика и предупреждения о верстке
+        self.registry = registry
+        # Одинаковые селекторы разных полей проверяем один раз
+        self.selectors = []
+        self._index = {}
+        self.fields = {}
+        for field, selector_list in self.field_selectors.items():
+            self.fields[field] = [self._compile(text) for text in selector_list]
+
+        # Раскладываем селекторы по классу/тегу, чтобы на каждом элементе проверять только подходящие
+        self.targets_by_class = {}
+        self.targets_by_tag = {}
+        self.targets_generic = []
+        self.ancestors_by_class = {}
+        self.ancestors_by_tag = {}
+        self.ancestors_generic = []
+        for index, selector in enumerate(self.selectors):
+            self._dispatch(selector.target, index, self.targets_by_class, self.targets_by_tag, self.targets_generic)
+            if selector.ancestor:
+                self._dispatch(selector.ancestor, index, self.ancestors_by_class,
+                               self.ancestors_by_tag, self.ancestors_generic)
+
+    @staticmethod
+    def _dispatch(compound, index, by_class, by_tag, generic):
+        if compound.classes:
+            by_class.setdefault(compound.classes[0], []).append(index)
+        elif compound.tag:
+            by_tag.setdefault(compound.tag, []).append(index)
+        else:
+            generic.append(index)
+
+    @staticmethod
+    def _candidates(tag, classes, by_class, by_tag, generic):
+        candidates = list(generic)
+        if tag in by_tag:
+            candidates.extend(by_tag[tag])
+        for class_name in classes:
+            if class_name in by_class:
+                candidates.extend(by_class[class_name])
+        return candidates
+
+    def _compile(self, text):
+        if text not in self._index:
+            self._index[text] = len(self.selectors)
+            self.selectors.append(CompiledSelector(text))
+        return self._index[text]
+
+    def walk(self, root):
+        """Один обход дерева: первые совпадения селекторов, кандидаты цены, картинки, характеристики"""
+        first_match = [None] * len(self.selectors)
+        open_ancestors = [0] * len(self.selectors)
+        remaining = len(self.selectors)
+        price_candidates = []
+        images = []
+        params_root = None
+        params_depth = 0
+        open_rows = []
+        rows = []
+
+        for event, element in etree.iterwalk(root, events=('start', 'end')):
+            tag = element.tag
+            if not isinstance(tag, str):
+                continue
+            class_attr = element.get('class')
+            classes = class_attr.split() if class_attr else ()
+
+            if event == 'end':
+                for index in self._candidates(tag, classes, self.ancestors_by_class,
+                                              self.ancestors_by_tag, self.ancestors_generic):
+                    if self.selectors[index].ancestor.matches(tag, classes, element):
+                        open_ancestors[index] -= 1
+                if params_depth:
+                    if element is params_root:
+                        params_depth = 0
+                    elif open_rows and open_rows[-1][0] is element:
+                        open_rows.pop()
+                continue
+
+            if remaining:
+                for index in self._candidates(tag, classes, self.targets_by_class,
+                                              self.targets_by_tag, self.targets_generic):
+                    selector = self.selectors[index]
+                    if first_match[index] is None and selector.target.matches(tag, classes, element):
+                        if selector.ancestor is None or open_ancestors[index] > 0:
+                            first_match[index] = element
+                            remaining -= 1
+
+            for index in self._candidates(tag, classes, self.ancestors_by_class,
+                                          self.ancestors_by_tag, self.ancestors_generic):
+                if self.selectors[index].ancestor.matches(tag, classes, element):
+                    open_ancestors[index] += 1
+
+            if tag in PRICE_TAGS and class_attr and PRICE_CLASS_RE.search(class_attr):
+                price_candidates.append(element)
+
+            if tag == 'img':
+                src = element.get('src')
+                if src and IMAGE_SRC_RE.search(src):
+                    images.append(src)
+
+            if params_root is None and tag == 'div' and 'product-params' in classes:
+                params_root = element
+                params_depth = 1
+            elif params_depth:
+                if tag == 'div' and 'product-params__row' in classes:
+                    row = [element, None, None]
+                    open_rows.append(row)
+                    rows.append(row)
+                elif tag == 'span' and open_rows:
+                    # Как row.find(): первый подходящий span среди потомков строки
+                    slot = 1 if 'product-params__label' in classes else 2 if 'product-params__value' in classes else 0
+                    if slot:
+                        for row in open_rows:
+                            if row[slot] is None:
+                                row[slot] = element
+
+        return first_match, price_candidates, images, rows
+
+    def extract(self, html):
+        """Разбираем html и возвращаем поля в том же виде, что и parse_product_page"""
+        root = parse_document(html)
+        with metrics.timer("walk"):
+            first_match, price_candidates, images, rows = self.walk(root)
+
+        # Обход уже проверил каждый селектор, порядок и пропуски из реестра здесь ничего не экономят:
+        # значение всегда по исходному приоритету, реестру уходят только итоги для статистики и сбоев верстки
+        orders = self.field_selectors
+        used = {}
+
+        def pick(field, convert):
+            """Значение первого селектора поля, для которого convert вернул не None; запоминаем, чей он"""
+            used[field] = None
+            for text in orders[field]:
+                element = first_match[self._index[text]]
+                value = convert(element) if element is not None else None
+                if value is not None:
+                    used[field] = text
+                    return value
+            return None
+
+        def with_default(value, default):
+            return default if value is None else value
+
+        product_data = {}
+        product_data['name'] = with_default(pick('name', element_text), "Название не найдено")
+        product_data['price'] = self.resolve_price(price_candidates)
+        product_data['rating'] = with_default(
+            pick('rating', lambda element: self.to_number(element, r'[\d.]+', float, comma=True)), 0.0)
+        product_data['reviews_count'] = with_default(
+            pick('reviews_count', lambda element: self.to_number(element, r'\d+', int)), 0)
+        product_data['description'] = with_default(pick('description', element_text), "Описание отсутствует")
+
+        image_list = self.resolve_images(images)
+        product_data['images'] = ', '.join(image_list) if image_list else ""
+
+        characteristics = {}
+        for _, label, value in rows:
+            if label is not None and value is not None:
+                characteristics[element_text(label)] = element_text(value)
+        product_data['characteristics'] = json.dumps(characteristics, ensure_ascii=False) if characteristics else ""
+
+        product_data['seller_name'] = with_default(pick('seller_name', element_text), "Продавец не указан")
+        seller_href = pick('seller_url', lambda element: element.get('href') or None)
+        product_data['seller_url'] = "https://www.wildberries.ru" + seller_href if seller_href else ""
+
+        # Попадание засчитывается только селектору, чье значение взято: частые запасные значат, что верстка уехала
+        for field in self.fields:
+            if self.registry:
+                self.registry.record(field, orders[field], used[field])
+            elif used[field] is not None:
+                metrics.inc("selector_hits", field=field, index=self.field_selectors[field].index(used[field]))
+
+        return product_data
+
+    @staticmethod
+    def resolve_price(candidates):
+        for element in candidates:
+            price_text = element_text(element)
+            if '₽' in price_text and any(char.isdigit() for char in price_text):
+                return price_text.split('₽')[0].strip()
+        return "Цена не найдена"
+
+    @staticmethod
+    def to_number(element, pattern, cast, comma=False):
+        text = element_text(element)
+        if comma:
+            text = text.replace(',', '.')
+        match = re.search(pattern, text)
+        if match:
+            try:
+                return cast(match.group())
+            except ValueError:
+                return None
+        return None
+
+    @staticmethod
+    def resolve_images(sources):
+        result = []
+        for src in sources:
+            if src.startswith('http') and src not in result:
+                if any(pattern in src for pattern in IMAGE_HOSTS):
+                    result.append(src)
+                    if len(result) >= MAX_IMAGES:
+                        break
+        return result
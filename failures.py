@@ -0,0 +1,292 @@
+from selenium.common.exceptions import TimeoutException, WebDriverException
+from metrics import get_metrics
+from urllib.parse import urlparse
+from collections import deque
+import threading
+import requests
+import random
+import json
+import time
+import logging
+
+
+logger = logging.getLogger(__name__)
+metrics = get_metrics()
+
+
+TIMEOUT = "timeout"
+BLOCKED = "blocked"
+REDIRECT = "redirect"
+PARSE_ERROR = "parse_error"
+NOT_CACHED = "not_cached"
+NETWORK = "network"
+ERROR = "error"
+
+# Сколько раз повторять ссылку по виду ошибки; 0 - ошибка окончательная:
+# редирект с detail.aspx значит, что карточки нет, а промах кэша в --cache-only не исправится повтором
+RETRY_LIMITS = {
+    TIMEOUT: 4,
+    BLOCKED: 5,
+    NETWORK: 4,
+    ERROR: 2,
+    PARSE_ERROR: 1,
+    REDIRECT: 0,
+    NOT_CACHED: 0,
+}
+
+
+class CrawlFailure(Exception):
+    """Ошибка загрузки с известным видом"""
+
+    def __init__(self, kind, message=""):
+        super().__init__(message or kind)
+        self.kind = kind
+
+
+def classify_exception(error):
+    """Вид ошибки по исключению Selenium, requests или CrawlFailure"""
+    if isinstance(error, CrawlFailure):
+        return error.kind
+    if isinstance(error, (TimeoutException, requests.Timeout, TimeoutError)):
+        return TIMEOUT
+    if isinstance(error, (requests.ConnectionError, ConnectionError)):
+        return NETWORK
+    if isinstance(error, WebDriverException):
+        message = str(error).lower()
+        if "timeout" in message or "timed out" in message:
+            return TIMEOUT
+        if "net::err_" in message:
+            return NETWORK
+    return ERROR
+
+
+class RetryPolicy:
+    """Экспоненциальная пауза между попытками с разбросом, чтобы повторы не шли пачкой"""
+
+    def __init__(self, base_delay=10.0, max_delay=600.0, limits=None, jitter=0.2):
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.limits = limits or RETRY_LIMITS
+        self.jitter = jitter
+
+    def delay(self, kind, attempts):
+        """Пауза перед следующей попыткой после attempts неудачных или None, если повторять не нужно"""
+        if attempts > self.limits.get(kind, RETRY_LIMITS[ERROR]):
+            return None
+        delay = min(self.max_delay, self.base_delay * 2 ** (attempts - 1))
+        return delay * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class HostCircuit:
+    """Состояние выключателя одного хоста"""
+
+    def __init__(self, window, cooldown):
+        self.events = deque(maxlen=window)
+        self.state = CLOSED
+        self.cooldown = cooldown
+        self.opened_until = 0.0
+        self.probe_started = None
+        self.trips = 0
+        self.paused_seconds = 0.0
+
+
+class CircuitBreaker:
+    """Выключатель по хостам: при всплеске страниц блокировки обход хоста встает на паузу.
+    После паузы проходит один пробный запрос: блокировка - пауза вдвое длиннее, нормальный ответ - обход дальше"""
+
+    def __init__(self, window=20, threshold=0.5, min_events=5, cooldown=60.0, max_cooldown=900.0):
+        self.window = window
+        self.threshold = threshold
+        self.min_events = min_events
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.hosts = {}
+        self._lock = threading.Lock()
+
+    def circuit_for(self, url):
+        host = urlparse(url).netloc or url
+        with self._lock:
+            if host not in self.hosts:
+                self.hosts[host] = HostCircuit(self.window, self.cooldown)
+            return host, self.hosts[host]
+
+    def wait(self, url):
+        """Ждем, пока хост не выйдет из паузы; возвращает время ожидания"""
+        host, circuit = self.circuit_for(url)
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                if circuit.state == CLOSED:
+                    break
+                if circuit.state == OPEN and now >= circuit.opened_until:
+                    circuit.state = HALF_OPEN
+                    circuit.probe_started = None
+                if circuit.state == HALF_OPEN:
+                    # Один пробный запрос; если он пропал без ответа, через паузу пускаем следующий
+                    if circuit.probe_started is None or now - circuit.probe_started > circuit.cooldown:
+                        circuit.probe_started = now
+                        break
+                    delay = 0.5
+                else:
+                    delay = min(circuit.opened_until - now, 5.0)
+            time.sleep(delay)
+            waited += delay
+
+        if waited:
+            with self._lock:
+                circuit.paused_seconds += waited
+            metrics.observe("circuit_wait", waited)
+        return waited
+
+    def record(self, url, blocked):
+        """Итог запроса к хосту: была ли страница блокировки"""
+        host, circuit = self.circuit_for(url)
+        with self._lock:
+            if circuit.state == HALF_OPEN:
+                if blocked:
+                    circuit.cooldown = min(self.max_cooldown, circuit.cooldown * 2)
+                    self._open(host, circuit)
+                else:
+                    circuit.state = CLOSED
+                    circuit.cooldown = self.cooldown
+                    circuit.events.clear()
+                    metrics.set("circuit_open", 0, host=host)
+                    logger.info(f"{host}: пробный запрос прошел, обход продолжается")
+                return
+
+            circuit.events.append(bool(blocked))
+            if circuit.state == CLOSED and len(circuit.events) >= self.min_events:
+                share = sum(circuit.events) / len(circuit.events)
+                if share >= self.threshold:
+                    self._open(host, circuit)
+
+    def _open(self, host, circuit):
+        circuit.state = OPEN
+        circuit.opened_until = time.monotonic() + circuit.cooldown
+        circuit.trips += 1
+        circuit.events.clear()
+        metrics.inc("circuit_trips", host=host)
+        metrics.set("circuit_open", 1, host=host)
+        logger.warning(f"{host}: много страниц блокировки, пауза {circuit.cooldown:.0f} с")
+
+    def stats(self):
+        with self._lock:
+            return {
+                host: {'state': circuit.state, 'trips': circuit.trips,
+                       'paused_seconds': round(circuit.paused_seconds, 1)}
+                for host, circuit in self.hosts.items()
+            }
+
+    def print_stats(self):
+        """Вывод срабатываний выключателя"""
+        for host, stats in self.stats().items():
+            if stats['trips']:
+                logger.info(f"{host}: пауз из-за блокировок {stats['trips']}, "
+                            f"ожидание {stats['paused_seconds']} с, сейчас {stats['state']}")
+
+
+class FailureLog:
+    """Ошибки по ссылкам за запуск: вид, число попыток, удалось ли в итоге"""
+
+    def __init__(self):
+        self.entries = {}
+        self._lock = threading.Lock()
+
+    def record(self, url, kind, detail=""):
+        """Запоминаем неудачную попытку, возвращаем число неудач ссылки за запуск"""
+        metrics.inc("failures", kind=kind)
+        with self._lock:
+            entry = self.entries.setdefault(url, {'url': url, 'attempts': 0, 'kinds': {}, 'recovered': False})
+            entry['attempts'] += 1
+            entry['kinds'][kind] = entry['kinds'].get(kind, 0) + 1
+            entry['kind'] = kind
+            entry['detail'] = str(detail)[:300]
+            entry['recovered'] = False
+            return entry['attempts']
+
+    def last(self, url):
+        """Последняя ошибка ссылки или None"""
+        with self._lock:
+            entry = self.entries.get(url)
+            return dict(entry) if entry else None
+
+    def resolve(self, url):
+        """Ссылка удалась после неудачных попыток"""
+        with self._lock:
+            entry = self.entries.get(url)
+            if entry and not entry['recovered']:
+                entry['recovered'] = True
+                metrics.inc("failures_recovered")
+
+    def summary(self):
+        """Итог по видам ошибок"""
+        with self._lock:
+            entries = list(self.entries.values())
+        by_kind = {}
+        for entry in entries:
+            if not entry['recovered']:
+                by_kind[entry['kind']] = by_kind.get(entry['kind'], 0) + 1
+        return {
+            'links_with_failures': len(entries),
+            'recovered': sum(1 for entry in entries if entry['recovered']),
+            'failed_by_kind': by_kind,
+            'attempts_by_kind': self._attempts_by_kind(entries),
+        }
+
+    @staticmethod
+    def _attempts_by_kind(entries):
+        counts = {}
+        for entry in entries:
+            for kind, count in entry['kinds'].items():
+                counts[kind] = counts.get(kind, 0) + count
+        return counts
+
+    def print_report(self):
+        """Итог ошибок в лог"""
+        summary = self.summary()
+        if not summary['links_with_failures']:
+            return
+        failed = ", ".join(f"{kind} {count}" for kind, count in sorted(summary['failed_by_kind'].items())) or "нет"
+        logger.info(f"Ошибки: ссылок с ошибками {summary['links_with_failures']}, "
+                    f"удалось повтором {summary['recovered']}, не удалось: {failed}")
+
+    def write_report(self, path, extra=None):
+        """Отчет об ошибках в JSON: итог по видам и каждая ссылка"""
+        with self._lock:
+            entries = sorted(self.entries.values(), key=lambda entry: entry['url'])
+            report = {'summary': None, 'links': [dict(entry) for entry in entries]}
+        report['summary'] = self.summary()
+        if extra:
+            report.update(extra)
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        logger.info(f"Отчет об ошибках сохранен в {path}")
+
+
+_shared_breaker = None
+_shared_log = None
+_shared_lock = threading.Lock()
+
+
+def get_shared_circuit_breaker():
+    """Один выключатель на процесс, общий для всех загрузок через планировщик"""
+    global _shared_breaker
+    with _shared_lock:
+        if _shared_breaker is None:
+            _shared_breaker = CircuitBreaker()
+        return _shared_breaker
+
+
+def get_shared_failure_log():
+    """Один журнал ошибок на процесс"""
+    global _shared_log
+    with _shared_lock:
+        if _shared_log is None:
+            _shared_log = FailureLog()
+        return _shared_log
@@ -0,0 +1,126 @@
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from concurrent.futures import ThreadPoolExecutor
+from rate_limit import get_shared_scheduler, looks_blocked
+from metrics import get_metrics
+import requests
+import threading
+import time
+import logging
+
+
+logger = logging.getLogger(__name__)
+metrics = get_metrics()
+
+
+DEFAULT_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
+    "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
+    "Accept-Language": "ru-RU,ru;q=0.9,en;q=0.8",
+}
+
+
+class HttpFetcher:
+    """Загрузка страниц по HTTP без браузера через общий keep-alive пул соединений"""
+
+    def __init__(self, max_workers=8, timeout=15, retries=2, scheduler=None):
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.scheduler = scheduler or get_shared_scheduler()
+        self._slots = threading.BoundedSemaphore(max_workers)
+        self.session = self.setup_session(retries)
+
+    def setup_session(self, retries):
+        """Настройка сессии с пулом соединений и повторами"""
+        session = requests.Session()
+        session.headers.update(DEFAULT_HEADERS)
+
+        retry = Retry(
+            total=retries,
+            backoff_factor=0.5,
+            status_forcelist=[500, 502, 503, 504],
+            allowed_methods=["GET"],
+        )
+        # Размер пула не меньше числа одновременных запросов, иначе соединения не переиспользуются
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=self.max_workers, max_retries=retry)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session
+
+    def fetch(self, url):
+        """Загружаем страницу, возвращаем (итоговый url, html) или None"""
+        with self._slots:
+            self.scheduler.acquire(url)
+            started = time.monotonic()
+            try:
+                with metrics.timer("http_request"):
+                    response = self.session.get(url, timeout=self.timeout)
+            except requests.RequestException as e:
+                metrics.inc("http_responses", status="error")
+                self.scheduler.report(url, time.monotonic() - started, ok=False)
+                logger.warning(f"HTTP ошибка при загрузке {url}: {e}")
+                return None
+
+        metrics.inc("http_responses", status=response.status_code)
+        blocked = response.status_code in (403, 429) or looks_blocked(response.url)
+        self.scheduler.report(url, time.monotonic() - started,
+                              ok=response.status_code == 200, blocked=blocked)
+        if response.status_code != 200:
+            logger.warning(f"HTTP {response.status_code} для {url}")
+            return None
+
+        if not response.encoding or response.encoding.lower() == "iso-8859-1":
+            response.encoding = response.apparent_encoding or "utf-8"
+        return response.url, response.text
+
+    def fetch_many(self, urls):
+        """Параллельная загрузка списка страниц, порядок результатов совпадает с порядком ссылок"""
+        if not urls:
+            return []
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            return list(executor.map(self.fetch, urls))
+
+    def close(self):
+        """Закрытие сессии"""
+        self.session.close()
+
+
+class BrowserFallbackGuard:
+    """Сколько карточек из HTTP все равно пришлось открывать в Chrome.
+    Обычный GET карточки WB отдает оболочку SPA без данных: если так почти со всеми, HTTP только удваивает запросы"""
+
+    def __init__(self, min_pages=20, max_share=0.8):
+        self.min_pages = min_pages
+        self.max_share = max_share
+        self.pages = 0
+        self.fallbacks = 0
+        self.enabled = True
+        self._lock = threading.Lock()
+
+    def record(self, fell_back):
+        """Итог одной страницы из HTTP: понадобился ли браузер"""
+        with self._lock:
+            if not self.enabled:
+                return
+            self.pages += 1
+            self.fallbacks += bool(fell_back)
+            if self.pages < self.min_pages or self.fallbacks / self.pages < self.max_share:
+                return
+            self.enabled = False
+            share = self.fallbacks / self.pages
+        metrics.set("http_backend_enabled", 0)
+        logger.warning(f"По HTTP без данных пришло {share:.0%} карточек из {self.pages}, "
+                       f"дальше карточки открываются сразу в Chrome")
+
+
+_shared_guard = None
+_shared_guard_lock = threading.Lock()
+
+
+def get_shared_fallback_guard():
+    """Один учет на процесс, общий для всех парсеров и потоков"""
+    global _shared_guard
+    with _shared_guard_lock:
+        if _shared_guard is None:
+            _shared_guard = BrowserFallbackGuard()
+        return _shared_guard
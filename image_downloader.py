@@ -0,0 +1,285 @@
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from concurrent.futures import Future, ThreadPoolExecutor
+from http_fetch import DEFAULT_HEADERS
+from product_record import ProductRecord
+from metrics import get_metrics, setup_logging
+import argparse
+import threading
+import hashlib
+import sqlite3
+import requests
+import time
+import json
+import os
+import logging
+
+
+logger = logging.getLogger(__name__)
+metrics = get_metrics()
+
+
+EXTENSIONS = {
+    'image/jpeg': '.jpg',
+    'image/webp': '.webp',
+    'image/png': '.png',
+    'image/gif': '.gif',
+    'image/avif': '.avif',
+}
+
+
+class ImageDownloader:
+    """Фото товаров параллельно через общий пул соединений; файлы по sha256, одинаковые хранятся один раз"""
+
+    def __init__(self, directory="images", max_workers=8, timeout=15, retries=2, scheduler=None):
+        self.directory = directory
+        self.max_workers = max_workers
+        self.timeout = timeout
+        # Фото отдает CDN, поэтому по умолчанию ограничиваем только числом одновременных загрузок
+        self.scheduler = scheduler
+        os.makedirs(directory, exist_ok=True)
+
+        self.downloaded = 0
+        self.duplicates = 0
+        self.skipped = 0
+        self.failed = 0
+        self.bytes_downloaded = 0
+        self.bytes_saved = 0
+        self.busy_time = 0.0
+        self._started_at = None
+
+        self._lock = threading.Lock()
+        # url -> Future загрузки: одну ссылку качает один поток, остальные ждут его результата
+        self._in_flight = {}
+        self.conn = sqlite3.connect(os.path.join(directory, "images.sqlite"), check_same_thread=False, timeout=30)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS images (
+                url TEXT PRIMARY KEY,
+                sha256 TEXT NOT NULL,
+                articul TEXT,
+                size INTEGER NOT NULL,
+                path TEXT NOT NULL,
+                downloaded_at REAL
+            )
+        """)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS images_sha256 ON images (sha256)")
+        self.conn.commit()
+
+        self.session = self.setup_session(retries)
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        # Не больше стольких картинок в очереди: если загрузка отстает, submit ждет
+        self._queue_slots = threading.BoundedSemaphore(max_workers * 4)
+
+    def setup_session(self, retries):
+        """Сессия с пулом соединений не меньше числа одновременных загрузок"""
+        session = requests.Session()
+        session.headers.update(DEFAULT_HEADERS)
+        session.headers['Accept'] = "image/avif,image/webp,image/*,*/*;q=0.8"
+        retry = Retry(
+            total=retries,
+            backoff_factor=0.5,
+            status_forcelist=[500, 502, 503, 504],
+            allowed_methods=["GET"],
+        )
+        adapter = HTTPAdapter(pool_connections=16, pool_maxsize=self.max_workers, max_retries=retry)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session
+
+    def known_path(self, url):
+        """Файл уже скачанной ссылки, если он на месте"""
+        with self._lock:
+            row = self.conn.execute("SELECT path, size FROM images WHERE url = ?", (url,)).fetchone()
+        if row and os.path.exists(os.path.join(self.directory, row[0])):
+            return row
+        return None
+
+    def download(self, url, articul=None):
+        """Одна картинка: путь к файлу относительно папки или None"""
+        if self._started_at is None:
+            self._started_at = time.monotonic()
+
+        with self._lock:
+            pending = self._in_flight.get(url)
+            owner = pending is None
+            if owner:
+                pending = self._in_flight[url] = Future()
+        if not owner:
+            # Ту же ссылку уже качает другой поток: ошибку он посчитал сам, готовый файл - пропуск
+            if pending.result() is None:
+                return None
+            return self.skip_known(url)
+
+        try:
+            path = self.skip_known(url) or self.fetch(url, articul)
+        except BaseException as e:
+            pending.set_exception(e)
+            raise
+        else:
+            pending.set_result(path)
+        finally:
+            with self._lock:
+                del self._in_flight[url]
+        return path
+
+    def skip_known(self, url):
+        """Путь уже скачанной ссылки с учетом в статистике или None"""
+        known = self.known_path(url)
+        if not known:
+            return None
+        metrics.inc("images", result="skipped")
+        with self._lock:
+            self.skipped += 1
+            self.bytes_saved += known[1]
+        return known[0]
+
+    def fetch(self, url, articul=None):
+        """Загрузка и сохранение картинки, вызывается только владельцем ссылки в _in_flight"""
+        if self.scheduler:
+            self.scheduler.acquire(url)
+        started = time.monotonic()
+        try:
+            with metrics.timer("image_download"):
+                response = self.session.get(url, timeout=self.timeout)
+            ok = response.status_code == 200
+        except requests.RequestException as e:
+            response, ok = None, False
+            logger.warning(f"Ошибка загрузки картинки {url}: {e}")
+        elapsed = time.monotonic() - started
+        if self.scheduler:
+            self.scheduler.report(url, elapsed, ok=ok, blocked=response is not None and response.status_code == 429)
+
+        if not ok:
+            metrics.inc("images", result="failed")
+            if response is not None:
+                logger.warning(f"HTTP {response.status_code} для картинки {url}")
+            with self._lock:
+                self.failed += 1
+                self.busy_time += elapsed
+            return None
+
+        content = response.content
+        digest = hashlib.sha256(content).hexdigest()
+        content_type = response.headers.get('Content-Type', '').split(';')[0].strip()
+        extension = EXTENSIONS.get(content_type) or os.path.splitext(url.split('?')[0])[1] or '.bin'
+        # Две буквы хэша - подпапка, чтобы в одной папке не было сотен тысяч файлов
+        path = os.path.join(digest[:2], digest + extension)
+        full_path = os.path.join(self.directory, path)
+
+        with self._lock:
+            self.bytes_downloaded += len(content)
+            self.busy_time += elapsed
+            if os.path.exists(full_path):
+                # Та же фотография у другого цвета или товара
+                self.duplicates += 1
+                self.bytes_saved += len(content)
+                metrics.inc("images", result="duplicate")
+            else:
+                os.makedirs(os.path.dirname(full_path), exist_ok=True)
+                with open(full_path + ".part", 'wb') as f:
+                    f.write(content)
+                os.replace(full_path + ".part", full_path)
+                self.downloaded += 1
+                metrics.inc("images", result="new")
+            self.conn.execute(
+                "INSERT OR REPLACE INTO images (url, sha256, articul, size, path, downloaded_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (url, digest, articul, len(content), path, time.time())
+            )
+            self.conn.commit()
+        return path
+
+    def download_many(self, urls, articul=None):
+        """Параллельная загрузка, пути в порядке ссылок"""
+        return list(self.executor.map(lambda url: self.download(url, articul), urls))
+
+    def submit(self, product_data):
+        """Фото товара в фоновую загрузку, парсинг не ждет"""
+        if not isinstance(product_data, ProductRecord):
+            product_data = ProductRecord.from_dict(product_data)
+        articul = str(product_data.articul) if product_data.articul else None
+        futures = []
+        for url in product_data.image_urls:
+            self._queue_slots.acquire()
+            future = self.executor.submit(self.download, url, articul)
+            future.add_done_callback(lambda _: self._queue_slots.release())
+            futures.append(future)
+        return futures
+
+    def paths_for(self, articul):
+        """Файлы фото товара"""
+        with self._lock:
+            rows = self.conn.execute("SELECT path FROM images WHERE articul = ? ORDER BY rowid",
+                                     (str(articul),)).fetchall()
+        return [path for (path,) in rows]
+
+    def stats(self):
+        """Скорость загрузки и сэкономленный объем"""
+        elapsed = time.monotonic() - self._started_at if self._started_at else 0.0
+        return {
+            'downloaded': self.downloaded,
+            'duplicates': self.duplicates,
+            'skipped': self.skipped,
+            'failed': self.failed,
+            'mb_downloaded': round(self.bytes_downloaded / 1024 / 1024, 2),
+            'mb_saved': round(self.bytes_saved / 1024 / 1024, 2),
+            'mb_per_sec': round(self.bytes_downloaded / 1024 / 1024 / elapsed, 2) if elapsed else 0.0,
+            'images_per_sec': round((self.downloaded + self.duplicates) / elapsed, 1) if elapsed else 0.0,
+        }
+
+    def print_stats(self):
+        """Вывод статистики загрузки"""
+        stats = self.stats()
+        logger.info(f"Картинки: новых файлов {stats['downloaded']}, дубликатов по содержимому {stats['duplicates']}, "
+                    f"уже были на диске {stats['skipped']}, ошибок {stats['failed']}; "
+                    f"скачано {stats['mb_downloaded']} МБ ({stats['mb_per_sec']} МБ/с, {stats['images_per_sec']} шт/с), "
+                    f"сэкономлено {stats['mb_saved']} МБ")
+
+    def close(self):
+        """Дожидаемся фоновых загрузок и закрываем сессию"""
+        self.executor.shutdown(wait=True)
+        self.session.close()
+        with self._lock:
+            self.conn.close()
+
+
+def iter_catalog_products(filename):
+    """Товары из каталога jsonl или из состояния обхода"""
+    if filename.endswith(".jsonl"):
+        with open(filename, 'r', encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    yield ProductRecord.from_dict(json.loads(line))
+    else:
+        from crawl_state import CrawlState
+
+        state = CrawlState(filename)
+        try:
+            yield from state.iter_done_products()
+        finally:
+            state.close()
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Загрузка фото товаров из готового каталога")
+    arg_parser.add_argument("catalog", nargs="?", default="crawl_state.sqlite",
+                            help="wildberries_catalog.jsonl или файл состояния обхода")
+    arg_parser.add_argument("--images-dir", default="images")
+    arg_parser.add_argument("--workers", type=int, default=8,
+                            help="Число одновременных загрузок")
+    args = arg_parser.parse_args()
+    setup_logging()
+
+    downloader = ImageDownloader(args.images_dir, max_workers=args.workers)
+    try:
+        products = 0
+        for product in iter_catalog_products(args.catalog):
+            downloader.submit(product)
+            products += 1
+        logger.info(f"Товаров с фото в очереди: {products}")
+    except Exception as e:
+        logger.error(f"Ошибка при загрузке фото: {e}")
+    finally:
+        downloader.close()
+        downloader.print_stats()
@@ -0,0 +1,247 @@
+from crawl_state import articul_from_url
+from product_record import ProductRecord
+from exporters import StreamingExporter, SINKS
+from metrics import get_metrics, add_observability_arguments, start_observability, finish_observability
+import argparse
+import threading
+import hashlib
+import sqlite3
+import json
+import time
+import re
+import logging
+
+
+logger = logging.getLogger(__name__)
+metrics = get_metrics()
+
+
+NEW = "new"
+CHANGED = "changed"
+UNCHANGED = "unchanged"
+
+# Поля, изменения которых пишутся в историю
+TRACKED_FIELDS = ('price', 'rating', 'reviews_count')
+
+# Скрипты и стили меняются от загрузки к загрузке (токены, счетчики), в отпечаток страницы не входят
+_VOLATILE_RE = re.compile(r'<(script|style|noscript)\b.*?</\1\s*>', re.S | re.I)
+_SPACES_RE = re.compile(r'\s+')
+
+
+def content_hash(html):
+    """Отпечаток сырой страницы без скриптов, стилей и разницы в пробелах"""
+    text = _SPACES_RE.sub(' ', _VOLATILE_RE.sub('', html))
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def fields_hash(record):
+    """Отпечаток извлеченных полей: ссылка не входит, у одного артикула она бывает разной"""
+    data = record.to_dict()
+    data.pop('url', None)
+    return hashlib.sha256(json.dumps(data, ensure_ascii=False, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def change_row(record, change, previous):
+    """Строка выгрузки изменений: товар, тип изменения и прошлые цена, рейтинг и отзывы"""
+    row = record.to_row()
+    row['change'] = change
+    for field in TRACKED_FIELDS:
+        row[f'old_{field}'] = previous.get(field) if previous else None
+    return row
+
+
+class ChangeTracker:
+    """Отпечатки карточек по артикулам и история цены, рейтинга и числа отзывов"""
+
+    def __init__(self, path="history.sqlite"):
+        self.path = path
+        self.counts_by_change = {NEW: 0, CHANGED: 0, UNCHANGED: 0}
+        self.skipped_parses = 0
+
+        # Отпечаток страницы между unchanged() и record() одного артикула
+        self._pending_hashes = {}
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS cards (
+                articul TEXT PRIMARY KEY,
+                content_hash TEXT,
+                fields_hash TEXT NOT NULL,
+                data TEXT NOT NULL,
+                first_seen REAL,
+                checked_at REAL,
+                changed_at REAL
+            )
+        """)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS history (
+                articul TEXT NOT NULL,
+                observed_at REAL NOT NULL,
+                price INTEGER,
+                rating REAL,
+                reviews_count INTEGER
+            )
+        """)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS history_articul ON history (articul, observed_at)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS cards_changed ON cards (changed_at)")
+        self.conn.commit()
+
+    def unchanged(self, url, html):
+        """Прошлая запись, если страница не изменилась, иначе None и разбор как обычно"""
+        articul = articul_from_url(url)
+        if not articul:
+            return None
+        page_hash = content_hash(html)
+        with self._lock:
+            row = self.conn.execute("SELECT content_hash, data FROM cards WHERE articul = ?",
+                                    (articul,)).fetchone()
+            if row is None or row[0] != page_hash:
+                self._pending_hashes[articul] = page_hash
+                return None
+            self.skipped_parses += 1
+        metrics.inc("incremental_skipped_parses")
+        record = ProductRecord.from_dict(json.loads(row[1]))
+        record.url = url
+        return record
+
+    def record(self, record):
+        """Сравниваем товар с прошлым обходом; возвращает тип изменения и прошлые значения полей истории"""
+        articul = str(record.articul or articul_from_url(record.url) or "")
+        if not articul:
+            return NEW, None
+        now = time.time()
+        new_hash = fields_hash(record)
+        with self._lock:
+            page_hash = self._pending_hashes.pop(articul, None)
+            row = self.conn.execute("SELECT fields_hash, data FROM cards WHERE articul = ?",
+                                    (articul,)).fetchone()
+
+            if row is not None and row[0] == new_hash:
+                change, previous = UNCHANGED, None
+                # Страница поменялась только в разметке - запоминаем ее, чтобы завтра не разбирать снова
+                self.conn.execute(
+                    "UPDATE cards SET checked_at = ?, content_hash = COALESCE(?, content_hash) WHERE articul = ?",
+                    (now, page_hash, articul)
+                )
+            else:
+                previous = json.loads(row[1]) if row is not None else None
+                change = NEW if previous is None else CHANGED
+                data = json.dumps(record.to_dict(), ensure_ascii=False)
+                self.conn.execute(
+                    "INSERT INTO cards (articul, content_hash, fields_hash, data, first_seen, checked_at, changed_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?) "
+                    "ON CONFLICT(articul) DO UPDATE SET content_hash = excluded.content_hash, "
+                    "fields_hash = excluded.fields_hash, data = excluded.data, "
+                    "checked_at = excluded.checked_at, changed_at = excluded.changed_at",
+                    (articul, page_hash, new_hash, data, now, now, now)
+                )
+                if previous is None or any(previous.get(field) != getattr(record, field)
+                                           for field in TRACKED_FIELDS):
+                    self.conn.execute(
+                        "INSERT INTO history (articul, observed_at, price, rating, reviews_count) "
+                        "VALUES (?, ?, ?, ?, ?)",
+                        (articul, now, record.price, record.rating, record.reviews_count)
+                    )
+            self.conn.commit()
+            self.counts_by_change[change] += 1
+        metrics.inc("incremental_cards", change=change)
+        return change, previous
+
+    def history(self, articul):
+        """Изменения цены, рейтинга и отзывов артикула по времени"""
+        with self._lock:
+            rows = self.conn.execute(
+                "SELECT observed_at, price, rating, reviews_count FROM history WHERE articul = ? "
+                "ORDER BY observed_at",
+                (str(articul),)
+            ).fetchall()
+        return [{'observed_at': observed_at, 'price': price, 'rating': rating, 'reviews_count': reviews_count}
+                for observed_at, price, rating, reviews_count in rows]
+
+    def iter_changed(self, since, chunk_size=500):
+        """Товары, новые или измененные после момента since"""
+        last_rowid = 0
+        while True:
+            with self._lock:
+                rows = self.conn.execute(
+                    "SELECT rowid, data, first_seen, changed_at FROM cards "
+                    "WHERE changed_at >= ? AND rowid > ? ORDER BY rowid LIMIT ?",
+                    (since, last_rowid, chunk_size)
+                ).fetchall()
+            if not rows:
+                return
+            for rowid, data, first_seen, changed_at in rows:
+                yield ProductRecord.from_dict(json.loads(data)), NEW if first_seen >= since else CHANGED
+            last_rowid = rows[-1][0]
+
+    def previous_values(self, articul, before):
+        """Значения полей истории на момент до before"""
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT price, rating, reviews_count FROM history WHERE articul = ? AND observed_at < ? "
+                "ORDER BY observed_at DESC LIMIT 1",
+                (str(articul), before)
+            ).fetchone()
+        return dict(zip(TRACKED_FIELDS, row)) if row else None
+
+    def counts(self):
+        """Сколько карточек и записей истории"""
+        with self._lock:
+            cards = self.conn.execute("SELECT COUNT(*) FROM cards").fetchone()[0]
+            history = self.conn.execute("SELECT COUNT(*) FROM history").fetchone()[0]
+        return {'cards': cards, 'history': history}
+
+    def print_stats(self):
+        """Итог инкрементального обхода"""
+        counts = self.counts_by_change
+        logger.info(f"Изменения: новых {counts[NEW]}, изменилось {counts[CHANGED]}, без изменений {counts[UNCHANGED]} "
+                    f"(из них без разбора {self.skipped_parses})")
+
+    def close(self):
+        """Закрытие базы"""
+        with self._lock:
+            self.conn.close()
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="История цен и выгрузка изменений каталога")
+    arg_parser.add_argument("--history", default="history.sqlite", help="Файл истории карточек")
+    subparsers = arg_parser.add_subparsers(dest="command", required=True)
+
+    changes_parser = subparsers.add_parser("changes", help="Выгрузка новых и измененных товаров")
+    changes_parser.add_argument("--since-hours", type=float, default=24,
+                                help="За сколько последних часов")
+    changes_parser.add_argument("--format", default="xlsx",
+                                help=f"Форматы экспорта через запятую: {', '.join(SINKS)}")
+    changes_parser.add_argument("--output", default="wildberries_catalog_changes",
+                                help="Имя файла без расширения")
+
+    history_parser = subparsers.add_parser("history", help="История цены, рейтинга и отзывов артикула")
+    history_parser.add_argument("articul")
+
+    add_observability_arguments(arg_parser)
+    args = arg_parser.parse_args()
+    start_observability(args)
+
+    tracker = ChangeTracker(args.history)
+    try:
+        if args.command == "changes":
+            since = time.time() - args.since_hours * 3600
+            exporter = StreamingExporter(formats=[fmt.strip() for fmt in args.format.split(",")],
+                                         output=args.output, rules=[])
+            for record, change in tracker.iter_changed(since):
+                previous = tracker.previous_values(record.articul, since) if change == CHANGED else None
+                exporter.write(change_row(record, change, previous))
+            exporter.close()
+        else:
+            entries = tracker.history(args.articul)
+            if not entries:
+                logger.info(f"Нет истории по артикулу {args.articul}")
+            for entry in entries:
+                observed = time.strftime("%Y-%m-%d %H:%M", time.localtime(entry['observed_at']))
+                logger.info(f"{observed}  цена {entry['price']}  рейтинг {entry['rating']}  "
+                            f"отзывов {entry['reviews_count']}")
+    finally:
+        tracker.close()
+        finish_observability(args)
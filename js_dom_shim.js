@@ -0,0 +1,100 @@
+// Минимальный DOM для проверки скриптов js_extract.py без браузера: benchmark.py --check
+// передает на stdin JSON {tree, script, args}, где tree - дерево страницы, разобранное как в ExtractionEngine.
+// Поддерживаются только те селекторы, что есть в скриптах: тег, классы, [attr] и [attr*='...'], потомок через пробел
+const fs = require('fs');
+
+const SHOW_ELEMENT = 1;
+const SHOW_TEXT = 4;
+const FILTER_ACCEPT = 1;
+const FILTER_REJECT = 2;
+global.NodeFilter = {SHOW_ELEMENT, SHOW_TEXT, FILTER_ACCEPT, FILTER_REJECT};
+
+function build(node, parent) {
+    if (typeof node === 'string') {
+        return {nodeType: 3, data: node, parentNode: parent, childNodes: []};
+    }
+    const element = {nodeType: 1, tagName: node.tag.toUpperCase(), attrs: node.attrs, parentNode: parent};
+    element.getAttribute = name => (name in element.attrs ? element.attrs[name] : null);
+    element.querySelectorAll = selector => querySelectorAll(element, selector);
+    element.querySelector = selector => querySelectorAll(element, selector)[0] || null;
+    element.childNodes = node.children.map(child => build(child, element));
+    return element;
+}
+
+function descendants(root) {
+    const result = [];
+    (function visit(node) {
+        for (const child of node.childNodes) {
+            if (child.nodeType === 1) {
+                result.push(child);
+                visit(child);
+            }
+        }
+    })(root);
+    return result;
+}
+
+function parseCompound(text) {
+    const match = text.match(/^([a-zA-Z][\w-]*)?((?:\.[\w-]+|\[[\w-]+(?:\*=['"][^'"]*['"])?\])*)$/);
+    if (!match) throw new Error(`селектор не поддерживается: ${text}`);
+    const compound = {tag: match[1] ? match[1].toUpperCase() : null, classes: [], attrs: []};
+    const parts = /\.([\w-]+)|\[([\w-]+)(?:\*=['"]([^'"]*)['"])?\]/g;
+    let part;
+    while ((part = parts.exec(match[2]))) {
+        if (part[1]) compound.classes.push(part[1]);
+        else compound.attrs.push([part[2], part[3]]);
+    }
+    return compound;
+}
+
+function matchesCompound(element, compound) {
+    if (compound.tag && element.tagName !== compound.tag) return false;
+    const classes = (element.getAttribute('class') || '').split(/\s+/);
+    if (!compound.classes.every(name => classes.includes(name))) return false;
+    return compound.attrs.every(([name, substring]) => {
+        const value = element.getAttribute(name);
+        return value !== null && (!substring || value.includes(substring));
+    });
+}
+
+function matchesSelector(element, selector) {
+    const compounds = selector.trim().split(/\s+/).map(parseCompound);
+    if (compounds.length > 2) throw new Error(`селектор не поддерживается: ${selector}`);
+    if (!matchesCompound(element, compounds[compounds.length - 1])) return false;
+    if (compounds.length === 1) return true;
+    for (let node = element.parentNode; node; node = node.parentNode) {
+        if (matchesCompound(node, compounds[0])) return true;
+    }
+    return false;
+}
+
+function querySelectorAll(root, selectorList) {
+    const selectors = selectorList.split(',');
+    return descendants(root).filter(element => selectors.some(selector => matchesSelector(element, selector)));
+}
+
+function createTreeWalker(root, whatToShow, filter) {
+    // Обход в порядке документа; отклоненный узел пропускается вместе с потомками, как FILTER_REJECT в браузере
+    const nodes = [];
+    (function visit(node) {
+        for (const child of node.childNodes) {
+            const shown = whatToShow & (child.nodeType === 1 ? SHOW_ELEMENT : SHOW_TEXT);
+            if (shown && filter.acceptNode(child) === FILTER_REJECT) continue;
+            if (shown) nodes.push(child);
+            visit(child);
+        }
+    })(root);
+    let position = 0;
+    return {nextNode: () => nodes[position++] || null};
+}
+
+const input = JSON.parse(fs.readFileSync(0, 'utf8'));
+const root = build(input.tree, null);
+global.document = {
+    querySelector: selector => root.querySelector(selector),
+    querySelectorAll: selector => root.querySelectorAll(selector),
+    createTreeWalker,
+};
+// Как execute_script в Selenium: скрипт - тело функции, аргументы доступны через arguments
+const result = new Function(input.script).apply(null, input.args);
+process.stdout.write(JSON.stringify(result === undefined ? null : result));
@@ -0,0 +1,162 @@
+from extraction import FIELD_SELECTORS, IMAGE_HOSTS, MAX_IMAGES
+from metrics import get_metrics
+import json
+import logging
+
+
+logger = logging.getLogger(__name__)
+metrics = get_metrics()
+
+
+# Настройки, общие с Python экстракторами, встраиваются в скрипт один раз при импорте
+_CONFIG = {
+    'fields': FIELD_SELECTORS,
+    'imageHosts': list(IMAGE_HOSTS),
+    'maxImages': MAX_IMAGES,
+}
+
+# Функции разбора в браузере, повторяют ExtractionEngine: текст как get_text(strip=True),
+# первое совпадение селекторов поля в порядке приоритета, те же правила для цены и картинок
+_HELPERS = """
+const config = %s;
+const SKIP = new Set(['SCRIPT', 'STYLE', 'TEMPLATE']);
+
+function textOf(element) {
+    const parts = [];
+    const walker = document.createTreeWalker(element, NodeFilter.SHOW_ELEMENT | NodeFilter.SHOW_TEXT, {
+        acceptNode(node) {
+            return node.nodeType === 1 && SKIP.has(node.tagName) ? NodeFilter.FILTER_REJECT : NodeFilter.FILTER_ACCEPT;
+        }
+    });
+    let node;
+    while ((node = walker.nextNode())) {
+        if (node.nodeType === 3) {
+            const text = node.data.trim();
+            if (text) parts.push(text);
+        }
+    }
+    return parts.join('');
+}
+""" % json.dumps(_CONFIG, ensure_ascii=False)
+
+PRODUCT_SCRIPT = _HELPERS + """
+// arguments[0] - селекторы полей в порядке проверки от реестра, без него исходный приоритет
+const fields = arguments[0] || config.fields;
+const matches = {};
+const used = {};
+for (const [field, selectors] of Object.entries(fields)) {
+    matches[field] = [];
+    used[field] = null;
+    for (const selector of selectors) {
+        const element = document.querySelector(selector);
+        if (element) matches[field].push([selector, element]);
+    }
+}
+
+function pick(field, convert) {
+    for (const [selector, element] of matches[field]) {
+        const value = convert(element);
+        if (value !== null) {
+            used[field] = selector;
+            return value;
+        }
+    }
+    return null;
+}
+
+function toNumber(element, pattern, comma) {
+    let text = textOf(element);
+    if (comma) text = text.replace(/,/g, '.');
+    const match = text.match(pattern);
+    if (match) {
+        const value = Number(match[0]);
+        if (!Number.isNaN(value)) return value;
+    }
+    return null;
+}
+
+let price = null;
+for (const element of document.querySelectorAll(
+        'span[class*="price"], div[class*="price"], ins[class*="price"], ' +
+        'span[class*="Price"], div[class*="Price"], ins[class*="Price"]')) {
+    const text = textOf(element);
+    if (text.includes('₽') && /\\d/.test(text)) {
+        price = text.split('₽')[0].trim();
+        break;
+    }
+}
+
+const images = [];
+for (const img of document.querySelectorAll('img[src]')) {
+    const src = img.getAttribute('src');
+    if (!/\\.(webp|jpg|png|jpeg)/.test(src) || !src.startsWith('http') || images.includes(src)) continue;
+    if (config.imageHosts.some(host => src.includes(host))) {
+        images.push(src);
+        if (images.length >= config.maxImages) break;
+    }
+}
+
+const characteristics = [];
+const params = document.querySelector('div.product-params');
+if (params) {
+    for (const row of params.querySelectorAll('div.product-params__row')) {
+        const label = row.querySelector('span.product-params__label');
+        const value = row.querySelector('span.product-params__value');
+        if (label && value) characteristics.push([textOf(label), textOf(value)]);
+    }
+}
+
+return {
+    name: pick('name', textOf),
+    price: price,
+    rating: pick('rating', element => toNumber(element, /[\\d.]+/, true)),
+    reviews_count: pick('reviews_count', element => toNumber(element, /\\d+/, false)),
+    description: pick('description', textOf),
+    images: images,
+    characteristics: characteristics,
+    seller_name: pick('seller_name', textOf),
+    seller_href: pick('seller_url', element => element.getAttribute('href') || null),
+    used: used,
+};
+"""
+
+LINKS_SCRIPT = """
+const links = [];
+for (const card of document.querySelectorAll('article.product-card')) {
+    const link = card.querySelector('a.product-card__link');
+    const href = link && link.getAttribute('href');
+    if (href) links.push(href);
+}
+return links;
+"""
+
+
+def extract_product(driver, registry=None):
+    """Поля товара одним вызовом execute_script, в том же виде, что и parse_product_page"""
+    orders = {field: registry.order(field) for field in FIELD_SELECTORS} if registry else None
+    with metrics.timer("js_extract", stage="product"):
+        result = driver.execute_script(PRODUCT_SCRIPT, orders)
+
+    # Попадание - только у селектора, чье значение взято, как в ExtractionEngine
+    if registry:
+        for field, order in orders.items():
+            registry.record(field, order, result['used'][field])
+
+    characteristics = dict(result['characteristics'])
+    return {
+        'name': result['name'] if result['name'] is not None else "Название не найдено",
+        'price': result['price'] if result['price'] is not None else "Цена не найдена",
+        'rating': float(result['rating']) if result['rating'] is not None else 0.0,
+        'reviews_count': int(result['reviews_count']) if result['reviews_count'] is not None else 0,
+        'description': result['description'] if result['description'] is not None else "Описание отсутствует",
+        'images': ', '.join(result['images']),
+        'characteristics': json.dumps(characteristics, ensure_ascii=False) if characteristics else "",
+        'seller_name': result['seller_name'] if result['seller_name'] is not None else "Продавец не указан",
+        'seller_url': "https://www.wildberries.ru" + result['seller_href'] if result['seller_href'] else "",
+    }
+
+
+def extract_card_links(driver):
+    """Ссылки карточек выдачи без передачи html страницы"""
+    with metrics.timer("js_extract", stage="search"):
+        return driver.execute_script(LINKS_SCRIPT) or []
@@ -1,93 +1,292 @@
-from webdriver_manager.chrome import ChromeDriverManager
-from selenium.webdriver.chrome.service import Service
-from selenium import webdriver
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
-from selenium.webdriver.chrome.options import Options
+from selenium.common.exceptions import TimeoutException
 from bs4 import BeautifulSoup
+from rate_limit import get_shared_scheduler, looks_blocked
+from driver_factory import get_shared_driver_pool, LOAD_PROFILES
+from page_cache import PageCache
+from crawl_state import articul_from_url
+from link_index import LinkIndex
+from js_extract import extract_card_links
+from failures import get_shared_failure_log, classify_exception, RetryPolicy, CrawlFailure, BLOCKED
+from metrics import get_metrics, add_observability_arguments, start_observability, finish_observability
+from concurrent.futures import ThreadPoolExecutor
+import argparse
+import threading
 import json
 import time
 import re
+import logging
+
+
+logger = logging.getLogger(__name__)
+metrics = get_metrics()
 
 
 class LinkCollector:
-    def __init__(self):
+    def __init__(self, start_driver=True, scheduler=None, cache=None, driver_pool=None,
+                 pagination="direct", page_workers=1, extractor="html", retry_policy=None, failure_log=None):
         self.wb_url = "https://www.wildberries.ru/"
         self.driver = None
-        self.setup_driver()
+        # direct - страницы по адресу &page=N в page_workers браузеров, click - кнопкой "дальше" в одном
+        self.pagination = pagination
+        self.page_workers = page_workers
+        # html - page_source и разбор в Python, js - ссылки собирает скрипт в браузере
+        self.extractor = extractor
+        # Страница выдачи повторяется с паузой при таймауте или блокировке, а не обрывает сбор
+        self.retry_policy = retry_policy or RetryPolicy(base_delay=5, max_delay=60)
+        self.failures = failure_log or get_shared_failure_log()
+        self.driver_pool = driver_pool or get_shared_driver_pool()
+        self.scheduler = scheduler or get_shared_scheduler()
+        self.cache = cache
+        if start_driver and not (cache and cache.cache_only):
+            self.setup_driver()
 
     def setup_driver(self):
-        """Настройка браузера"""
-        chrome_options = Options()
-        chrome_options.add_argument("--no-sandbox")
-        chrome_options.add_argument("--disable-dev-shm-usage")
-        chrome_options.add_argument("--disable-blink-features=AutomationControlled")
-        chrome_options.add_experimental_option("excludeSwitches", ["enable-automation"])
-        chrome_options.add_experimental_option('useAutomationExtension', False)
-        chrome_options.add_argument("--user-agent=Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36")
-
-        service = Service(ChromeDriverManager().install())
-        self.driver = webdriver.Chrome(service=service, options=chrome_options)
+        """Настройка браузера: прогретый из общего пула или новый"""
+        self.driver = self.driver_pool.acquire()
 
     def collect_product_links(self, query, pages=2):
-        """Поиск товаров и сбор ссылок"""
+        """Поиск товаров и сбор ссылок; при ошибке возвращаем то, что успели собрать"""
+        product_links = []
+        # Продвигаемые карточки повторяются на разных страницах, оставляем первое появление
+        seen = set()
         try:
-            encoded_query = query.replace(' ', '%20')
-            search_url = f"https://www.wildberries.ru/catalog/0/search.aspx?search={encoded_query}"
-            print(f"Ищем товары по запросу: {query}")
-            print(f"Переходим по ссылке: {search_url}")
+            for page_links in self.iter_product_links(query, pages):
+                for link in page_links:
+                    key = articul_from_url(link) or link
+                    if key not in seen:
+                        seen.add(key)
+                        product_links.append(link)
+        except Exception as e:
+            kind = classify_exception(e)
+            logger.warning(f"Ошибка при поиске товаров ({kind}): {e}", extra={'query': query, 'kind': kind})
+            self.failures.record(f"search:{query}", kind, e)
+
+        logger.info(f"Всего собрано ссылок на товары: {len(product_links)}")
+        return product_links
+
+    def collect_batch(self, queries, index, pages=2):
+        """Сбор по списку запросов через общий индекс артикулов, каждый товар в выдаче один раз"""
+        for number, query in enumerate(queries, start=1):
+            logger.info(f"Запрос {number} из {len(queries)}: {query}")
+            new_total = 0
+            try:
+                for page, page_links in enumerate(self.iter_product_links(query, pages), start=1):
+                    new_links = index.add_page(page_links, query, page)
+                    new_total += len(new_links)
+                    logger.info(f"  страница {page}: ссылок {len(page_links)}, новых артикулов {len(new_links)}")
+            except Exception as e:
+                logger.warning(f"Ошибка при поиске по запросу {query}: {e}")
+            logger.info(f"По запросу {query} новых товаров: {new_total}")
+
+        product_links = index.links_for_queries(queries)
+        logger.info(f"Всего уникальных товаров по запросам: {len(product_links)}")
+        return product_links
+
+    def load_queries(self, filename):
+        """Запросы из файла: по одному в строке, # - комментарий"""
+        with open(filename, 'r', encoding='utf-8') as f:
+            queries = [line.strip() for line in f if line.strip() and not line.strip().startswith('#')]
+        # Повторы запроса в файле ничего не добавят
+        return list(dict.fromkeys(queries))
+
+    def iter_product_links(self, query, pages=2):
+        """Постраничный сбор ссылок, ссылки страницы отдаются сразу после ее обработки"""
+        encoded_query = query.replace(' ', '%20')
+        search_url = f"https://www.wildberries.ru/catalog/0/search.aspx?search={encoded_query}"
+        logger.info(f"Ищем товары по запросу: {query}")
+
+        # Страницы, уже лежащие в кэше, отдаем без браузера
+        first_page = 1
+        while self.cache and first_page <= pages:
+            html = self.cache.get(self.page_url(search_url, first_page))
+            if html is None:
+                break
+            page_links = self.extract_links_from_page(html)
+            logger.info(f"Страница {first_page} из кэша, товаров: {len(page_links)}")
+            yield page_links
+            first_page += 1
 
-            self.driver.get(search_url)
-            time.sleep(5)
+        if first_page > pages:
+            return
+        if self.cache and self.cache.cache_only:
+            logger.warning(f"Страницы {first_page}+ нет в кэше, сбор остановлен")
+            return
+
+        if self.pagination == "direct":
+            yield from self.iter_pages_parallel(search_url, first_page, pages)
+            return
+
+        if self.driver is None:
+            self.setup_driver()
+
+        start_url = search_url if first_page == 1 else self.page_url(search_url, first_page)
+        logger.info(f"Переходим по ссылке: {start_url}")
+
+        self.scheduler.acquire(start_url)
+        started = time.monotonic()
+        try:
+            self.driver.get(start_url)
 
             # Ждем загрузки товаров
-            WebDriverWait(self.driver, 4).until(
+            WebDriverWait(self.driver, 15).until(
                 EC.presence_of_element_located((By.CLASS_NAME, "product-card"))
             )
+        except Exception:
+            blocked = looks_blocked(self.driver.current_url, self.driver.title)
+            self.scheduler.report(start_url, time.monotonic() - started, ok=False, blocked=blocked)
+            raise
+        self.scheduler.report(start_url, time.monotonic() - started)
+
+        for page in range(first_page, pages + 1):
+            logger.info(f"Обрабатываем страницу {page}")
 
-            product_links = []
-            for page in range(1, pages + 1):
-                print(f"Обрабатываем страницу {page}")
-
-                # Прокрутка для загрузки всех товаров
-                self.scroll_page()
-                time.sleep(2)
-
-                # Получаем HTML и извлекаем ссылки
-                html = self.driver.page_source
-                page_links = self.extract_links_from_page(html)
-                product_links.extend(page_links)
-
-                print(f"Найдено товаров на странице: {len(page_links)}")
-
-                # Переход на следующую страницу
-                if page < pages:
-                    try:
-                        next_btn = WebDriverWait(self.driver, 5).until(
-                            EC.element_to_be_clickable((By.CSS_SELECTOR, "a.pagination-next"))
-                        )
-                        if next_btn.is_enabled():
-                            self.driver.execute_script("arguments[0].click();", next_btn)
-                            time.sleep(3)
-                            WebDriverWait(self.driver, 10).until(
-                                EC.presence_of_element_located((By.CLASS_NAME, "product-card"))
-                            )
-                        else:
-                            break
-                    except Exception as e:
-                        print(f"Не удалось перейти на следующую страницу: {e}")
+            # Прокрутка для загрузки всех товаров
+            self.scroll_page()
+
+            # Получаем ссылки
+            page_links, html = self.read_search_page(self.driver)
+            metrics.inc("search_pages", result="ok" if page_links else "empty")
+            if self.cache and page_links and html:
+                self.cache.put(self.page_url(search_url, page), html)
+
+            logger.info(f"Найдено товаров на странице: {len(page_links)}")
+            yield page_links
+
+            # Переход на следующую страницу
+            if page < pages:
+                try:
+                    next_btn = WebDriverWait(self.driver, 5).until(
+                        EC.element_to_be_clickable((By.CSS_SELECTOR, "a.pagination-next"))
+                    )
+                    if next_btn.is_enabled():
+                        self.open_next_page(next_btn)
+                    else:
                         break
+                except Exception as e:
+                    logger.warning(f"Не удалось перейти на следующую страницу: {e}")
+                    break
 
-            print(f"Всего собрано ссылок на товары: {len(product_links)}")
-            return product_links
+    def iter_pages_parallel(self, search_url, first_page, pages):
+        """Страницы по прямым адресам в несколько браузеров, отдаются строго по порядку"""
+        # Свой браузер сборщика больше не нужен, пусть его заберет первый воркер
+        if self.driver:
+            self.driver_pool.release(self.driver)
+            self.driver = None
 
-        except Exception as e:
-            print(f"Ошибка при поиске товаров: {e}")
-            return []
+        local = threading.local()
+        drivers = []
+        drivers_lock = threading.Lock()
+
+        def load(page):
+            driver = getattr(local, 'driver', None)
+            if driver is None:
+                driver = local.driver = self.driver_pool.acquire()
+                with drivers_lock:
+                    drivers.append(driver)
+            return self.load_search_page_with_retries(driver, self.page_url(search_url, page))
+
+        executor = ThreadPoolExecutor(max_workers=self.page_workers)
+        in_flight = {}
+        next_page = first_page
+        try:
+            for page in range(first_page, pages + 1):
+                # Держим в работе не больше page_workers страниц вперед
+                while next_page <= pages and len(in_flight) < self.page_workers:
+                    in_flight[next_page] = executor.submit(load, next_page)
+                    next_page += 1
+
+                try:
+                    page_links, html = in_flight.pop(page).result()
+                except Exception as e:
+                    logger.warning(f"Не удалось загрузить страницу {page}: {e}")
+                    metrics.inc("search_pages", result="error")
+                    break
+
+                if not page_links:
+                    logger.info(f"На странице {page} нет товаров, выдача закончилась")
+                    metrics.inc("search_pages", result="empty")
+                    break
+                metrics.inc("search_pages", result="ok")
+                if self.cache and html:
+                    self.cache.put(self.page_url(search_url, page), html)
+
+                logger.info(f"Страница {page}, найдено товаров: {len(page_links)}")
+                yield page_links
+        finally:
+            # Страницы после пустой уже не нужны
+            for future in in_flight.values():
+                future.cancel()
+            executor.shutdown(wait=True)
+            for driver in drivers:
+                self.driver_pool.release(driver)
+
+    def load_search_page(self, driver, url):
+        """Ссылки и html страницы выдачи; пустая выдача - страница без карточек, а не ошибка"""
+        self.scheduler.acquire(url)
+        started = time.monotonic()
+        try:
+            with metrics.timer("driver_get", stage="search"):
+                driver.get(url)
+            with metrics.timer("wait_cards"):
+                WebDriverWait(driver, 15).until(
+                    EC.presence_of_element_located((By.CLASS_NAME, "product-card"))
+                )
+        except TimeoutException:
+            blocked = looks_blocked(driver.current_url, driver.title)
+            # Карточки не дождались: даже если это конец выдачи, хост отвечал медленно - снижаем темп
+            self.scheduler.report(url, time.monotonic() - started, ok=not blocked, blocked=blocked, slow=True)
+            if blocked:
+                raise CrawlFailure(BLOCKED, f"страница выдачи заблокирована: {driver.current_url}")
+            return self.read_search_page(driver)
+        except Exception:
+            blocked = looks_blocked(driver.current_url, driver.title)
+            self.scheduler.report(url, time.monotonic() - started, ok=False, blocked=blocked)
+            raise
+        self.scheduler.report(url, time.monotonic() - started)
+
+        self.scroll_page(driver=driver)
+        return self.read_search_page(driver)
+
+    def load_search_page_with_retries(self, driver, url):
+        """load_search_page с повторами по виду ошибки и экспоненциальной паузой"""
+        attempts = 0
+        while True:
+            try:
+                page = self.load_search_page(driver, url)
+                if attempts:
+                    self.failures.resolve(url)
+                return page
+            except Exception as e:
+                attempts += 1
+                kind = classify_exception(e)
+                self.failures.record(url, kind, e)
+                delay = self.retry_policy.delay(kind, attempts)
+                if delay is None:
+                    raise
+                logger.warning(f"Страница выдачи не загрузилась ({kind}), повтор через {delay:.0f} с: {url}")
+                time.sleep(delay)
+
+    def read_search_page(self, driver):
+        """Ссылки открытой страницы выдачи и ее html для кэша; в режиме js html не передается"""
+        if self.extractor == "js":
+            return extract_card_links(driver), None
+        with metrics.timer("page_source", stage="search"):
+            html = driver.page_source
+        return self.extract_links_from_page(html), html
+
+    def page_url(self, search_url, page):
+        """Адрес страницы выдачи, он же ключ кэша"""
+        return f"{search_url}&page={page}"
 
     def extract_links_from_page(self, html):
         """Извлекаем ссылки на товары со страницы"""
+        with metrics.timer("extract_links"):
+            return self._extract_links(html)
+
+    def _extract_links(self, html):
         soup = BeautifulSoup(html, 'html.parser')
         links = []
 
@@ -102,54 +301,134 @@ class LinkCollector:
                     full_url = link_tag['href']
                     links.append(full_url)
             except Exception as e:
-                print(f"Ошибка при извлечении ссылки: {e}")
+                logger.warning(f"Ошибка при извлечении ссылки: {e}")
                 continue
 
         return links
 
-    def scroll_page(self):
+    def open_next_page(self, next_btn):
+        """Переход на следующую страницу с ожиданием смены карточек"""
+        first_card = self.driver.find_element(By.CLASS_NAME, "product-card")
+        url = self.driver.current_url
+        self.scheduler.acquire(url)
+        started = time.monotonic()
+        try:
+            with metrics.timer("next_page"):
+                self.driver.execute_script("arguments[0].click();", next_btn)
+                WebDriverWait(self.driver, 10).until(EC.staleness_of(first_card))
+                WebDriverWait(self.driver, 10).until(
+                    EC.presence_of_element_located((By.CLASS_NAME, "product-card"))
+                )
+        except Exception:
+            blocked = looks_blocked(self.driver.current_url, self.driver.title)
+            self.scheduler.report(url, time.monotonic() - started, ok=False, blocked=blocked)
+            raise
+        self.scheduler.report(url, time.monotonic() - started)
+
+    @metrics.timed("scroll")
+    def scroll_page(self, timeout=2, driver=None):
         """Прокрутка страницы для загрузки всех товаров"""
-        last_height = self.driver.execute_script("return document.body.scrollHeight")
+        driver = driver or self.driver
+        last_height = driver.execute_script("return document.body.scrollHeight")
         for _ in range(3):
-            self.driver.execute_script("window.scrollTo(0, document.body.scrollHeight);")
-            time.sleep(2)
-            new_height = self.driver.execute_script("return document.body.scrollHeight")
-            if new_height == last_height:
+            driver.execute_script("window.scrollTo(0, document.body.scrollHeight);")
+            # Ждем подгрузки новых карточек, а не фиксированную паузу
+            try:
+                WebDriverWait(driver, timeout, poll_frequency=0.2).until(
+                    lambda d: d.execute_script("return document.body.scrollHeight") != last_height
+                )
+            except TimeoutException:
                 break
-            last_height = new_height
+            last_height = driver.execute_script("return document.body.scrollHeight")
 
     def save_links_to_file(self, links, filename="product_links.json"):
         """Сохраняем ссылки в файл"""
         try:
             with open(filename, 'w', encoding='utf-8') as f:
                 json.dump(links, f, ensure_ascii=False, indent=2)
-            print(f"Ссылки сохранены в файл: {filename}")
+            logger.info(f"Ссылки сохранены в файл: {filename}")
         except Exception as e:
-            print(f"Ошибка при сохранении ссылок: {e}")
+            logger.warning(f"Ошибка при сохранении ссылок: {e}")
 
     def close(self):
         """Закрытие браузера"""
         if self.driver:
-            self.driver.quit()
+            # Браузер не закрываем, а отдаем следующему сборщику или парсеру
+            self.driver_pool.release(self.driver)
+            self.driver = None
 
 
 if __name__ == "__main__":
-    collector = LinkCollector()
+    arg_parser = argparse.ArgumentParser(description="Сбор ссылок на товары Wildberries")
+    arg_parser.add_argument("query", nargs="?", default="пальто из натуральной шерсти")
+    arg_parser.add_argument("--pages", type=int, default=2)
+    arg_parser.add_argument("--queries-file", default=None,
+                            help="Файл с запросами, по одному в строке")
+    arg_parser.add_argument("--index", default="link_index.sqlite",
+                            help="Индекс артикулов для сбора по нескольким запросам")
+    arg_parser.add_argument("--pagination", choices=["direct", "click"], default="direct",
+                            help="direct - страницы по прямым адресам параллельно, click - кнопкой по одной")
+    arg_parser.add_argument("--page-workers", type=int, default=3,
+                            help="Сколько страниц выдачи грузить одновременно в режиме direct")
+    arg_parser.add_argument("--show-browser", action="store_true",
+                            help="Открывать окно Chrome вместо headless")
+    arg_parser.add_argument("--load-profile", choices=list(LOAD_PROFILES), default="lite",
+                            help="lite - не грузить картинки, шрифты, видео и счетчики")
+    arg_parser.add_argument("--cache", default=None,
+                            help="Файл кэша страниц (SQLite), например page_cache.sqlite")
+    arg_parser.add_argument("--cache-ttl", type=float, default=24,
+                            help="Время жизни страницы в кэше, часов")
+    arg_parser.add_argument("--cache-only", action="store_true",
+                            help="Брать выдачу только из кэша, без браузера")
+    arg_parser.add_argument("--extractor", choices=["html", "js"], default="html",
+                            help="js - ссылки собирает скрипт в браузере, без передачи page_source")
+    add_observability_arguments(arg_parser)
+    args = arg_parser.parse_args()
+    start_observability(args)
+
+    cache = None
+    if args.cache or args.cache_only:
+        cache = PageCache(args.cache or "page_cache.sqlite", ttl=args.cache_ttl * 3600,
+                          cache_only=args.cache_only)
+
+    driver_pool = get_shared_driver_pool()
+    driver_pool.headless = not args.show_browser
+    driver_pool.profile = args.load_profile
+
+    collector = LinkCollector(cache=cache, pagination=args.pagination, page_workers=args.page_workers,
+                              extractor=args.extractor)
     try:
-        print("Запуск сборщика ссылок Wildberries")
+        logger.info("Запуск сборщика ссылок Wildberries")
 
         # Собираем ссылки
-        product_links = collector.collect_product_links("пальто из натуральной шерсти", pages=2)
+        if args.queries_file:
+            index = LinkIndex(args.index)
+            try:
+                product_links = collector.collect_batch(collector.load_queries(args.queries_file), index,
+                                                        pages=args.pages)
+                index.print_stats()
+            finally:
+                index.close()
+        else:
+            product_links = collector.collect_product_links(args.query, pages=args.pages)
 
         if product_links:
             # Сохраняем ссылки в файл
             collector.save_links_to_file(product_links)
-            print(f"Готово! Собрано {len(product_links)} ссылок")
+            logger.info(f"Готово! Собрано {len(product_links)} ссылок")
         else:
-            print("Товары не найдены")
+            logger.info("Товары не найдены")
 
     except Exception as e:
-        print(f"Ошибка: {e}")
+        logger.error(f"Ошибка: {e}")
     finally:
         collector.close()
-        print("Работа завершена")
\ No newline at end of file
+        collector.failures.print_report()
+        collector.scheduler.print_stats()
+        driver_pool.print_stats()
+        driver_pool.close()
+        if cache:
+            cache.print_stats()
+            cache.close()
+        finish_observability(args)
+        logger.info("Работа завершена")
\ No newline at end of file
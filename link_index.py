@@ -0,0 +1,156 @@
+from crawl_state import articul_from_url
+import threading
+import hashlib
+import sqlite3
+import math
+import time
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_product_url(url):
+    """Каноническая ссылка на карточку по артикулу, без параметров и хвостов"""
+    articul = articul_from_url(url)
+    if not articul:
+        return None
+    return f"https://www.wildberries.ru/catalog/{articul}/detail.aspx"
+
+
+class BloomFilter:
+    """Фильтр Блума в памяти: "точно нет" без запроса к базе, "возможно есть" проверяется в базе"""
+
+    def __init__(self, capacity=1_000_000, error_rate=0.001):
+        self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def positions(self, key):
+        digest = hashlib.blake2b(key.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, key):
+        for position in self.positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, key):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self.positions(key))
+
+
+class LinkIndex:
+    """Постоянный индекс артикулов: один товар на все запросы и запуски, плюс откуда он пришел"""
+
+    def __init__(self, path="link_index.sqlite", capacity=1_000_000, error_rate=0.001):
+        self.path = path
+        self.bloom_skips = 0
+        self.db_checks = 0
+
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS articuls (
+                articul TEXT PRIMARY KEY,
+                url TEXT NOT NULL,
+                first_query TEXT,
+                first_seen REAL
+            )
+        """)
+        # Первое появление артикула в выдаче каждого запроса
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS sightings (
+                articul TEXT NOT NULL,
+                query TEXT NOT NULL,
+                page INTEGER,
+                position INTEGER,
+                seen_at REAL,
+                PRIMARY KEY (articul, query)
+            )
+        """)
+        self.conn.commit()
+
+        self.bloom = BloomFilter(capacity, error_rate)
+        for (articul,) in self.conn.execute("SELECT articul FROM articuls"):
+            self.bloom.add(articul)
+
+    def add_page(self, links, query, page):
+        """Ссылки одной страницы выдачи; возвращает нормализованные ссылки на новые артикулы"""
+        now = time.time()
+        new_links = []
+        with self._lock:
+            for position, url in enumerate(links, start=1):
+                articul = articul_from_url(url)
+                if not articul:
+                    continue
+
+                if self.is_known(articul):
+                    self.conn.execute(
+                        "INSERT OR IGNORE INTO sightings (articul, query, page, position, seen_at) "
+                        "VALUES (?, ?, ?, ?, ?)",
+                        (articul, query, page, position, now)
+                    )
+                    continue
+
+                normalized = normalize_product_url(url)
+                self.conn.execute(
+                    "INSERT INTO articuls (articul, url, first_query, first_seen) VALUES (?, ?, ?, ?)",
+                    (articul, normalized, query, now)
+                )
+                self.conn.execute(
+                    "INSERT OR IGNORE INTO sightings (articul, query, page, position, seen_at) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (articul, query, page, position, now)
+                )
+                self.bloom.add(articul)
+                new_links.append(normalized)
+            self.conn.commit()
+        return new_links
+
+    def is_known(self, articul):
+        """Проверка артикула: сначала фильтр Блума, база только при возможном совпадении"""
+        if articul not in self.bloom:
+            self.bloom_skips += 1
+            return False
+        self.db_checks += 1
+        return self.conn.execute("SELECT 1 FROM articuls WHERE articul = ?", (articul,)).fetchone() is not None
+
+    def sources(self, articul):
+        """Запросы, страницы и позиции, где встречался артикул"""
+        with self._lock:
+            rows = self.conn.execute(
+                "SELECT query, page, position FROM sightings WHERE articul = ? ORDER BY seen_at",
+                (str(articul),)
+            ).fetchall()
+        return [{'query': query, 'page': page, 'position': position} for query, page, position in rows]
+
+    def links_for_queries(self, queries):
+        """Уникальные ссылки всех товаров, найденных по этим запросам"""
+        placeholders = ", ".join("?" * len(queries))
+        with self._lock:
+            rows = self.conn.execute(
+                f"SELECT a.url FROM articuls a WHERE a.articul IN "
+                f"(SELECT DISTINCT articul FROM sightings WHERE query IN ({placeholders})) ORDER BY a.rowid",
+                list(queries)
+            ).fetchall()
+        return [url for (url,) in rows]
+
+    def counts(self):
+        """Сколько артикулов и появлений в выдаче"""
+        with self._lock:
+            articuls = self.conn.execute("SELECT COUNT(*) FROM articuls").fetchone()[0]
+            sightings = self.conn.execute("SELECT COUNT(*) FROM sightings").fetchone()[0]
+        return {'articuls': articuls, 'sightings': sightings}
+
+    def print_stats(self):
+        """Вывод статистики индекса"""
+        counts = self.counts()
+        logger.info(f"Индекс артикулов: {counts['articuls']} товаров, {counts['sightings']} появлений в выдаче, "
+                    f"без запроса к базе {self.bloom_skips}, проверок в базе {self.db_checks}")
+
+    def close(self):
+        """Закрытие базы"""
+        with self._lock:
+            self.conn.close()
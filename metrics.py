@@ -0,0 +1,327 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from contextlib import contextmanager
+import functools
+import threading
+import logging
+import json
+import time
+import sys
+
+
+logger = logging.getLogger(__name__)
+
+PREFIX = "wb_"
+
+# Границы корзин гистограмм в секундах: от разбора поля до загрузки страницы
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Стандартные поля LogRecord, все остальное в JSON логе - переданное через extra
+_RECORD_FIELDS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+
+class Histogram:
+    """Счетчики по корзинам, сумма, минимум и максимум"""
+
+    __slots__ = ('counts', 'count', 'sum', 'min', 'max')
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+    def observe(self, value):
+        for index, bound in enumerate(BUCKETS):
+            if value <= bound:
+                self.counts[index] += 1
+                break
+        else:
+            self.counts[-1] += 1
+        self.count += 1
+        self.sum += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def merge(self, other):
+        """Добавляем наблюдения другой гистограммы, например из процесса разбора"""
+        for index, bucket_count in enumerate(other.counts):
+            self.counts[index] += bucket_count
+        self.count += other.count
+        self.sum += other.sum
+        if other.min is not None:
+            self.min = other.min if self.min is None else min(self.min, other.min)
+            self.max = other.max if self.max is None else max(self.max, other.max)
+
+    def quantile(self, q):
+        """Оценка квантиля по верхней границе корзины"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for index, bucket_count in enumerate(self.counts):
+            seen += bucket_count
+            if seen >= rank:
+                return BUCKETS[index] if index < len(BUCKETS) else self.max
+        return self.max
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'sum': round(self.sum, 6),
+            'avg': round(self.sum / self.count, 6) if self.count else 0.0,
+            'min': round(self.min or 0.0, 6),
+            'max': round(self.max or 0.0, 6),
+            'p50': self.quantile(0.5),
+            'p95': self.quantile(0.95),
+        }
+
+
+def _key(name, labels):
+    return name, tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _labels_text(labels, extra=()):
+    items = list(labels) + list(extra)
+    if not items:
+        return ""
+    escaped = ['{}="{}"'.format(key, value.replace('\\', '\\\\').replace('"', '\\"')) for key, value in items]
+    return "{" + ",".join(escaped) + "}"
+
+
+class Metrics:
+    """Счетчики, значения и гистограммы времени по стадиям обхода"""
+
+    def __init__(self):
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+        self.started_at = time.time()
+        self._lock = threading.Lock()
+        self._server = None
+
+    def inc(self, name, value=1, **labels):
+        """Счетчик: успехи, ошибки, срабатывания запасных селекторов"""
+        key = _key(name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        """Текущее значение, например глубина очереди"""
+        with self._lock:
+            self.gauges[_key(name, labels)] = value
+
+    def observe(self, name, value, **labels):
+        """Значение в гистограмму, для таймеров - секунды"""
+        key = _key(name, labels)
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(value)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """Время блока в гистограмму name, в том числе если блок упал"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    def timed(self, name, **labels):
+        """Декоратор: время каждого вызова функции"""
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.timer(name, **labels):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def reset(self):
+        with self._lock:
+            self.counters.clear()
+            self.gauges.clear()
+            self.histograms.clear()
+            self.started_at = time.time()
+
+    def drain(self):
+        """Счетчики и гистограммы с момента прошлого drain: процесс разбора отдает их родителю"""
+        with self._lock:
+            counters, histograms = self.counters, self.histograms
+            self.counters, self.histograms = {}, {}
+        return counters, histograms
+
+    def merge(self, counters, histograms):
+        """Добавляем то, что вернул drain в другом процессе"""
+        with self._lock:
+            for key, value in counters.items():
+                self.counters[key] = self.counters.get(key, 0) + value
+            for key, other in histograms.items():
+                histogram = self.histograms.get(key)
+                if histogram is None:
+                    histogram = self.histograms[key] = Histogram()
+                histogram.merge(other)
+
+    def snapshot(self):
+        """Все метрики словарем для JSON"""
+        def entries(source, convert):
+            return [{'name': name, 'labels': dict(labels), **convert(value)}
+                    for (name, labels), value in sorted(source.items())]
+
+        with self._lock:
+            return {
+                'uptime': round(time.time() - self.started_at, 3),
+                'counters': entries(self.counters, lambda value: {'value': value}),
+                'gauges': entries(self.gauges, lambda value: {'value': value}),
+                'timers': entries(self.histograms, lambda histogram: histogram.to_dict()),
+            }
+
+    def to_json(self):
+        return json.dumps(self.snapshot(), ensure_ascii=False, indent=2)
+
+    def to_prometheus(self):
+        """Текстовый формат Prometheus"""
+        lines = []
+        with self._lock:
+            for (name, labels), value in sorted(self.counters.items()):
+                lines.append(f"{PREFIX}{name}_total{_labels_text(labels)} {value}")
+            for (name, labels), value in sorted(self.gauges.items()):
+                lines.append(f"{PREFIX}{name}{_labels_text(labels)} {value}")
+            for (name, labels), histogram in sorted(self.histograms.items()):
+                metric = f"{PREFIX}{name}_seconds"
+                cumulative = 0
+                for bound, bucket_count in zip(BUCKETS, histogram.counts):
+                    cumulative += bucket_count
+                    lines.append(f"{metric}_bucket{_labels_text(labels, [('le', str(bound))])} {cumulative}")
+                lines.append(f"{metric}_bucket{_labels_text(labels, [('le', '+Inf')])} {histogram.count}")
+                lines.append(f"{metric}_sum{_labels_text(labels)} {histogram.sum:.6f}")
+                lines.append(f"{metric}_count{_labels_text(labels)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, path):
+        """Сохраняем метрики: .prom - формат Prometheus, иначе JSON"""
+        text = self.to_prometheus() if path.endswith(".prom") else self.to_json()
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(text)
+        logger.info("Метрики сохранены в %s", path)
+
+    def log_summary(self, top=15):
+        """Куда ушло время: стадии по суммарному времени"""
+        with self._lock:
+            timers = sorted(self.histograms.items(), key=lambda item: item[1].sum, reverse=True)[:top]
+        if not timers:
+            return
+        logger.info("Время по стадиям (сумма / вызовов / среднее / p95):")
+        for (name, labels), histogram in timers:
+            label = name + _labels_text(labels)
+            logger.info("  %-45s %9.2f с %7d %9.4f с %8.3f с", label, histogram.sum, histogram.count,
+                        histogram.sum / histogram.count, histogram.quantile(0.95))
+
+    def serve(self, port, host="127.0.0.1"):
+        """Живые метрики по HTTP: /metrics - Prometheus, /metrics.json - JSON"""
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.startswith("/metrics.json"):
+                    body, content_type = metrics.to_json(), "application/json"
+                elif self.path.startswith("/metrics"):
+                    body, content_type = metrics.to_prometheus(), "text/plain; version=0.0.4"
+                else:
+                    self.send_error(404)
+                    return
+                data = body.encode('utf-8')
+                self.send_response(200)
+                self.send_header("Content-Type", f"{content_type}; charset=utf-8")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                logger.debug("metrics http: " + format, *args)
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        logger.info("Метрики доступны на http://%s:%d/metrics", host, self._server.server_port)
+        return self._server
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+
+class JsonFormatter(logging.Formatter):
+    """Строка лога - JSON объект, поля из extra попадают в него же"""
+
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record, "%Y-%m-%dT%H:%M:%S"),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_FIELDS and not key.startswith('_'):
+                entry[key] = value
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+def setup_logging(level="INFO", fmt="text"):
+    """Настройка логов для запуска из командной строки"""
+    handler = logging.StreamHandler(sys.stdout)
+    if fmt == "json":
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)-7s %(message)s", "%H:%M:%S"))
+    root = logging.getLogger()
+    root.handlers[:] = [handler]
+    root.setLevel(level.upper())
+    # Отладочные логи библиотек не нужны даже в DEBUG
+    for name in ("urllib3", "selenium", "WDM"):
+        logging.getLogger(name).setLevel(logging.WARNING)
+
+
+def add_observability_arguments(arg_parser):
+    """Общие флаги логов и метрик для скриптов"""
+    arg_parser.add_argument("--log-level", default="INFO", choices=["DEBUG", "INFO", "WARNING", "ERROR"],
+                            help="DEBUG - подробности по каждому элементу")
+    arg_parser.add_argument("--log-format", default="text", choices=["text", "json"])
+    arg_parser.add_argument("--metrics-out", default=None,
+                            help="Файл метрик в конце запуска: .json или .prom")
+    arg_parser.add_argument("--metrics-port", type=int, default=None,
+                            help="Порт для живых метрик по HTTP")
+
+
+def start_observability(args):
+    """Логи и живые метрики по флагам из add_observability_arguments"""
+    setup_logging(args.log_level, args.log_format)
+    if args.metrics_port is not None:
+        get_metrics().serve(args.metrics_port)
+
+
+def finish_observability(args):
+    """Итог по времени стадий и сохранение метрик"""
+    metrics = get_metrics()
+    metrics.log_summary()
+    if args.metrics_out:
+        metrics.write(args.metrics_out)
+    metrics.stop()
+
+
+_shared_metrics = None
+_shared_lock = threading.Lock()
+
+
+def get_metrics():
+    """Один реестр метрик на процесс"""
+    global _shared_metrics
+    with _shared_lock:
+        if _shared_metrics is None:
+            _shared_metrics = Metrics()
+        return _shared_metrics
@@ -0,0 +1,201 @@
+from metrics import setup_logging
+import argparse
+import json
+import os
+import re
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+
+# Любые пробелы внутри чисел: обычный, неразрывный, тонкий, узкий неразрывный
+SPACES_PATTERN = r'[\s\u00a0\u2009\u202f]+'
+INTEGER_PATTERN = r'(\d+)'
+DECIMAL_PATTERN = r'(\d+(?:\.\d+)?)'
+
+_SPACES_RE = re.compile(SPACES_PATTERN)
+_INTEGER_RE = re.compile(INTEGER_PATTERN)
+_DECIMAL_RE = re.compile(DECIMAL_PATTERN)
+
+# Колонка и способ приведения: целое или дробное
+NUMERIC_COLUMNS = {'price': 'int', 'rating': 'float', 'reviews_count': 'int'}
+
+DEFAULT_RULES = [
+    {
+        'name': 'filtered',
+        'output': 'filtered_catalog',
+        'conditions': [
+            {'column': 'rating', 'op': '>=', 'value': 4.5},
+            {'column': 'price', 'op': '<=', 'value': 10000},
+        ],
+    },
+]
+
+
+def to_number(value, kind='float'):
+    """Скалярная версия нормализации для построчного фильтра"""
+    if value is None or isinstance(value, (int, float)):
+        return value
+    text = _SPACES_RE.sub('', str(value)).replace(',', '.')
+    match = (_INTEGER_RE if kind == 'int' else _DECIMAL_RE).search(text)
+    if not match:
+        return None
+    return int(match.group()) if kind == 'int' else float(match.group())
+
+
+def normalize_column(series, kind):
+    """Текст в число строковыми операциями pandas над всей колонкой сразу"""
+    import pandas as pd
+
+    if pd.api.types.is_numeric_dtype(series):
+        return series
+    text = series.astype('string').str.replace(SPACES_PATTERN, '', regex=True).str.replace(',', '.', regex=False)
+    extracted = text.str.extract(INTEGER_PATTERN if kind == 'int' else DECIMAL_PATTERN, expand=False)
+    return pd.to_numeric(extracted, errors='coerce').astype('Int64' if kind == 'int' else 'Float64')
+
+
+def normalize_catalog(df):
+    """Цена, рейтинг и отзывы в числовые колонки за один проход по каждой колонке"""
+    for column, kind in NUMERIC_COLUMNS.items():
+        if column in df.columns:
+            df[column] = normalize_column(df[column], kind)
+    return df
+
+
+class FilterRule:
+    """Правило фильтра из конфига: набор условий через И и файл для результата"""
+
+    OPERATORS = {
+        '>=': lambda a, b: a >= b,
+        '<=': lambda a, b: a <= b,
+        '>': lambda a, b: a > b,
+        '<': lambda a, b: a < b,
+        '==': lambda a, b: a == b,
+        '!=': lambda a, b: a != b,
+    }
+
+    def __init__(self, name, output, conditions):
+        self.name = name
+        self.output = output
+        self.conditions = conditions
+        for condition in conditions:
+            if condition['op'] not in self.OPERATORS and condition['op'] not in ('contains', 'in'):
+                raise ValueError(f"Неизвестная операция в правиле {name}: {condition['op']}")
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data['name'], data.get('output', data['name']), data.get('conditions', []))
+
+    def output_path(self, catalog):
+        """Файл правила рядом с основным каталогом; абсолютный путь из конфига не меняется"""
+        return os.path.join(os.path.dirname(catalog), self.output)
+
+    def mask(self, df):
+        """Векторная маска по DataFrame"""
+        import pandas as pd
+
+        mask = pd.Series(True, index=df.index)
+        for condition in self.conditions:
+            column, op, value = condition['column'], condition['op'], condition['value']
+            if column not in df.columns:
+                return pd.Series(False, index=df.index)
+            series = df[column]
+            if op == 'contains':
+                result = series.astype('string').str.contains(value, case=False, regex=False)
+            elif op == 'in':
+                result = series.isin(value)
+            else:
+                result = self.OPERATORS[op](series, value)
+            mask &= result.fillna(False).astype(bool)
+        return mask
+
+    def matches(self, row):
+        """Проверка одной строки при потоковом экспорте"""
+        for condition in self.conditions:
+            column, op, value = condition['column'], condition['op'], condition['value']
+            cell = row.get(column)
+            if op == 'contains':
+                if cell is None or str(value).lower() not in str(cell).lower():
+                    return False
+            elif op == 'in':
+                if cell not in value:
+                    return False
+            else:
+                if isinstance(value, (int, float)):
+                    cell = to_number(cell, NUMERIC_COLUMNS.get(column, 'float'))
+                if cell is None or not self.OPERATORS[op](cell, value):
+                    return False
+        return True
+
+
+def load_filter_rules(path=None):
+    """Правила из JSON конфига, без конфига - стандартный фильтр каталога"""
+    if path is None:
+        return [FilterRule.from_dict(rule) for rule in DEFAULT_RULES]
+    with open(path, 'r', encoding='utf-8') as f:
+        config = json.load(f)
+    return [FilterRule.from_dict(rule) for rule in config.get('rules', [])]
+
+
+def apply_filters(df, rules):
+    """Результат каждого правила отдельным DataFrame"""
+    return {rule.name: df[rule.mask(df)] for rule in rules}
+
+
+def read_catalog(filename):
+    """Загружаем выгруженный каталог любого поддерживаемого формата"""
+    import pandas as pd
+
+    extension = os.path.splitext(filename)[1].lower()
+    if extension == '.xlsx':
+        return pd.read_excel(filename)
+    if extension == '.csv':
+        return pd.read_csv(filename, encoding='utf-8-sig')
+    if extension == '.jsonl':
+        return pd.read_json(filename, lines=True)
+    if extension == '.parquet':
+        return pd.read_parquet(filename)
+    raise ValueError(f"Неизвестный формат каталога: {filename}")
+
+
+def write_catalog(df, filename):
+    """Сохраняем DataFrame по расширению файла"""
+    extension = os.path.splitext(filename)[1].lower()
+    if extension == '.xlsx':
+        df.to_excel(filename, index=False)
+    elif extension == '.csv':
+        df.to_csv(filename, index=False, encoding='utf-8-sig')
+    elif extension == '.jsonl':
+        df.to_json(filename, orient='records', lines=True, force_ascii=False)
+    elif extension == '.parquet':
+        df.to_parquet(filename, index=False)
+    else:
+        raise ValueError(f"Неизвестный формат каталога: {filename}")
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Нормализация и фильтрация выгруженного каталога")
+    arg_parser.add_argument("catalog", help="Файл каталога: xlsx, csv, jsonl или parquet")
+    arg_parser.add_argument("--filters", default=None, help="JSON с правилами фильтрации")
+    arg_parser.add_argument("--format", default=None,
+                            help="Формат файлов с результатами, по умолчанию как у каталога")
+    args = arg_parser.parse_args()
+    setup_logging()
+
+    try:
+        catalog = normalize_catalog(read_catalog(args.catalog))
+        logger.info(f"Нормализовано товаров: {len(catalog)}")
+
+        extension = "." + args.format if args.format else os.path.splitext(args.catalog)[1]
+        rules = load_filter_rules(args.filters)
+        for rule in rules:
+            filtered = catalog[rule.mask(catalog)]
+            if filtered.empty:
+                logger.info(f"Нет товаров для правила {rule.name}")
+                continue
+            filename = rule.output_path(args.catalog) + extension
+            write_catalog(filtered, filename)
+            logger.info(f"{rule.name}: {len(filtered)} товаров сохранено в {filename}")
+    except Exception as e:
+        logger.error(f"Ошибка при обработке каталога: {e}")
@@ -0,0 +1,141 @@
+import threading
+import sqlite3
+import time
+import zlib
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+
+class PageCache:
+    """Кэш страниц на диске: SQLite, сжатие zlib, TTL и вытеснение давно не читанных по размеру"""
+
+    # Сколько отметок чтения копим в памяти до записи в базу
+    ACCESS_FLUSH_EVERY = 256
+
+    def __init__(self, path="page_cache.sqlite", ttl=24 * 3600, max_bytes=512 * 1024 * 1024, cache_only=False):
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        # Только кэш: сеть и браузер не трогаем, промах = нет данных
+        self.cache_only = cache_only
+
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evicted = 0
+
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS pages (
+                url TEXT PRIMARY KEY,
+                content BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                fetched_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )
+        """)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS pages_accessed ON pages (accessed_at)")
+        self.conn.commit()
+        # Размер кэша считаем один раз при открытии, дальше ведем в памяти
+        self.size = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM pages").fetchone()[0]
+        # url -> время последнего чтения, пишутся пачкой в flush_access
+        self.accessed = {}
+
+    def get(self, url):
+        """Html из кэша или None"""
+        now = time.time()
+        with self._lock:
+            row = self.conn.execute("SELECT content, fetched_at FROM pages WHERE url = ?", (url,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+
+            content, fetched_at = row
+            # В режиме только кэша протухшие страницы лучше, чем ничего
+            if self.ttl and now - fetched_at > self.ttl and not self.cache_only:
+                self.conn.execute("DELETE FROM pages WHERE url = ?", (url,))
+                self.conn.commit()
+                self.size -= len(content)
+                self.accessed.pop(url, None)
+                self.expired += 1
+                self.misses += 1
+                return None
+
+            self.accessed[url] = now
+            if len(self.accessed) >= self.ACCESS_FLUSH_EVERY:
+                self.flush_access()
+                self.conn.commit()
+            self.hits += 1
+        return zlib.decompress(content).decode('utf-8')
+
+    def put(self, url, html):
+        """Сохраняем страницу и вытесняем старые, если превышен размер"""
+        content = zlib.compress(html.encode('utf-8'), 6)
+        now = time.time()
+        with self._lock:
+            old = self.conn.execute("SELECT size FROM pages WHERE url = ?", (url,)).fetchone()
+            self.conn.execute(
+                "INSERT OR REPLACE INTO pages (url, content, size, fetched_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                (url, content, len(content), now, now)
+            )
+            self.size += len(content) - (old[0] if old else 0)
+            self.accessed.pop(url, None)
+            self.flush_access()
+            self.evict()
+            self.conn.commit()
+
+    def flush_access(self):
+        """Записываем накопленные отметки чтения одним executemany, вызывается под блокировкой"""
+        if not self.accessed:
+            return
+        self.conn.executemany("UPDATE pages SET accessed_at = ? WHERE url = ?",
+                              [(accessed_at, url) for url, accessed_at in self.accessed.items()])
+        self.accessed.clear()
+
+    def evict(self):
+        """Удаляем давно не читанные страницы, пока кэш больше лимита"""
+        if not self.max_bytes or self.size <= self.max_bytes:
+            return
+        # Порядок вытеснения должен учитывать последние чтения
+        self.flush_access()
+        rows = self.conn.execute("SELECT url, size FROM pages ORDER BY accessed_at").fetchall()
+        for url, size in rows:
+            if self.size <= self.max_bytes:
+                break
+            self.conn.execute("DELETE FROM pages WHERE url = ?", (url,))
+            self.size -= size
+            self.evicted += 1
+
+    def stats(self):
+        """Статистика попаданий и размер кэша"""
+        with self._lock:
+            pages = self.conn.execute("SELECT COUNT(*) FROM pages").fetchone()[0]
+            size = self.size
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / lookups, 3) if lookups else 0.0,
+            'expired': self.expired,
+            'evicted': self.evicted,
+            'pages': pages,
+            'size_mb': round(size / 1024 / 1024, 2),
+        }
+
+    def print_stats(self):
+        """Вывод статистики кэша"""
+        stats = self.stats()
+        logger.info(f"Кэш страниц: попаданий {stats['hits']}, промахов {stats['misses']} "
+                    f"({stats['hit_rate']:.0%}), протухло {stats['expired']}, вытеснено {stats['evicted']}, "
+                    f"в кэше {stats['pages']} стр. / {stats['size_mb']} МБ")
+
+    def close(self):
+        """Запись отметок чтения и закрытие базы"""
+        with self._lock:
+            self.flush_access()
+            self.conn.commit()
+            self.conn.close()
@@ -0,0 +1,300 @@
+from concurrent.futures import ProcessPoolExecutor
+from collect_info import ProductParser
+from worker_pool import OrderedResults
+from selector_registry import get_shared_selector_registry
+from rate_limit import get_shared_scheduler
+from metrics import get_metrics, setup_logging
+import multiprocessing
+import functools
+import threading
+import queue
+import time
+import os
+import logging
+
+
+logger = logging.getLogger(__name__)
+metrics = get_metrics()
+
+
+class PageSelectors:
+    """Реестр селекторов внутри процесса разбора: порядок проверки приходит от реестра родителя вместе
+    со страницей, итоги полей возвращаются с результатом и учитываются в родителе"""
+
+    def __init__(self):
+        self.orders = {}
+        self.outcomes = []
+
+    def start(self, orders):
+        self.orders = orders
+        self.outcomes = []
+
+    def order(self, field):
+        return self.orders[field]
+
+    def record(self, field, order, used):
+        self.outcomes.append((field, order, used))
+        return used
+
+
+# Парсер внутри процесса разбора, создается один раз при старте процесса
+_worker_parser = None
+_worker_selectors = None
+
+
+def _init_worker(extractor, log_level):
+    global _worker_parser, _worker_selectors
+    setup_logging(log_level)
+    _worker_selectors = PageSelectors()
+    _worker_parser = ProductParser(start_driver=False, extractor=extractor, selector_registry=_worker_selectors)
+
+
+def _parse_in_worker(html, orders):
+    started = time.perf_counter()
+    _worker_selectors.start(orders)
+    product_data = _worker_parser.parse_product_page(html)
+    # Метрики процесса (время полей, срабатывания селекторов) уходят родителю вместе с результатом
+    return product_data, time.perf_counter() - started, _worker_selectors.outcomes, metrics.drain()
+
+
+class ParsePool:
+    """Разбор html в отдельных процессах: ограниченная очередь между загрузкой и разбором"""
+
+    def __init__(self, processes=None, queue_size=None, extractor="compiled", selector_registry=None):
+        self.processes = processes or os.cpu_count() or 1
+        # Статистика селекторов и предупреждения о верстке - в реестре родителя, процессы шлют итоги страниц
+        self.selectors = selector_registry or get_shared_selector_registry()
+        if extractor == "js":
+            # Процессу приходит готовый html, скрипт в браузере здесь выполнить негде
+            logger.warning("Экстрактор js в процессах разбора не работает, html разбирается как compiled")
+            extractor = "compiled"
+        # Сколько страниц может ждать разбора; загрузка встает, пока очередь полна
+        self.queue_size = queue_size or self.processes * 2
+        # spawn: браузерные и сетевые потоки родителя в дочерние процессы не копируются
+        self.executor = ProcessPoolExecutor(
+            max_workers=self.processes, mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker, initargs=(extractor, logging.getLevelName(logging.getLogger().level)),
+        )
+        self._slots = threading.BoundedSemaphore(self.queue_size)
+
+        self.submitted = 0
+        self.parsed = 0
+        self.depth = 0
+        self.max_depth = 0
+        self.depth_samples = 0
+        self.depth_sum = 0
+        self.parse_time = 0.0
+        self.blocked_time = 0.0
+        self.started_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def submit(self, html, callback):
+        """Страница в очередь разбора; callback(product_data) вызывается в родительском процессе"""
+        started = time.perf_counter()
+        self._slots.acquire()
+        blocked = time.perf_counter() - started
+        metrics.observe("parse_queue_blocked", blocked)
+
+        with self._lock:
+            self.blocked_time += blocked
+            self.submitted += 1
+            self.depth += 1
+            self.max_depth = max(self.max_depth, self.depth)
+            self.depth_samples += 1
+            self.depth_sum += self.depth
+            depth = self.depth
+        metrics.set("parse_queue_depth", depth)
+
+        submitted_at = time.perf_counter()
+        try:
+            orders = {field: self.selectors.order(field) for field in self.selectors.field_selectors}
+            future = self.executor.submit(_parse_in_worker, html, orders)
+        except Exception:
+            self._done()
+            raise
+        future.add_done_callback(lambda future: self._on_done(future, submitted_at, callback))
+
+    def _on_done(self, future, submitted_at, callback):
+        product_data = None
+        try:
+            product_data, elapsed, outcomes, (counters, histograms) = future.result()
+            for field, order, used in outcomes:
+                self.selectors.record(field, order, used)
+            metrics.merge(counters, histograms)
+            metrics.observe("parse_worker", elapsed)
+            metrics.observe("parse_queue_wait", max(0.0, time.perf_counter() - submitted_at - elapsed))
+            with self._lock:
+                self.parse_time += elapsed
+                self.parsed += 1
+        except Exception as e:
+            logger.warning(f"Ошибка в процессе разбора: {e}")
+            metrics.inc("parse_worker_errors")
+        finally:
+            self._done()
+        try:
+            callback(product_data)
+        except Exception as e:
+            logger.warning(f"Ошибка при обработке результата разбора: {e}")
+
+    def _done(self):
+        with self._lock:
+            self.depth -= 1
+            depth = self.depth
+        metrics.set("parse_queue_depth", depth)
+        self._slots.release()
+
+    def stats(self):
+        """Глубина очереди и загрузка процессов разбора"""
+        elapsed = time.monotonic() - self.started_at
+        return {
+            'parsed': self.parsed,
+            'avg_depth': round(self.depth_sum / self.depth_samples, 1) if self.depth_samples else 0.0,
+            'max_depth': self.max_depth,
+            'queue_size': self.queue_size,
+            'blocked_time': round(self.blocked_time, 2),
+            'utilization': round(self.parse_time / (elapsed * self.processes), 3) if elapsed else 0.0,
+        }
+
+    def print_stats(self):
+        """Вывод статистики разбора"""
+        stats = self.stats()
+        metrics.set("parse_utilization", stats['utilization'])
+        logger.info(f"Разбор в {self.processes} процессах: страниц {stats['parsed']}, "
+                    f"загрузка процессов {stats['utilization']:.0%}, очередь в среднем {stats['avg_depth']}, "
+                    f"максимум {stats['max_depth']} из {stats['queue_size']}, "
+                    f"загрузка ждала свободного места {stats['blocked_time']} с")
+
+    def close(self):
+        """Ждем разбор оставшихся страниц и останавливаем процессы"""
+        self.executor.shutdown(wait=True)
+
+
+class FetchParsePool:
+    """Потоки только загружают страницы, разбор уходит в ParsePool; браузер не простаивает на разборе"""
+
+    def __init__(self, fetch_workers=1, parse_pool=None, scheduler=None, parser_factory=None, **parser_options):
+        self.fetch_workers = fetch_workers
+        self.parse_pool = parse_pool or ParsePool()
+        self.scheduler = scheduler or get_shared_scheduler()
+        self.parser_factory = parser_factory or (
+            lambda: ProductParser(scheduler=self.scheduler, **parser_options)
+        )
+        self.busy_time = 0.0
+        self.wall_time = 0.0
+        self._lock = threading.Lock()
+
+    def run(self, links, on_result=None):
+        """Загружаем и разбираем ссылки, результат в порядке исходного списка"""
+        tasks = queue.Queue()
+        for index, link in enumerate(links):
+            tasks.put((index, link, False))
+
+        # on_result получает ссылки в порядке списка, как бы ни завершались загрузка и разбор
+        results = OrderedResults(links, on_result)
+        done = results.done
+
+        def finish(index, link, product_data):
+            results.put(index, product_data)
+
+        started = time.monotonic()
+        threads = [
+            threading.Thread(target=self.fetch_loop, args=(worker_id, tasks, finish, done), daemon=True)
+            for worker_id in range(min(self.fetch_workers, len(links)))
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.wall_time += (time.monotonic() - started) * len(threads)
+
+        logger.info(f"Загрузка и разбор завершены: успешно {sum(1 for r in results.results if r)} из {len(links)}")
+        return results.results
+
+    def fetch_loop(self, worker_id, tasks, finish, done):
+        """Цикл потока загрузки: ждет, пока не будут готовы все ссылки, включая повторы в Chrome"""
+        parser = None
+        try:
+            while not done.is_set():
+                try:
+                    index, link, browser = tasks.get(timeout=0.2)
+                except queue.Empty:
+                    continue
+
+                started = time.perf_counter()
+                try:
+                    if parser is None:
+                        parser = self.parser_factory()
+                    page = parser.fetch_product_page(link, browser=browser)
+                except Exception as e:
+                    logger.warning(f"[загрузка {worker_id}] ошибка, перезапускаем браузер: {e}")
+                    metrics.inc("worker_restarts")
+                    self.close_parser(parser)
+                    parser = None
+                    page = None
+                finally:
+                    with self._lock:
+                        self.busy_time += time.perf_counter() - started
+
+                if page is None:
+                    finish(index, link, None)
+                    continue
+
+                html, source = page
+                try:
+                    unchanged = parser.unchanged_product(link, html, source)
+                    if not unchanged:
+                        self.parse_pool.submit(html, functools.partial(self.on_parsed, parser, tasks, finish,
+                                                                       index, link, html, source))
+                except Exception as e:
+                    # Упавший пул процессов или история изменений не должны вешать остальные ссылки
+                    logger.warning(f"Не удалось отправить страницу в разбор {link}: {e}")
+                    finish(index, link, None)
+                    continue
+                if unchanged:
+                    finish(index, link, unchanged)
+        finally:
+            self.close_parser(parser)
+
+    def on_parsed(self, parser, tasks, finish, index, link, html, source, product_data):
+        """Результат разбора: страница из HTTP без данных идет повторно в Chrome, остальное - в итог.
+        Ссылка завершается при любой ошибке, иначе потоки загрузки ждали бы ее вечно"""
+        result = None
+        requeued = False
+        try:
+            if source == "http" and parser.http_needs_browser(product_data):
+                logger.warning(f"Без браузера не получилось, открываем в Chrome: {link}")
+                tasks.put((index, link, True))
+                requeued = True
+                return
+            if product_data and parser.cache and source != "cache":
+                parser.cache.put(link, html)
+            result = parser.finish_product(product_data, link, source=source)
+        except Exception as e:
+            logger.warning(f"Ошибка при обработке результата разбора {link}: {e}")
+            result = None
+        finally:
+            if not requeued:
+                finish(index, link, result)
+
+    def utilization(self):
+        """Доля времени потоков загрузки, занятая загрузкой страниц"""
+        return round(self.busy_time / self.wall_time, 3) if self.wall_time else 0.0
+
+    def print_stats(self):
+        """Загрузка обеих стадий"""
+        utilization = self.utilization()
+        metrics.set("fetch_utilization", utilization)
+        logger.info(f"Загрузка в {self.fetch_workers} потоках: занята {utilization:.0%} времени")
+        self.parse_pool.print_stats()
+
+    @staticmethod
+    def close_parser(parser):
+        if parser is None:
+            return
+        try:
+            parser.close()
+        except Exception as e:
+            logger.warning(f"Ошибка при закрытии браузера: {e}")
+
+    def close(self):
+        self.parse_pool.close()
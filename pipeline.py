@@ -0,0 +1,211 @@
+from link_collect import LinkCollector
+from crawl_state import articul_from_url
+from collect_info import ProductParser
+from rate_limit import get_shared_scheduler
+from driver_factory import get_shared_driver_pool, LOAD_PROFILES
+from exporters import StreamingExporter, SINKS
+from normalize import load_filter_rules
+from image_downloader import ImageDownloader
+from metrics import get_metrics, add_observability_arguments, start_observability, finish_observability
+import argparse
+import threading
+import queue
+import time
+import logging
+
+
+logger = logging.getLogger(__name__)
+metrics = get_metrics()
+
+
+_STOP = object()
+
+
+class CrawlPipeline:
+    """Сбор ссылок и парсинг карточек одновременно, стадии связаны ограниченной очередью"""
+
+    def __init__(self, query, pages=2, queue_size=20, parse_workers=1, backend="selenium",
+                 page_workers=1, extractor="compiled", collector_factory=None, parser_factory=None):
+        self.query = query
+        self.pages = pages
+        self.parse_workers = parse_workers
+        # Ограниченная очередь: если парсинг отстает, сборщик ссылок ждет
+        self.links_queue = queue.Queue(maxsize=queue_size)
+        # Сборщик и парсеры ходят на один хост, поэтому планировщик общий
+        self.scheduler = get_shared_scheduler()
+        # js - и выдача, и карточки разбираются скриптом в браузере
+        self.collector_factory = collector_factory or (lambda: LinkCollector(
+            scheduler=self.scheduler, page_workers=page_workers, extractor="js" if extractor == "js" else "html"
+        ))
+        self.parser_factory = parser_factory or (
+            lambda: ProductParser(backend=backend, scheduler=self.scheduler, extractor=extractor)
+        )
+
+        self.collected_links = []
+        self.products = []
+        self.first_product_after = None
+        self._products_lock = threading.Lock()
+        self._started_at = None
+        self._consumers = []
+
+    def run(self, on_product=None):
+        """Запуск конвейера, без on_product возвращает товары в порядке поступления ссылок"""
+        self._started_at = time.monotonic()
+
+        producer = threading.Thread(target=self.produce_links, daemon=True)
+        self._consumers = [
+            threading.Thread(target=self.consume_links, args=(worker_id, on_product), daemon=True)
+            for worker_id in range(self.parse_workers)
+        ]
+
+        # Парсеры стартуют первыми: сборщик ссылок проверяет, что их есть кому забирать
+        for consumer in self._consumers:
+            consumer.start()
+        producer.start()
+
+        producer.join()
+        for consumer in self._consumers:
+            consumer.join()
+
+        self.products.sort(key=lambda item: item[0])
+        return [product for _, product in self.products]
+
+    def produce_links(self):
+        """Стадия сбора ссылок"""
+        collector = None
+        seen = set()
+        try:
+            collector = self.collector_factory()
+            for page_links in collector.iter_product_links(self.query, self.pages):
+                for link in page_links:
+                    key = articul_from_url(link) or link
+                    if key in seen:
+                        continue
+                    seen.add(key)
+                    self.collected_links.append(link)
+                    with metrics.timer("queue_put_wait"):
+                        if not self.put_link((len(self.collected_links) - 1, link)):
+                            logger.error("Все парсеры остановились, сбор ссылок прерван")
+                            return
+                    metrics.set("links_queue_depth", self.links_queue.qsize())
+        except Exception as e:
+            logger.warning(f"Ошибка при сборе ссылок: {e}")
+        finally:
+            if collector:
+                collector.close()
+            for _ in range(self.parse_workers):
+                if not self.put_link(_STOP):
+                    break
+
+    def put_link(self, item, poll_interval=0.5):
+        """Кладем в очередь, пока жив хоть один парсер; False - забирать ссылки больше некому"""
+        while True:
+            try:
+                self.links_queue.put(item, timeout=poll_interval)
+                return True
+            except queue.Full:
+                if not any(consumer.is_alive() for consumer in self._consumers):
+                    return False
+
+    def consume_links(self, worker_id, on_product):
+        """Стадия парсинга карточек"""
+        parser = None
+        try:
+            while True:
+                with metrics.timer("queue_get_wait"):
+                    item = self.links_queue.get()
+                metrics.set("links_queue_depth", self.links_queue.qsize())
+                if item is _STOP:
+                    break
+
+                index, link = item
+                try:
+                    if parser is None:
+                        parser = self.parser_factory()
+                    product_data = parser.parse_product_from_link(link)
+                except Exception as e:
+                    logger.warning(f"[парсер {worker_id}] ошибка на {link}: {e}")
+                    continue
+
+                if not product_data:
+                    continue
+
+                with self._products_lock:
+                    if self.first_product_after is None:
+                        self.first_product_after = time.monotonic() - self._started_at
+                        logger.info(f"Первый товар готов через {self.first_product_after:.1f} с")
+                    # Если товары сразу уходят в экспорт, в памяти их не держим
+                    if on_product:
+                        on_product(product_data)
+                    else:
+                        self.products.append((index, product_data))
+        finally:
+            if parser:
+                parser.close()
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Сбор ссылок и данных Wildberries за один проход")
+    arg_parser.add_argument("query", nargs="?", default="пальто из натуральной шерсти")
+    arg_parser.add_argument("--pages", type=int, default=2)
+    arg_parser.add_argument("--queue-size", type=int, default=20,
+                            help="Сколько ссылок может ждать парсинга")
+    arg_parser.add_argument("--parse-workers", type=int, default=1)
+    arg_parser.add_argument("--page-workers", type=int, default=1,
+                            help="Сколько страниц выдачи грузить одновременно")
+    arg_parser.add_argument("--backend", choices=["selenium", "http"], default="selenium")
+    arg_parser.add_argument("--extractor", choices=["compiled", "soup", "js"], default="compiled",
+                            help="js - ссылки и поля карточек собирает скрипт в браузере")
+    arg_parser.add_argument("--show-browser", action="store_true",
+                            help="Открывать окно Chrome вместо headless")
+    arg_parser.add_argument("--load-profile", choices=list(LOAD_PROFILES), default="lite",
+                            help="lite - не грузить картинки, шрифты, видео и счетчики")
+    arg_parser.add_argument("--format", default="xlsx,jsonl",
+                            help=f"Форматы экспорта через запятую: {', '.join(SINKS)}")
+    arg_parser.add_argument("--output", default="wildberries_catalog",
+                            help="Имя файла каталога без расширения")
+    arg_parser.add_argument("--filters", default=None,
+                            help="JSON с правилами фильтрации, например filters.json")
+    arg_parser.add_argument("--images", default=None,
+                            help="Папка для фото товаров, фото качаются по мере парсинга")
+    add_observability_arguments(arg_parser)
+    args = arg_parser.parse_args()
+    start_observability(args)
+
+    exporter = StreamingExporter(formats=[fmt.strip() for fmt in args.format.split(",")], output=args.output,
+                                 rules=load_filter_rules(args.filters))
+
+    downloader = ImageDownloader(args.images) if args.images else None
+
+    def on_product(product_data):
+        exporter.write(product_data)
+        if downloader:
+            downloader.submit(product_data)
+
+    driver_pool = get_shared_driver_pool()
+    driver_pool.headless = not args.show_browser
+    driver_pool.profile = args.load_profile
+    try:
+        logger.info("Запуск конвейера Wildberries")
+        pipeline = CrawlPipeline(args.query, pages=args.pages, queue_size=args.queue_size,
+                                 parse_workers=args.parse_workers, backend=args.backend,
+                                 page_workers=args.page_workers, extractor=args.extractor)
+        pipeline.run(on_product=on_product)
+
+        if pipeline.collected_links:
+            LinkCollector(start_driver=False).save_links_to_file(pipeline.collected_links)
+
+        logger.info(f"Успешно обработано товаров: {exporter.total}")
+
+    except Exception as e:
+        logger.error(f"Критическая ошибка: {e}")
+    finally:
+        exporter.close()
+        if downloader:
+            downloader.close()
+            downloader.print_stats()
+        get_shared_scheduler().print_stats()
+        driver_pool.print_stats()
+        driver_pool.close()
+        finish_observability(args)
+        logger.info("Конвейер завершил работу")
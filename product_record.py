@@ -0,0 +1,197 @@
+from dataclasses import dataclass
+from array import array
+import json
+import math
+import sys
+import re
+
+
+_NUMBER_RE = re.compile(r'\d+')
+_SPACES_RE = re.compile(r'\s+')
+
+# Строки-заглушки экстракторов, в типизированной записи это отсутствие значения
+MISSING_PRICE = ("Цена не найдена", "Ошибка получения цены")
+
+
+def parse_price_text(price_text):
+    """Число из текста цены с любыми пробелами внутри (обычный, неразрывный, тонкий)"""
+    if price_text is None or isinstance(price_text, (int, float)):
+        return price_text
+    match = _NUMBER_RE.search(_SPACES_RE.sub('', price_text))
+    return int(match.group()) if match else None
+
+
+def _intern(value):
+    return sys.intern(value) if value else value
+
+
+@dataclass(slots=True)
+class ProductRecord:
+    """Товар с типизированными полями вместо словаря со строками"""
+
+    name: str
+    price: int | None
+    rating: float
+    reviews_count: int
+    description: str
+    # Ссылки на фото одной строкой через запятую: так компактнее кортежа из отдельных строк
+    images: str
+    characteristics: tuple
+    seller_name: str
+    seller_url: str
+    url: str = ""
+    articul: int | None = None
+
+    @classmethod
+    def from_dict(cls, data):
+        """Из словаря parse_product_page или из сохраненного to_dict"""
+        images = data.get('images') or ""
+        if not isinstance(images, str):
+            images = ', '.join(images)
+
+        characteristics = data.get('characteristics') or ()
+        if isinstance(characteristics, str):
+            characteristics = json.loads(characteristics)
+        if isinstance(characteristics, dict):
+            characteristics = characteristics.items()
+
+        price = data.get('price')
+        if price in MISSING_PRICE:
+            price = None
+
+        articul = data.get('articul')
+        return cls(
+            name=data.get('name', ""),
+            price=parse_price_text(price),
+            rating=float(data.get('rating') or 0.0),
+            reviews_count=int(data.get('reviews_count') or 0),
+            description=data.get('description', ""),
+            images=images,
+            # Названия характеристик и продавцы повторяются от товара к товару, храним одну копию строки
+            characteristics=tuple((_intern(key), value) for key, value in characteristics),
+            seller_name=_intern(data.get('seller_name', "")),
+            seller_url=_intern(data.get('seller_url', "")),
+            url=data.get('url', ""),
+            articul=int(articul) if articul else None,
+        )
+
+    def to_dict(self):
+        """Структурированный словарь для JSON"""
+        return {
+            'name': self.name,
+            'price': self.price,
+            'rating': self.rating,
+            'reviews_count': self.reviews_count,
+            'description': self.description,
+            'images': self.image_urls,
+            'characteristics': dict(self.characteristics),
+            'seller_name': self.seller_name,
+            'seller_url': self.seller_url,
+            'url': self.url,
+            'articul': self.articul,
+        }
+
+    def to_row(self):
+        """Плоская строка для табличного экспорта"""
+        return {
+            'name': self.name,
+            'price': self.price,
+            'rating': self.rating,
+            'reviews_count': self.reviews_count,
+            'description': self.description,
+            'images': self.images,
+            'characteristics': json.dumps(dict(self.characteristics), ensure_ascii=False) if self.characteristics else "",
+            'seller_name': self.seller_name,
+            'seller_url': self.seller_url,
+            'url': self.url,
+            'articul': self.articul,
+        }
+
+    @property
+    def image_urls(self):
+        return [image.strip() for image in self.images.split(',') if image.strip()]
+
+    def get(self, field, default=None):
+        """Доступ как у словаря, для мест, где раньше был dict"""
+        return getattr(self, field, default)
+
+
+def as_row(product):
+    """Строка экспорта из записи или из старого словаря"""
+    return product.to_row() if isinstance(product, ProductRecord) else product
+
+
+class ProductBatch:
+    """Колоночное хранение пачки товаров: числа в array, строки в списках"""
+
+    NUMERIC = {'price': 'd', 'rating': 'd', 'reviews_count': 'q', 'articul': 'q'}
+    TEXT = ['name', 'description', 'images', 'characteristics', 'seller_name', 'seller_url', 'url']
+    COLUMNS = ['name', 'price', 'rating', 'reviews_count', 'description', 'images',
+               'characteristics', 'seller_name', 'seller_url', 'url', 'articul']
+
+    def __init__(self):
+        self.columns = {name: array(code) for name, code in self.NUMERIC.items()}
+        self.columns.update({name: [] for name in self.TEXT})
+
+    def __len__(self):
+        return len(self.columns['name'])
+
+    def append(self, record):
+        if not isinstance(record, ProductRecord):
+            record = ProductRecord.from_dict(record)
+        row = record.to_row()
+        columns = self.columns
+        # Отсутствующая цена хранится как NaN, артикул как -1
+        columns['price'].append(math.nan if record.price is None else record.price)
+        columns['rating'].append(record.rating)
+        columns['reviews_count'].append(record.reviews_count)
+        columns['articul'].append(-1 if record.articul is None else record.articul)
+        for name in self.TEXT:
+            columns[name].append(row[name])
+
+    def extend(self, records):
+        for record in records:
+            self.append(record)
+
+    def clear(self):
+        self.__init__()
+
+    def numeric(self, name):
+        """Числовая колонка как numpy-массив одним копированием буфера array"""
+        import numpy as np
+
+        return np.array(self.columns[name], dtype=np.float64 if self.NUMERIC[name] == 'd' else np.int64)
+
+    def to_pandas(self):
+        """DataFrame: числовые колонки берутся из буферов array без построчного копирования"""
+        import pandas as pd
+
+        data = {}
+        for name in self.COLUMNS:
+            column = self.columns[name]
+            if name in self.NUMERIC:
+                values = self.numeric(name)
+                if name == 'articul':
+                    values = pd.array(values, dtype="Int64")
+                    values[values == -1] = pd.NA
+                data[name] = values
+            else:
+                data[name] = column
+        return pd.DataFrame(data, columns=self.COLUMNS)
+
+    def to_arrow(self):
+        """Таблица pyarrow, нужен pyarrow"""
+        import pyarrow as pa
+
+        arrays = []
+        for name in self.COLUMNS:
+            column = self.columns[name]
+            if name in self.NUMERIC:
+                values = self.numeric(name)
+                if name == 'articul':
+                    arrays.append(pa.array(values, mask=values == -1))
+                else:
+                    arrays.append(pa.array(values, from_pandas=True))
+            else:
+                arrays.append(pa.array(column, type=pa.string()))
+        return pa.Table.from_arrays(arrays, names=self.COLUMNS)
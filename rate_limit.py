@@ -0,0 +1,159 @@
+from metrics import get_metrics
+from failures import get_shared_circuit_breaker
+from urllib.parse import urlparse
+import threading
+import time
+import logging
+
+
+logger = logging.getLogger(__name__)
+metrics = get_metrics()
+
+
+# Признаки страницы-заглушки вместо контента
+BLOCK_MARKERS = ("captcha", "капча", "почти готово", "доступ ограничен", "too many requests")
+
+
+def looks_blocked(*texts):
+    """Проверяем заголовок/url/html на признаки блокировки"""
+    for text in texts:
+        if text and any(marker in text.lower() for marker in BLOCK_MARKERS):
+            return True
+    return False
+
+
+class HostBucket:
+    """Токен-бакет одного хоста со скоростью, меняющейся по AIMD"""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated_at = time.monotonic()
+
+        self.requests = 0
+        self.errors = 0
+        self.blocked = 0
+        self.slow = 0
+        self.backoffs = 0
+        self.throttled_seconds = 0.0
+        self.work_seconds = 0.0
+
+    def refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def reserve(self):
+        """Забираем токен, если он есть, иначе возвращаем сколько ждать"""
+        self.refill(time.monotonic())
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class AdaptiveScheduler:
+    """Общий планировщик запросов: лимит на хост, ускорение на здоровых ответах и откат на плохих"""
+
+    def __init__(self, initial_rate=1.0, min_rate=0.1, max_rate=5.0, burst=2,
+                 increase=0.1, decrease=0.5, slow_threshold=8.0, breaker=None):
+        self.initial_rate = initial_rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.burst = burst
+        self.increase = increase
+        self.decrease = decrease
+        self.slow_threshold = slow_threshold
+        # Выключатель ставит хост на паузу при всплеске блокировок, поверх плавного замедления AIMD
+        self.breaker = breaker
+        self.buckets = {}
+        self._lock = threading.Lock()
+
+    def bucket_for(self, url):
+        host = urlparse(url).netloc or url
+        with self._lock:
+            if host not in self.buckets:
+                self.buckets[host] = HostBucket(self.initial_rate, self.burst)
+            return self.buckets[host]
+
+    def acquire(self, url):
+        """Ждем, пока хост не на паузе и для него освободится токен"""
+        if self.breaker:
+            self.breaker.wait(url)
+        bucket = self.bucket_for(url)
+        waited = 0.0
+        while True:
+            with self._lock:
+                delay = bucket.reserve()
+                if delay <= 0:
+                    bucket.requests += 1
+                    bucket.throttled_seconds += waited
+                    metrics.observe("rate_limit_wait", waited)
+                    return waited
+            time.sleep(delay)
+            waited += delay
+
+    def report(self, url, elapsed, ok=True, blocked=False, slow=False):
+        """Результат запроса: здоровый ответ ускоряет хост, ошибка/медленный ответ/блокировка тормозят.
+        slow=True - ответ медленный независимо от elapsed, например страница не дождалась содержимого"""
+        if self.breaker:
+            self.breaker.record(url, blocked)
+        bucket = self.bucket_for(url)
+        slow = slow or elapsed > self.slow_threshold
+        with self._lock:
+            bucket.work_seconds += elapsed
+            if ok and not blocked and not slow:
+                bucket.rate = min(self.max_rate, bucket.rate + self.increase)
+                return
+
+            metrics.inc("backoffs", reason="blocked" if blocked else "error" if not ok else "slow")
+            if blocked:
+                bucket.blocked += 1
+            elif not ok:
+                bucket.errors += 1
+            else:
+                bucket.slow += 1
+            bucket.backoffs += 1
+            bucket.rate = max(self.min_rate, bucket.rate * self.decrease)
+            # Накопленный запас токенов после плохого ответа не тратим
+            bucket.tokens = min(bucket.tokens, 0.0)
+
+    def stats(self):
+        """Статистика по хостам"""
+        with self._lock:
+            return {
+                host: {
+                    'rate': round(bucket.rate, 3),
+                    'requests': bucket.requests,
+                    'errors': bucket.errors,
+                    'blocked': bucket.blocked,
+                    'slow': bucket.slow,
+                    'backoffs': bucket.backoffs,
+                    'throttled_seconds': round(bucket.throttled_seconds, 2),
+                    'work_seconds': round(bucket.work_seconds, 2),
+                }
+                for host, bucket in self.buckets.items()
+            }
+
+    def print_stats(self):
+        """Вывод статистики ожидания и работы"""
+        if self.breaker:
+            self.breaker.print_stats()
+        for host, stats in self.stats().items():
+            logger.info(f"{host}: запросов {stats['requests']}, скорость {stats['rate']} в с, "
+                        f"ожидание {stats['throttled_seconds']} с, работа {stats['work_seconds']} с, "
+                        f"откатов {stats['backoffs']} (ошибки {stats['errors']}, блок {stats['blocked']}, "
+                        f"медленно {stats['slow']})")
+
+
+_shared_scheduler = None
+_shared_lock = threading.Lock()
+
+
+def get_shared_scheduler():
+    """Один планировщик на процесс, общий для сборщика ссылок и парсеров"""
+    global _shared_scheduler
+    with _shared_lock:
+        if _shared_scheduler is None:
+            _shared_scheduler = AdaptiveScheduler(breaker=get_shared_circuit_breaker())
+        return _shared_scheduler
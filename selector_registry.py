@@ -0,0 +1,221 @@
+from extraction import FIELD_SELECTORS
+from metrics import get_metrics
+import collections
+import math
+import threading
+import json
+import time
+import os
+import logging
+
+
+logger = logging.getLogger(__name__)
+metrics = get_metrics()
+
+
+def is_fallback(selector):
+    """Широкий запасной селектор: подстрока в атрибуте ([class*='rating']) ловит что угодно,
+    поэтому он всегда проверяется после точных, как бы часто ни срабатывал"""
+    return "*=" in selector
+
+
+class SelectorRegistry:
+    """Частота срабатываний селекторов по полям: soup и js проверяют точные селекторы в порядке частоты
+    и пропускают те, что ничего не дают; compiled берет статистику и предупреждения об уехавшей верстке"""
+
+    def __init__(self, path=None, field_selectors=None, window=500, drift_after=30, drift_ratio=0.5,
+                 probe_every=50, learn=True):
+        self.path = path
+        self.field_selectors = field_selectors or FIELD_SELECTORS
+        # После window проверок счетчики делятся пополам, чтобы свежая верстка перевешивала старую
+        self.window = window
+        # Верстка уехала, если за последние drift_after страниц поле находилось реже, чем drift_ratio
+        # от его обычной частоты, и такой провал не объясняется случайностью (больше трех сигм):
+        # поля, которых часто нет и на живой верстке (рейтинг у новых товаров), не дают ложных тревог
+        self.drift_after = drift_after
+        self.drift_ratio = drift_ratio
+        # Каждая probe_every-я страница поля проверяет и пропускаемые селекторы: вдруг верстка вернулась
+        self.probe_every = probe_every
+        # learn=False - исходный порядок без пропусков, статистика только копится
+        self.learn = learn
+
+        self.stats = {field: {selector: {'hits': 0.0, 'tries': 0.0} for selector in selectors}
+                      for field, selectors in self.field_selectors.items()}
+        self.pages = {field: 0 for field in self.field_selectors}
+        # Частота поля до последних drift_after страниц и сами последние страницы
+        self.history = {field: {'hits': 0.0, 'pages': 0.0} for field in self.field_selectors}
+        self.recent = {field: collections.deque(maxlen=drift_after) for field in self.field_selectors}
+        self.drifted = set()
+        self._lock = threading.Lock()
+
+        if path and os.path.exists(path):
+            self.load()
+
+    def load(self):
+        """Статистика прошлых запусков; селекторы, которых больше нет в FIELD_SELECTORS, отбрасываются"""
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                saved = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Не удалось прочитать статистику селекторов {self.path}: {e}")
+            return
+        with self._lock:
+            for field, entry in saved.get('fields', {}).items():
+                if field not in self.stats:
+                    continue
+                for selector, counts in entry.get('selectors', {}).items():
+                    if selector in self.stats[field]:
+                        self.stats[field][selector] = {'hits': float(counts['hits']), 'tries': float(counts['tries'])}
+                if 'history' in entry:
+                    self.history[field] = {'hits': float(entry['history']['hits']),
+                                           'pages': float(entry['history']['pages'])}
+                self.recent[field].extend(bool(hit) for hit in entry.get('recent', []))
+                if entry.get('drifted'):
+                    self.drifted.add(field)
+
+    def attach(self, path):
+        """Статистика между запусками: читаем прошлые запуски из path, save() пишет туда же"""
+        self.path = path
+        if os.path.exists(path):
+            self.load()
+
+    def save(self):
+        """Сохраняем статистику атомарно: временный файл и замена"""
+        if not self.path:
+            return
+        with self._lock:
+            data = {
+                'updated_at': time.time(),
+                'fields': {
+                    field: {
+                        'order': self._learned_order(field),
+                        'skipped': [selector for selector in self.field_selectors[field]
+                                    if self._skipped(field, selector)],
+                        'selectors': {selector: {'hits': round(counts['hits'], 3), 'tries': round(counts['tries'], 3)}
+                                      for selector, counts in selectors.items()},
+                        'history': {key: round(value, 3) for key, value in self.history[field].items()},
+                        'recent': [int(hit) for hit in self.recent[field]],
+                        'drifted': field in self.drifted,
+                    }
+                    for field, selectors in self.stats.items()
+                },
+            }
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.path)
+
+    def hit_rate(self, field, selector):
+        """Доля страниц, где значение дал этот селектор, из тех, где до него дошла очередь;
+        со сглаживанием: у непроверенного селектора 0.5"""
+        counts = self.stats[field][selector]
+        return (counts['hits'] + 1) / (counts['tries'] + 2)
+
+    def _learned_order(self, field):
+        # Точные селекторы - по частоте, при равной - исходный приоритет; широкие запасные - в конце как были
+        selectors = self.field_selectors[field]
+        specific = sorted((selector for selector in selectors if not is_fallback(selector)),
+                          key=lambda selector: (-self.hit_rate(field, selector), selectors.index(selector)))
+        return specific + [selector for selector in selectors if is_fallback(selector)]
+
+    def order(self, field):
+        """Порядок проверки для soup и js: точные селекторы по частоте, без тех, что не дали значения за окно"""
+        with self._lock:
+            if not self.learn:
+                return list(self.field_selectors[field])
+            order = self._learned_order(field)
+            if self.pages[field] % self.probe_every == 0:
+                return order
+            return [selector for selector in order if not self._skipped(field, selector)]
+
+    def _skipped(self, field, selector):
+        # Половина окна: после деления счетчиков пополам селектор не должен оживать сам собой
+        counts = self.stats[field][selector]
+        return counts['hits'] == 0 and counts['tries'] >= self.window / 2
+
+    def record(self, field, order, used):
+        """Итог одной страницы: order - селекторы в порядке проверки, used - тот, чье значение взято, или None.
+        Попытка засчитывается селекторам до used включительно: дальше по списку их никто не спрашивал"""
+        with self._lock:
+            self.pages[field] += 1
+            for selector in order:
+                counts = self.stats[field][selector]
+                counts['tries'] += 1
+                if selector == used:
+                    counts['hits'] += 1
+                if counts['tries'] > self.window:
+                    counts['hits'] /= 2
+                    counts['tries'] /= 2
+                if selector == used:
+                    break
+            drift_started, drift_ended, recent_rate, usual_rate = self._track_drift(field, used is not None)
+
+        if used is not None:
+            metrics.inc("selector_hits", field=field, index=self.field_selectors[field].index(used))
+        else:
+            metrics.inc("selector_misses", field=field)
+        if drift_started:
+            metrics.set("selector_drift", 1, field=field)
+            logger.warning(f"Селекторы поля {field} стали срабатывать реже: {recent_rate:.0%} "
+                           f"последних {self.drift_after} страниц против обычных {usual_rate:.0%}")
+        elif drift_ended:
+            metrics.set("selector_drift", 0, field=field)
+            logger.info(f"Поле {field} снова находится как обычно: {recent_rate:.0%} последних страниц")
+        return used
+
+    def _track_drift(self, field, hit):
+        """Сравниваем частоту поля на последних страницах с обычной; вызывается под блокировкой"""
+        recent = self.recent[field]
+        history = self.history[field]
+        # Страница, выпавшая из последних, уходит в обычную частоту; во время сбоя обычную не портим
+        if len(recent) == recent.maxlen and field not in self.drifted:
+            history['pages'] += 1
+            history['hits'] += recent[0]
+            if history['pages'] > self.window:
+                history['hits'] /= 2
+                history['pages'] /= 2
+        recent.append(hit)
+
+        usual_rate = history['hits'] / history['pages'] if history['pages'] else 0.0
+        recent_rate = sum(recent) / len(recent)
+        if len(recent) < recent.maxlen or history['pages'] < self.drift_after or not usual_rate:
+            return False, False, recent_rate, usual_rate
+        expected = usual_rate * len(recent)
+        spread = math.sqrt(len(recent) * usual_rate * (1 - usual_rate))
+        hits = sum(recent)
+        # Вход - заметный и неслучайный провал, выход - возврат к обычному с точностью до одной сигмы
+        drift_started = (field not in self.drifted and hits < expected * self.drift_ratio
+                         and expected - hits > 3 * spread)
+        drift_ended = field in self.drifted and hits >= expected - spread
+        if drift_started:
+            self.drifted.add(field)
+        if drift_ended:
+            self.drifted.discard(field)
+        return drift_started, drift_ended, recent_rate, usual_rate
+
+    def print_stats(self):
+        """Порядок селекторов и частота срабатываний по полям"""
+        for field in self.field_selectors:
+            parts = []
+            for selector in self._learned_order(field):
+                counts = self.stats[field][selector]
+                if counts['tries']:
+                    skipped = " (пропускается)" if self._skipped(field, selector) else ""
+                    parts.append(f"{selector} {counts['hits'] / counts['tries']:.0%}{skipped}")
+            if parts:
+                logger.info(f"Селекторы {field}: " + ", ".join(parts))
+        if self.drifted:
+            logger.warning(f"Верстка уехала, поля находятся реже обычного: {', '.join(sorted(self.drifted))}")
+
+
+_shared_registry = None
+_shared_registry_lock = threading.Lock()
+
+
+def get_shared_selector_registry():
+    """Один реестр селекторов на процесс; в файл пишет только после attach()"""
+    global _shared_registry
+    with _shared_registry_lock:
+        if _shared_registry is None:
+            _shared_registry = SelectorRegistry()
+        return _shared_registry
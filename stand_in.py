@@ -0,0 +1,340 @@
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from collect_info import ProductParser
+from image_downloader import ImageDownloader
+from selector_registry import SelectorRegistry
+from rate_limit import AdaptiveScheduler
+from failures import FailureLog
+from benchmark import load_corpus, EXPECTED_FILE
+from distributed import SqliteWorkQueue, QueueBroker, DONE
+import collections
+import subprocess
+import threading
+import tempfile
+import argparse
+import json
+import time
+import sys
+import os
+import re
+
+
+# Картинки стенда: a и b - одинаковые байты под разными ссылками, c - другая картинка
+IMAGES = {
+    'a.jpg': b'\xff\xd8\xff\xe0' + b'one photo' * 100,
+    'b.jpg': b'\xff\xd8\xff\xe0' + b'one photo' * 100,
+    'c.jpg': b'\xff\xd8\xff\xe0' + b'other photo' * 100,
+}
+# Сколько раз /flaky/ отвечает 503 до нормального ответа: меньше числа повторов HttpFetcher
+FLAKY_FAILURES = 2
+# Сколько /slow/ держит ответ: карточки дальше по списку успевают раньше
+SLOW_SECONDS = 0.5
+# Окно повторной проверки для прогона collect_info --incremental, секунды
+RECHECK_SECONDS = 3
+
+
+class StandIn:
+    """Локальная замена сайта на http.server: карточки из fixtures/product, картинки, сбои и блокировка"""
+
+    def __init__(self):
+        # Карточки по артикулам 1000, 1001... в порядке файлов корпуса
+        self.cards = {str(1000 + index): (name, html) for index, (name, html) in enumerate(load_corpus("product"))}
+        self.hits = collections.Counter()
+        self._lock = threading.Lock()
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self.handler_class())
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def card_url(self, articul, route="catalog"):
+        return f"{self.base_url}/{route}/{articul}/detail.aspx"
+
+    def handler_class(self):
+        stand = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                with stand._lock:
+                    stand.hits[self.path] += 1
+                    hits = stand.hits[self.path]
+                match = re.match(r'^/(catalog|flaky|limited|moved|slow)/(\d+)/detail\.aspx$', self.path)
+                if match:
+                    route, articul = match.groups()
+                    if route == "flaky" and hits <= FLAKY_FAILURES:
+                        return self.reply(503, b"temporarily unavailable")
+                    if route == "slow":
+                        time.sleep(SLOW_SECONDS)
+                    if route == "limited":
+                        return self.reply(429, b"too many requests")
+                    if route == "moved":
+                        self.send_response(302)
+                        self.send_header("Location", "/")
+                        self.end_headers()
+                        return
+                    if articul in stand.cards:
+                        return self.reply(200, stand.cards[articul][1].encode('utf-8'), "text/html; charset=utf-8")
+                match = re.match(r'^/images/(slow/)?([\w.]+)$', self.path)
+                if match and match.group(2) in IMAGES:
+                    if match.group(1):
+                        time.sleep(SLOW_SECONDS)
+                    return self.reply(200, IMAGES[match.group(2)], "image/jpeg")
+                if self.path == "/":
+                    return self.reply(200, "<html><title>Главная</title></html>".encode('utf-8'),
+                                      "text/html; charset=utf-8")
+                self.reply(404, b"not found")
+
+            def reply(self, status, body, content_type="text/plain"):
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def check_http_backend(stand, expected):
+    """Карточки по HTTP: значения как в эталоне, оболочка SPA уходит в Chrome, сбои повторяются"""
+    problems = []
+    scheduler = AdaptiveScheduler(initial_rate=50, max_rate=200, burst=20)
+    parser = ProductParser(backend="http", http_workers=4, start_driver=False, scheduler=scheduler,
+                           selector_registry=SelectorRegistry(), failure_log=FailureLog())
+    try:
+        articuls = list(stand.cards)
+        pages = parser.fetcher.fetch_many([stand.card_url(articul) for articul in articuls])
+        for articul, page in zip(articuls, pages):
+            name = stand.cards[articul][0]
+            url = stand.card_url(articul)
+            record = parser.parse_product_over_http(url, page) if page else None
+            reference = expected.get(name)
+            if parser.needs_browser(reference):
+                # Страница без данных не считается результатом, ее откроет Chrome
+                if record is not None:
+                    problems.append(f"{name}: страница без данных не ушла в браузер")
+                continue
+            if record is None:
+                problems.append(f"{name}: не разобрана по HTTP")
+                continue
+            if record != parser.finish_product(dict(reference), url, source="http"):
+                problems.append(f"{name}: значения по HTTP отличаются от эталона")
+
+        # 503 дважды, затем карточка: повторы сессии должны дойти до ответа
+        flaky_url = stand.card_url(articuls[0], route="flaky")
+        if parser.fetcher.fetch(flaky_url) is None:
+            problems.append("повторы после 503 не дошли до ответа")
+        if stand.hits[f"/flaky/{articuls[0]}/detail.aspx"] != FLAKY_FAILURES + 1:
+            problems.append(f"ожидалось {FLAKY_FAILURES + 1} запроса к /flaky/, "
+                            f"было {stand.hits[f'/flaky/{articuls[0]}/detail.aspx']}")
+
+        # 429 - блокировка: планировщик замедляет хост
+        rate_before = scheduler.stats()[f"127.0.0.1:{stand.server.server_address[1]}"]['rate']
+        if parser.fetcher.fetch(stand.card_url(articuls[0], route="limited")) is not None:
+            problems.append("ответ 429 принят за страницу")
+        stats = scheduler.stats()[f"127.0.0.1:{stand.server.server_address[1]}"]
+        if not stats['blocked'] or stats['rate'] >= rate_before:
+            problems.append("после 429 скорость хоста не снизилась")
+
+        # Редирект с карточки - товара нет, в браузер не отправляем
+        if parser.parse_product_over_http(stand.card_url(articuls[0], route="moved")) is not None:
+            problems.append("редирект с карточки принят за товар")
+    finally:
+        parser.close()
+    return problems
+
+
+def check_images(stand):
+    """Фото: одинаковое содержимое под разными ссылками хранится один раз, повторная загрузка не качает,
+    одновременные загрузки одной ссылки идут одним запросом"""
+    problems = []
+    with tempfile.TemporaryDirectory() as directory:
+        downloader = ImageDownloader(directory, max_workers=3)
+        try:
+            urls = [f"{stand.base_url}/images/{name}" for name in sorted(IMAGES)]
+            paths = downloader.download_many(urls, articul="1000")
+            if None in paths:
+                problems.append("не все картинки скачались")
+            elif paths[0] != paths[1] or paths[0] == paths[2]:
+                problems.append("одинаковые картинки не слились в один файл")
+            downloader.download_many(urls, articul="1000")
+            stats = downloader.stats()
+            if (stats['downloaded'], stats['duplicates'], stats['skipped']) != (2, 1, 3):
+                problems.append(f"картинки: новых {stats['downloaded']}, дубликатов {stats['duplicates']}, "
+                                f"пропущено {stats['skipped']} вместо 2, 1, 3")
+        finally:
+            downloader.close()
+
+    # Одна и та же медленная ссылка из нескольких потоков сразу: качается один раз, остальные ждут
+    with tempfile.TemporaryDirectory() as directory:
+        downloader = ImageDownloader(directory, max_workers=3)
+        try:
+            path = "/images/slow/c.jpg"
+            before = stand.hits[path]
+            paths = downloader.download_many([stand.base_url + path] * 3, articul="1000")
+            stats = downloader.stats()
+            if stand.hits[path] - before != 1 or len(set(paths)) != 1 or None in paths:
+                problems.append(f"одну картинку из {len(paths)} потоков скачали {stand.hits[path] - before} раз")
+            elif (stats['downloaded'], stats['duplicates'], stats['skipped']) != (1, 0, 2):
+                problems.append(f"одновременная загрузка: новых {stats['downloaded']}, дубликатов "
+                                f"{stats['duplicates']}, пропущено {stats['skipped']} вместо 1, 0, 2")
+        finally:
+            downloader.close()
+    return problems
+
+
+def check_recheck(stand, expected):
+    """collect_info --incremental по стенду несколько раз: запуск, встретивший ссылку раньше срока,
+    не продлевает срок, и карточка снова разбирается, когда с ее разбора прошло --recheck-hours"""
+    problems = []
+    parser = ProductParser(backend="http", start_driver=False, selector_registry=SelectorRegistry())
+    try:
+        links = [stand.card_url(articul) for articul, (name, html) in stand.cards.items()
+                 if name in expected and not parser.needs_browser(expected[name])][:2]
+    finally:
+        parser.close()
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "collect_info.py")
+
+    with tempfile.TemporaryDirectory() as directory:
+        with open(os.path.join(directory, "links.json"), 'w', encoding='utf-8') as f:
+            json.dump(links, f)
+
+        def run():
+            subprocess.run([sys.executable, script, "--backend", "http", "--incremental", "--links-file", "links.json",
+                            "--recheck-hours", str(RECHECK_SECONDS / 3600), "--format", "jsonl", "--max-rps", "50"],
+                           cwd=directory, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+
+        def fetched():
+            """Сколько раз запуск запросил каждую карточку"""
+            before = {link: stand.hits[link[len(stand.base_url):]] for link in links}
+            started = time.time()
+            run()
+            return started, [stand.hits[link[len(stand.base_url):]] - before[link] for link in links]
+
+        started, hits = fetched()
+        if hits != [1] * len(links):
+            problems.append(f"первый запуск: запросов карточек {hits} вместо {[1] * len(links)}")
+            return problems
+
+        # Запуск до срока: ссылки снова в списке, но разбирать их рано
+        time.sleep(RECHECK_SECONDS * 0.6)
+        if fetched()[1] != [0] * len(links):
+            problems.append("карточки запрошены повторно раньше --recheck-hours")
+
+        # Срок от разбора прошел, хотя предыдущий запуск видел ссылки совсем недавно
+        time.sleep(max(0.0, started + RECHECK_SECONDS + 1 - time.time()))
+        if fetched()[1] != [1] * len(links):
+            problems.append("карточки не поставлены на повторную проверку через --recheck-hours после разбора")
+    return problems
+
+
+def check_result_order(stand, expected):
+    """collect_info пулами браузеров и процессов разбора: строки каталога в порядке ссылок, а не готовности"""
+    problems = []
+    parser = ProductParser(backend="http", start_driver=False, selector_registry=SelectorRegistry())
+    try:
+        articuls = [articul for articul, (name, html) in stand.cards.items()
+                    if name in expected and not parser.needs_browser(expected[name])]
+    finally:
+        parser.close()
+    # Медленные ответы в начале списка: без перестановки их строки оказались бы в конце
+    links = [stand.card_url(articul, route="slow" if position % 2 == 0 else "catalog")
+             for position, articul in enumerate(articuls)]
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "collect_info.py")
+
+    for pool_options in (["--workers", "2"], ["--workers", "2", "--parse-processes", "2"]):
+        with tempfile.TemporaryDirectory() as directory:
+            with open(os.path.join(directory, "links.json"), 'w', encoding='utf-8') as f:
+                json.dump(links, f)
+            subprocess.run([sys.executable, script, "--backend", "http", "--links-file", "links.json",
+                            "--format", "jsonl", "--max-rps", "50"] + pool_options,
+                           cwd=directory, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+            with open(os.path.join(directory, "wildberries_catalog.jsonl"), 'r', encoding='utf-8') as f:
+                urls = [json.loads(line)['url'] for line in f if line.strip()]
+            if urls != links:
+                problems.append(f"{' '.join(pool_options)}: порядок строк каталога не совпадает со ссылками")
+    return problems
+
+
+class WatchedBroker(QueueBroker):
+    """Брокер стенда: запоминает процессы, бравшие задачи"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.leasing_processes = set()
+
+    def call(self, method, params):
+        if method == 'lease':
+            # worker_id - хост-процесс-номер
+            self.leasing_processes.add(params['worker_id'].rsplit("-", 1)[0])
+        return super().call(method, params)
+
+
+def check_distributed(stand, expected):
+    """Координатор и два процесса-воркера distributed.py работают с одной очередью через брокер по HTTP"""
+    problems = []
+    parser = ProductParser(backend="http", start_driver=False, selector_registry=SelectorRegistry())
+    try:
+        links = [stand.card_url(articul) for articul, (name, html) in stand.cards.items()
+                 if name in expected and not parser.needs_browser(expected[name])]
+    finally:
+        parser.close()
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "distributed.py")
+
+    with tempfile.TemporaryDirectory() as directory:
+        work_queue = SqliteWorkQueue(os.path.join(directory, "work_queue.sqlite"))
+        broker = WatchedBroker(work_queue, host="127.0.0.1", port=0, token="stand").start()
+        try:
+            common = ["--queue", broker.address, "--token", "stand"]
+            with open(os.path.join(directory, "links.json"), 'w', encoding='utf-8') as f:
+                json.dump(links, f)
+            subprocess.run([sys.executable, script, "coordinator", "--links-file", "links.json"] + common,
+                           cwd=directory, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+            workers = [subprocess.Popen([sys.executable, script, "worker", "--backend", "http", "--batch-size", "1"]
+                                        + common, cwd=directory, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+                       for _ in range(2)]
+            for worker in workers:
+                if worker.wait(timeout=120):
+                    problems.append(f"воркер завершился с кодом {worker.returncode}")
+
+            counts = work_queue.counts()
+            if counts[DONE] != len(links):
+                problems.append(f"через брокер готово {counts[DONE]} из {len(links)} ссылок: {counts}")
+            if len(broker.leasing_processes) != 2:
+                problems.append(f"задачи брали {len(broker.leasing_processes)} процесса вместо 2")
+            names = sorted(record.name for record in work_queue.iter_results())
+            if names != sorted(expected[stand.cards[link.split("/")[-2]][0]]['name'] for link in links):
+                problems.append("результаты воркеров отличаются от эталона")
+        finally:
+            broker.close()
+            work_queue.close()
+    return problems
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Проверка HTTP бэкенда и загрузки фото на локальном стенде")
+    arg_parser.parse_args()
+
+    with open(EXPECTED_FILE, 'r', encoding='utf-8') as f:
+        expected = json.load(f)['product']
+
+    with StandIn() as stand:
+        problems = (check_http_backend(stand, expected) + check_images(stand) + check_recheck(stand, expected)
+                    + check_result_order(stand, expected) + check_distributed(stand, expected))
+
+    if problems:
+        print("Стенд: есть ошибки")
+        for problem in problems:
+            print(f"  - {problem}")
+        sys.exit(1)
+    print("Стенд: HTTP бэкенд, загрузка фото, повторная проверка, порядок результатов и очередь через брокер работают")
@@ -0,0 +1,136 @@
+from collect_info import ProductParser
+from rate_limit import get_shared_scheduler
+from metrics import get_metrics
+import threading
+import queue
+import logging
+
+
+logger = logging.getLogger(__name__)
+metrics = get_metrics()
+
+
+class OrderedResults:
+    """Буфер перестановки: результаты приходят в порядке готовности, а on_result получает их в порядке
+    исходного списка - только следующий индекс без пропусков, чтобы экспорт и состояние шли как ссылки"""
+
+    def __init__(self, links, on_result=None):
+        self.links = links
+        self.on_result = on_result
+        self.results = [None] * len(links)
+        self.done = threading.Event()
+        self._ready = set()
+        self._next = 0
+        self._lock = threading.Lock()
+        if not links:
+            self.done.set()
+
+    def put(self, index, product_data):
+        """Результат ссылки index; отдаем в on_result все готовые подряд, начиная с ожидаемой"""
+        with self._lock:
+            if index in self._ready or index < self._next:
+                return
+            self.results[index] = product_data
+            self._ready.add(index)
+            # Под блокировкой, иначе два потока могли бы отдать соседние ссылки в обратном порядке
+            while self._next in self._ready:
+                self._ready.discard(self._next)
+                self.deliver(self.links[self._next], self.results[self._next])
+                self._next += 1
+            if self._next == len(self.links):
+                self.done.set()
+
+    def deliver(self, link, product_data):
+        if not self.on_result:
+            return
+        try:
+            self.on_result(link, product_data)
+        except Exception as e:
+            logger.warning(f"Ошибка при обработке результата {link}: {e}")
+
+    def waiting(self):
+        """Сколько готовых результатов ждут более ранние ссылки"""
+        with self._lock:
+            return len(self._ready)
+
+
+class ParserPool:
+    """Пул независимых браузеров, разбирающих общую очередь ссылок"""
+
+    def __init__(self, workers=4, scheduler=None, parser_factory=None, **parser_options):
+        self.workers = workers
+        # Общий планировщик на все браузеры, чтобы не упереться в блокировку
+        self.scheduler = scheduler or get_shared_scheduler()
+        self.parser_factory = parser_factory or (
+            lambda: ProductParser(scheduler=self.scheduler, **parser_options)
+        )
+        self.failures = {}
+        self._results_lock = threading.Lock()
+
+    def run(self, links, on_result=None):
+        """Парсим ссылки всеми воркерами, результат в порядке исходного списка"""
+        tasks = queue.Queue()
+        for index, link in enumerate(links):
+            tasks.put((index, link))
+
+        results = OrderedResults(links, on_result)
+        self.failures = {}
+
+        threads = [
+            threading.Thread(target=self.worker_loop, args=(worker_id, tasks, results), daemon=True)
+            for worker_id in range(min(self.workers, len(links)))
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        logger.info(f"Пул завершил работу: успешно {sum(1 for r in results.results if r)}, "
+                    f"ошибок {len(self.failures)}")
+        return results.results
+
+    def worker_loop(self, worker_id, tasks, results):
+        """Цикл одного воркера со своим браузером; results - OrderedResults"""
+        parser = None
+        try:
+            while True:
+                try:
+                    index, link = tasks.get_nowait()
+                except queue.Empty:
+                    break
+
+                try:
+                    if parser is None:
+                        parser = self.parser_factory()
+
+                    logger.debug(f"[воркер {worker_id}] товар {index + 1}: {link}")
+                    product_data = parser.parse_product_from_link(link)
+                except Exception as e:
+                    # Падение браузера не должно останавливать остальные воркеры
+                    self.record_failure(index, link, str(e))
+                    results.put(index, None)
+                    logger.warning(f"[воркер {worker_id}] ошибка, перезапускаем браузер: {e}")
+                    metrics.inc("worker_restarts")
+                    self.close_parser(parser)
+                    parser = None
+                    continue
+
+                if not product_data:
+                    self.record_failure(index, link, "нет данных")
+                results.put(index, product_data)
+        finally:
+            self.close_parser(parser)
+
+    def record_failure(self, index, link, reason):
+        """Запоминаем ошибку по ссылке"""
+        with self._results_lock:
+            self.failures[index] = {'url': link, 'error': reason}
+
+    def close_parser(self, parser):
+        """Закрытие браузера воркера"""
+        if parser is None:
+            return
+        try:
+            parser.close()
+        except Exception as e:
+            logger.warning(f"Ошибка при закрытии браузера: {e}")